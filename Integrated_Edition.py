@@ -25,9 +25,16 @@ import platform
 import subprocess
 import requests
 from datetime import datetime
-from typing import Optional, Dict, Any, Callable, List
-from concurrent.futures import ThreadPoolExecutor
-from collections import deque
+from typing import Optional, Dict, Any, Callable, List, Tuple
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from collections import deque, OrderedDict
+from itertools import zip_longest
+import ipaddress
+import statistics
+import math
+import weakref
+import itertools
+import ssl
 import queue
 import logging
 from pathlib import Path
@@ -35,11 +42,22 @@ import hashlib
 import base64
 import random
 import webbrowser
+import asyncio
+import mmap
+from contextlib import contextmanager
 
 # Import networking libraries
 try:
     import paramiko
     import dns.resolver
+    import dns.message
+    import dns.query
+    import dns.rcode
+    import dns.flags
+    import dns.rdata
+    import dns.rdataclass
+    import dns.rdatatype
+    import dns.exception
     from cryptography.fernet import Fernet
     import psutil
 except ImportError:
@@ -51,6 +69,24 @@ except ImportError:
     input("Press Enter to exit...")
     sys.exit(1)
 
+# Optional: faster event loop for the asyncio proxy engine
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# Optional: HTTP/2 for DNS-over-HTTPS (needs httpx[http2])
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Optional: cross-process locking for the persistent DNS store (POSIX only)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 # ================= CONFIGURATION =================
 ctk.set_appearance_mode("Dark")
 ctk.set_default_color_theme("dark-blue")
@@ -58,6 +94,15 @@ ctk.set_default_color_theme("dark-blue")
 CONFIG_FILE = "config_ultimate.json"
 LOG_FILE = "ssh_tunnel_ultimate.log"
 ENCRYPTION_KEY_FILE = ".key_ultimate"
+DNS_CACHE_FILE = "dns_cache_ultimate.bin"
+NETWORK_PROFILE_FILE = "network_profiles_ultimate.json"
+
+# Linux Multipath TCP (kernel 5.6+); the socket module only names IPPROTO_MPTCP from Python 3.10
+IPPROTO_MPTCP = getattr(socket, "IPPROTO_MPTCP", 262)
+SOL_MPTCP = 284
+MPTCP_INFO = 1
+MPTCP_TCPINFO = 2
+MPTCP_SUBFLOW_ADDRS = 3
 
 DEFAULT_CONFIG = {
     "servers": {},
@@ -65,7 +110,9 @@ DEFAULT_CONFIG = {
         "Shecan": {"primary": "178.22.122.100", "secondary": "185.51.200.2"},
         "Google": {"primary": "8.8.8.8", "secondary": "8.8.4.4"},
         "Cloudflare": {"primary": "1.1.1.1", "secondary": "1.0.0.1"},
-        "OpenDNS": {"primary": "208.67.222.222", "secondary": "208.67.220.220"}
+        "OpenDNS": {"primary": "208.67.222.222", "secondary": "208.67.220.220"},
+        "Cloudflare DoT": {"primary": "1.1.1.1", "secondary": "1.0.0.1", "protocol": "dot", "url": "cloudflare-dns.com"},
+        "Cloudflare DoH": {"primary": "1.1.1.1", "secondary": "1.0.0.1", "protocol": "doh", "url": "https://cloudflare-dns.com/dns-query"}
     },
     "settings": {
         "local_port": "1080",
@@ -74,6 +121,8 @@ DEFAULT_CONFIG = {
         "log_traffic": False,
         "theme": "dark-blue",
         "wan_bonding_enabled": False,
+        "wan_bonding_per_channel": True,
+        "mptcp_enabled": False,
         "load_balancing_mode": "round_robin",
         "max_threads": 100,
         "auto_reset_interval": 60,
@@ -84,7 +133,26 @@ DEFAULT_CONFIG = {
         "reconnect_initial_delay": 5,
         "dns_fallback_enabled": True,
         "dns_fallback_list": ["8.8.8.8", "1.1.1.1", "9.9.9.9"],
-        "dns_timeout": 5
+        "dns_timeout": 5,
+        "proxy_engine": "thread",
+        "relay_high_watermark": 262144,
+        "relay_low_watermark": 65536,
+        "socks_fast_open": False,
+        "warm_channel_pool": False,
+        "warm_pool_max_channels": 32,
+        "dns_persistent_cache": True,
+        "dns_custom_servers": [],
+        "dns_live_ranking": True,
+        "dns_stub_enabled": False,
+        "dns_stub_port": 5300,
+        "dns_stub_upstream": "1.1.1.1",
+        "network_profile_cache": True,
+        "interface_probe_target": "",
+        "ssh_transports_min": 1,
+        "ssh_transports_max": 1,
+        "ssh_channels_per_transport": 16,
+        "channel_scheduler": "p2c",
+        "channel_sticky": True
     }
 }
 
@@ -114,23 +182,52 @@ class DNSTester:
         'Shecan Secondary': '185.51.200.2'
     }
     
-    def __init__(self, target_host: str = "google.com", test_rounds: int = 3):
+    def __init__(self, target_host: str = "google.com", test_rounds: int = 3,
+                 servers: Optional[Dict[str, str]] = None):
         self.target_host = target_host
         self.test_rounds = test_rounds
+        self.servers = dict(self.DNS_SERVERS)
+        if servers:
+            self.servers.update(servers)
         self.best_dns = None
         self.best_response_time = float('inf')
         self.results = {}
     
+    @staticmethod
+    def parse_server_list(entries) -> Dict[str, str]:
+        """Parse user resolvers given as 'ip' or 'name=ip' (lines or a list)."""
+        if isinstance(entries, str):
+            entries = entries.splitlines()
+        servers = {}
+        for entry in entries:
+            entry = entry.strip()
+            if not entry or entry.startswith('#'):
+                continue
+            name, _, ip = entry.rpartition('=')
+            ip = ip.strip()
+            try:
+                ipaddress.ip_address(ip)
+            except ValueError:
+                logger.warning(f"Ignoring invalid DNS server entry: {entry}")
+                continue
+            servers[name.strip() or ip] = ip
+        return servers
+    
     def test_dns_server(self, dns_ip: str, timeout: int = 3) -> Optional[float]:
         """Test DNS server speed"""
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            family = socket.AF_INET6 if ':' in dns_ip else socket.AF_INET
+            sock = socket.socket(family, socket.SOCK_DGRAM)
             sock.settimeout(timeout)
-            query = self._build_dns_query(self.target_host)
+            transaction_id = random.getrandbits(16)
+            query = self._build_dns_query(self.target_host, transaction_id)
             
             start_time = time.time()
             sock.sendto(query, (dns_ip, 53))
-            data, _ = sock.recvfrom(512)
+            while True:
+                data, _ = sock.recvfrom(512)
+                if len(data) >= 2 and struct.unpack('!H', data[:2])[0] == transaction_id:
+                    break
             response_time = (time.time() - start_time) * 1000
             
             sock.close()
@@ -143,9 +240,10 @@ class DNSTester:
             logger.debug(f"DNS test failed for {dns_ip}: {e}")
             return None
     
-    def _build_dns_query(self, hostname: str) -> bytes:
+    def _build_dns_query(self, hostname: str, transaction_id: Optional[int] = None) -> bytes:
         """Build DNS query"""
-        transaction_id = b'\xaa\xbb'
+        if transaction_id is None:
+            transaction_id = random.getrandbits(16)
         flags = b'\x01\x00'
         questions = b'\x00\x01'
         answer_rrs = b'\x00\x00'
@@ -159,62 +257,498 @@ class DNSTester:
         question += b'\x00\x01'
         question += b'\x00\x01'
         
-        return transaction_id + flags + questions + answer_rrs + authority_rrs + additional_rrs + question
+        return struct.pack('!H', transaction_id) + flags + questions + answer_rrs + authority_rrs + additional_rrs + question
 
-    def find_best_dns(self) -> Dict[str, Any]:
+    def probe_all(self, timeout: float = 2.0) -> Dict[str, List[float]]:
+        """Send every round to every server at once and collect response times.
+        
+        One non-blocking UDP socket per address family; replies are matched by
+        transaction id and source address, so wall time is about one timeout.
+        """
+        servers = list(self.servers.items())
+        rounds = max(1, self.test_rounds)
+        samples: Dict[str, List[float]] = {name: [] for name, _ in servers}
+        if not servers:
+            return samples
+        
+        sockets: Dict[int, socket.socket] = {}
+        for family in {socket.AF_INET6 if ':' in ip else socket.AF_INET for _, ip in servers}:
+            try:
+                sock = socket.socket(family, socket.SOCK_DGRAM)
+                sock.setblocking(False)
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+                except OSError:
+                    pass
+                sockets[family] = sock
+            except OSError as e:
+                logger.debug(f"DNS probe socket for family {family} unavailable: {e}")
+        
+        # Unique ids across the whole batch; round-major so each round spans every server
+        total = len(servers) * rounds
+        ids = random.sample(range(65536), total) if total <= 65536 else [random.getrandbits(16) for _ in range(total)]
+        outbox = deque()
+        for round_index in range(rounds):
+            for server_index, (name, ip) in enumerate(servers):
+                outbox.append((name, ip, ids[round_index * len(servers) + server_index]))
+        
+        inflight: Dict[int, Tuple[str, Any, float]] = {}
+        last_send = time.time()
+        try:
+            while outbox or inflight:
+                while outbox:
+                    name, ip, transaction_id = outbox[0]
+                    sock = sockets.get(socket.AF_INET6 if ':' in ip else socket.AF_INET)
+                    if sock is None:
+                        outbox.popleft()
+                        continue
+                    try:
+                        sock.sendto(self._build_dns_query(self.target_host, transaction_id), (ip, 53))
+                    except BlockingIOError:
+                        break
+                    except OSError as e:
+                        logger.debug(f"DNS probe to {ip} failed: {e}")
+                        outbox.popleft()
+                        continue
+                    outbox.popleft()
+                    last_send = time.time()
+                    inflight[transaction_id] = (name, ipaddress.ip_address(ip), last_send)
+                
+                remaining = last_send + timeout - time.time()
+                if remaining <= 0 or not (outbox or inflight):
+                    break
+                wait_time = min(remaining, 0.01) if outbox else remaining
+                readable, _, _ = select.select(list(sockets.values()), [], [], wait_time)
+                
+                for sock in readable:
+                    while True:
+                        try:
+                            data, source = sock.recvfrom(4096)
+                        except (BlockingIOError, InterruptedError):
+                            break
+                        except OSError:
+                            break  # e.g. ICMP port unreachable surfaced on Windows
+                        received = time.time()
+                        if len(data) <= 12:
+                            continue
+                        transaction_id = struct.unpack('!H', data[:2])[0]
+                        entry = inflight.get(transaction_id)
+                        if not entry:
+                            continue
+                        name, expected_ip, sent_at = entry
+                        try:
+                            source_ip = ipaddress.ip_address(source[0].split('%')[0])
+                        except ValueError:
+                            continue
+                        if source_ip != expected_ip:
+                            continue
+                        del inflight[transaction_id]
+                        if data[2] & 0x80 and data[3] & 0x0F == 0:
+                            samples[name].append((received - sent_at) * 1000)
+        finally:
+            for sock in sockets.values():
+                sock.close()
+        return samples
+
+    @staticmethod
+    def summarize(samples: List[float], rounds: int) -> Dict[str, float]:
+        """Median, p90, mean and jitter (stdev) of one server's response times."""
+        ordered = sorted(samples)
+        return {
+            "avg_time": sum(ordered) / len(ordered),
+            "median": statistics.median(ordered),
+            "p90": ordered[min(len(ordered) - 1, int(round(0.9 * (len(ordered) - 1))))],
+            "jitter": statistics.pstdev(ordered) if len(ordered) > 1 else 0.0,
+            "success_rate": len(ordered) / rounds * 100
+        }
+
+    @staticmethod
+    def udp_exchange(wire: bytes, address: str, port: int = 53, timeout: float = 2.0) -> bytes:
+        """Plain UDP query/response, usable as a benchmark backend."""
+        family = socket.AF_INET6 if ':' in address else socket.AF_INET
+        with socket.socket(family, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(timeout)
+            sock.sendto(wire, (address, port))
+            while True:
+                data, _ = sock.recvfrom(4096)
+                if data[:2] == wire[:2]:
+                    return data
+
+    def benchmark_backends(self, backends: Dict[str, Callable[[bytes], bytes]],
+                           queries: int = 200, concurrency: int = 16) -> Dict[str, Dict[str, float]]:
+        """Push the same concurrent query load through each backend (wire in, wire out)."""
+        results = {}
+        for name, exchange in backends.items():
+            def timed(_):
+                wire = self._build_dns_query(self.target_host)
+                start_time = time.time()
+                try:
+                    response = exchange(wire)
+                except Exception as e:
+                    logger.debug(f"Benchmark query via {name} failed: {e}")
+                    return None
+                if response[:2] != wire[:2]:
+                    return None
+                return (time.time() - start_time) * 1000
+            
+            wall_start = time.time()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                times = [t for t in executor.map(timed, range(queries)) if t is not None]
+            wall_ms = (time.time() - wall_start) * 1000
+            
+            summary = self.summarize(times, queries) if times else {"success_rate": 0.0}
+            summary["wall_ms"] = wall_ms
+            summary["qps"] = len(times) / (wall_ms / 1000) if wall_ms else 0.0
+            results[name] = summary
+        return results
+
+    def find_best_dns(self, timeout: float = 2.0) -> Dict[str, Any]:
         """Find the best DNS server with reliability check."""
-        logger.info("Starting DNS servers testing...")
+        logger.info(f"Starting DNS servers testing ({len(self.servers)} servers)...")
         
         self.results = {}
         working_servers = {}
+        rounds = max(1, self.test_rounds)
         
-        for name, dns_ip in self.DNS_SERVERS.items():
-            total_time = 0
-            successful_tests = 0
-            
-            for _ in range(self.test_rounds):
-                response_time = self.test_dns_server(dns_ip, timeout=2)
-                if response_time is not None:
-                    if response_time < 5000:
-                        total_time += response_time
-                        successful_tests += 1
-            
-            if successful_tests > 0:
-                avg_time = total_time / successful_tests
-                success_rate = (successful_tests / self.test_rounds) * 100
+        start_time = time.time()
+        all_samples = self.probe_all(timeout)
+        
+        for name, samples in all_samples.items():
+            if samples:
+                summary = self.summarize(samples, rounds)
                 
                 # فقط سرورهایی با موفقیت بیش از 50٪
-                if success_rate >= 50:
-                    self.results[name] = {
-                        "ip": dns_ip,
-                        "avg_time": avg_time,
-                        "success_rate": success_rate
-                    }
-                    working_servers[name] = avg_time
-                    logger.info(f"  ✓ {name}: {avg_time:.2f}ms ({success_rate:.0f}%)")
+                if summary["success_rate"] >= 50:
+                    self.results[name] = {"ip": self.servers[name], **summary}
+                    working_servers[name] = summary["median"]
+                    logger.info(f"  ✓ {name}: median {summary['median']:.2f}ms, p90 {summary['p90']:.2f}ms, "
+                                f"jitter {summary['jitter']:.2f}ms ({summary['success_rate']:.0f}%)")
                 else:
-                    logger.info(f"  ✗ {name}: Failed ({success_rate:.0f}% success)")
+                    logger.info(f"  ✗ {name}: Failed ({summary['success_rate']:.0f}% success)")
             else:
                 logger.info(f"  ✗ {name}: No response")
         
+        logger.info(f"DNS test finished in {(time.time() - start_time) * 1000:.0f}ms")
+        
         if not working_servers:
             logger.warning("⚠️ No reliable DNS servers found! Using default.")
-            return {"name": "Default", "ip": "8.8.8.8", "avg_time": 0}
+            return {"name": "Default", "ip": "8.8.8.8", "avg_time": 0, "median": 0, "p90": 0, "jitter": 0}
         
-        # انتخاب بهترین بر اساس میانگین زمان
+        # انتخاب بهترین بر اساس میانه زمان پاسخ
         best_name = min(working_servers.items(), key=lambda x: x[1])[0]
         best_result = self.results[best_name]
         
-        logger.info(f"✅ Best DNS: {best_name} ({best_result['ip']}) - {best_result['avg_time']:.2f}ms")
+        logger.info(f"✅ Best DNS: {best_name} ({best_result['ip']}) - {best_result['median']:.2f}ms")
         
         return {
             "name": best_name,
             "ip": best_result["ip"],
             "avg_time": best_result["avg_time"],
+            "median": best_result["median"],
+            "p90": best_result["p90"],
+            "jitter": best_result["jitter"],
             "success_rate": best_result["success_rate"],
-            "all_results": self.results
+            "all_results": dict(sorted(self.results.items(), key=lambda item: item[1]["median"]))
         }
 
+# ================= RESOLVER RANKER =================
+class ResolverRanker:
+    """Ranks nameservers from live lookups plus sparse probes and switches the resolver to the best."""
+    
+    def __init__(self, resolver: 'dns.resolver.Resolver', tester: DNSTester,
+                 probe_interval=30, alpha=0.2, switch_margin=0.2, switch_rounds=3, min_samples=3,
+                 on_switch: Optional[Callable[[str, str], None]] = None):
+        self.resolver = resolver
+        self.tester = tester
+        self.probe_interval = probe_interval
+        self.alpha = alpha
+        self.switch_margin = switch_margin
+        self.switch_rounds = switch_rounds
+        self.min_samples = min_samples
+        self.on_switch = on_switch
+        # ip -> [ewma_ms, ewma_failure_rate, samples]
+        self.stats: Dict[str, list] = {}
+        self.names: Dict[str, str] = {}
+        self.challenger = None
+        self.challenger_streak = 0
+        self.switches = 0
+        self._lock = threading.Lock()
+        self.is_running = False
+        self.ranker_thread = None
+        self._stop_event = threading.Event()
+    
+    def record(self, nameserver: str, latency_ms: Optional[float]):
+        """Record one answered (latency) or failed (None) query against a nameserver."""
+        with self._lock:
+            entry = self.stats.get(nameserver)
+            if entry is None:
+                entry = self.stats[nameserver] = [None, 0.0, 0]
+            failed = 1.0 if latency_ms is None else 0.0
+            entry[1] += self.alpha * (failed - entry[1])
+            if latency_ms is not None:
+                entry[0] = latency_ms if entry[0] is None else entry[0] + self.alpha * (latency_ms - entry[0])
+            entry[2] += 1
+    
+    def _score(self, entry: list) -> float:
+        if entry[0] is None or entry[2] < self.min_samples:
+            return float('inf')
+        # Each 10% of failures costs as much as 40% extra latency
+        return entry[0] * (1 + 4 * entry[1])
+    
+    def get_ranking(self) -> List[Dict[str, Any]]:
+        """Nameservers ordered best first, with their live statistics."""
+        current = self.resolver.nameservers[0] if self.resolver.nameservers else None
+        with self._lock:
+            ranking = [{
+                "ip": ip,
+                "name": self.names.get(ip, ip),
+                "latency_ms": entry[0],
+                "failure_rate": entry[1] * 100,
+                "samples": entry[2],
+                "score": self._score(entry),
+                "active": ip == current
+            } for ip, entry in self.stats.items()]
+        return sorted(ranking, key=lambda item: item["score"])
+    
+    def start(self):
+        """Start background probing and re-ranking."""
+        if self.is_running:
+            return
+        self.is_running = True
+        self._stop_event.clear()
+        self.ranker_thread = threading.Thread(target=self._rank_loop, daemon=True, name="DNSRanker")
+        self.ranker_thread.start()
+    
+    def stop(self):
+        """Stop background ranking."""
+        self.is_running = False
+        self._stop_event.set()
+        if self.ranker_thread:
+            self.ranker_thread.join(timeout=3)
+    
+    def _probe(self):
+        """One round to every candidate; cheap because all queries are in flight together."""
+        servers = dict(self.tester.servers)
+        known = set(servers.values())
+        for ip in self.resolver.nameservers:
+            if ip not in known:
+                servers[ip] = ip
+        
+        prober = DNSTester(self.tester.target_host, test_rounds=1)
+        prober.servers = servers
+        samples = prober.probe_all(timeout=2.0)
+        
+        with self._lock:
+            self.names.update({ip: name for name, ip in servers.items()})
+        for name, times in samples.items():
+            self.record(servers[name], times[0] if times else None)
+    
+    def evaluate(self):
+        """Switch the live resolver if one candidate has stayed clearly ahead."""
+        nameservers = list(self.resolver.nameservers)
+        if not nameservers:
+            return
+        current = nameservers[0]
+        with self._lock:
+            scores = {ip: self._score(entry) for ip, entry in self.stats.items()}
+        if not scores:
+            return
+        best = min(scores, key=scores.get)
+        current_score = scores.get(current, float('inf'))
+        
+        # Hysteresis: a margin plus several consecutive wins before switching
+        if best == current or scores[best] >= current_score * (1 - self.switch_margin):
+            self.challenger, self.challenger_streak = None, 0
+            return
+        if best != self.challenger:
+            self.challenger, self.challenger_streak = best, 0
+        self.challenger_streak += 1
+        if self.challenger_streak < self.switch_rounds:
+            return
+        
+        # Rebind the list in one assignment; in-flight queries keep the old one
+        self.resolver.nameservers = [best] + [ip for ip in nameservers if ip != best][:1]
+        self.switches += 1
+        self.challenger, self.challenger_streak = None, 0
+        logger.info(f"DNS switched {current} -> {best} (score {current_score:.1f} -> {scores[best]:.1f})")
+        if self.on_switch:
+            self.on_switch(self.names.get(best, best), best)
+    
+    def _rank_loop(self):
+        """Probe and evaluate loop."""
+        while self.is_running:
+            try:
+                self._probe()
+                self.evaluate()
+            except Exception as e:
+                logger.debug(f"Resolver ranking error: {e}")
+            # Sparse probes, jittered so several proxies don't probe in lockstep
+            self._stop_event.wait(self.probe_interval * random.uniform(0.8, 1.2))
+
+# ================= HEDGED RESOLVER =================
+def answer_from_response(query: 'dns.message.Message', response: 'dns.message.Message', nameserver: str):
+    """Turn a raw response into a dns.resolver.Answer, raising NXDOMAIN/NoAnswer like Resolver.resolve."""
+    name = query.question[0].name
+    if response.rcode() == dns.rcode.NXDOMAIN:
+        raise dns.resolver.NXDOMAIN(qnames=[name], responses={name: response})
+    if response.rcode() != dns.rcode.NOERROR:
+        raise dns.resolver.NoNameservers(
+            request=query, errors=[(nameserver, False, 53, dns.rcode.to_text(response.rcode()), response)])
+    answer = dns.resolver.Answer(name, query.question[0].rdtype, dns.rdataclass.IN, response, nameserver=nameserver)
+    if answer.rrset is None:
+        raise dns.resolver.NoAnswer(response=response)
+    return answer
+
+class HedgedResolver:
+    """Queries the best nameserver first and hedges to the next one after its observed p90."""
+    
+    def __init__(self, resolver: 'dns.resolver.Resolver', fallback: Optional[List[str]] = None,
+                 ranker: Optional[ResolverRanker] = None, timeout=5.0, default_delay=0.25,
+                 min_delay=0.02, dead_after=3, dead_backoff=5.0, max_dead_backoff=120.0):
+        self.resolver = resolver
+        self.fallback = list(fallback or [])
+        self.ranker = ranker
+        self.timeout = timeout
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.dead_after = dead_after
+        self.dead_backoff = dead_backoff
+        self.max_dead_backoff = max_dead_backoff
+        # ip -> {"latencies": deque, "failures": consecutive, "dead_until": ts, "backoff": s}
+        self.health: Dict[str, Dict[str, Any]] = {}
+        self.queries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="DNSHedge")
+    
+    def _entry(self, nameserver: str) -> Dict[str, Any]:
+        entry = self.health.get(nameserver)
+        if entry is None:
+            entry = self.health[nameserver] = {
+                "latencies": deque(maxlen=64), "failures": 0, "dead_until": 0.0, "backoff": self.dead_backoff
+            }
+        return entry
+    
+    def candidates(self) -> List[str]:
+        """Nameservers to try, best first, with resolvers currently marked dead left out."""
+        ordered = list(dict.fromkeys(list(self.resolver.nameservers) + self.fallback))
+        now = time.time()
+        with self._lock:
+            alive = [ip for ip in ordered if self._entry(ip)["dead_until"] <= now]
+            if not self.ranker:
+                # Without a live ranker, servers with enough history go first, fastest median first
+                def median_latency(ip):
+                    latencies = self.health[ip]["latencies"]
+                    return statistics.median(latencies) if len(latencies) >= 3 else float('inf')
+                alive.sort(key=median_latency)
+        return alive
+    
+    def hedge_delay(self, nameserver: str) -> float:
+        """How long to wait on a nameserver before also asking the next one: its p90 latency."""
+        with self._lock:
+            latencies = sorted(self._entry(nameserver)["latencies"])
+        if len(latencies) < 5:
+            return self.default_delay
+        p90 = latencies[min(len(latencies) - 1, int(round(0.9 * (len(latencies) - 1))))]
+        return min(max(p90 / 1000, self.min_delay), self.timeout)
+    
+    def _record(self, nameserver: str, latency_ms: Optional[float]):
+        with self._lock:
+            entry = self._entry(nameserver)
+            if latency_ms is not None:
+                entry["latencies"].append(latency_ms)
+                entry["failures"] = 0
+                entry["backoff"] = self.dead_backoff
+            else:
+                entry["failures"] += 1
+                if entry["failures"] >= self.dead_after:
+                    # Skip it for a while; the back-off doubles each time it fails again once revived
+                    entry["dead_until"] = time.time() + entry["backoff"]
+                    entry["backoff"] = min(entry["backoff"] * 2, self.max_dead_backoff)
+                    if entry["failures"] == self.dead_after:
+                        logger.warning(f"DNS {nameserver} marked dead for {entry['dead_until'] - time.time():.0f}s")
+        if self.ranker:
+            self.ranker.record(nameserver, latency_ms)
+    
+    def _query(self, query: 'dns.message.Message', nameserver: str, deadline: float):
+        """One attempt against one nameserver; returns an Answer or raises."""
+        start_time = time.time()
+        try:
+            response, _ = dns.query.udp_with_fallback(query, nameserver, timeout=max(deadline - start_time, 0.01))
+            answer = answer_from_response(query, response, nameserver)
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+            # A definitive negative still means the server is healthy
+            self._record(nameserver, (time.time() - start_time) * 1000)
+            raise
+        except Exception:
+            self._record(nameserver, None)
+            raise
+        self._record(nameserver, (time.time() - start_time) * 1000)
+        return answer
+    
+    def resolve(self, qname: str, rdtype='A'):
+        """Resolve like dns.resolver.Resolver.resolve; first valid answer from any hedge wins."""
+        candidates = self.candidates()
+        if not candidates:
+            raise dns.resolver.NoNameservers()
+        query = dns.message.make_query(qname, rdtype)
+        deadline = time.time() + self.timeout
+        with self._lock:
+            self.queries += 1
+        
+        in_flight: Dict[Future, int] = {}
+        # Last definitive failure (e.g. SERVFAIL); timeouts alone end in LifetimeTimeout
+        last_error: Optional[Exception] = None
+        next_index = 0
+        while time.time() < deadline:
+            if next_index < len(candidates):
+                nameserver = candidates[next_index]
+                in_flight[self.executor.submit(self._query, query, nameserver, deadline)] = next_index
+                if next_index > 0:
+                    with self._lock:
+                        self.hedges += 1
+                next_index += 1
+                wait_for = min(self.hedge_delay(nameserver), deadline - time.time())
+            elif in_flight:
+                wait_for = deadline - time.time()
+            else:
+                break
+            
+            done, _ = wait(list(in_flight), timeout=max(wait_for, 0), return_when=FIRST_COMPLETED)
+            for future in done:
+                index = in_flight.pop(future)
+                try:
+                    answer = future.result()
+                except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+                    raise
+                except Exception as e:
+                    # Failed outright: fall through to the next candidate without waiting out the delay
+                    if not isinstance(e, dns.exception.Timeout):
+                        last_error = e
+                    continue
+                if index > 0:
+                    with self._lock:
+                        self.hedge_wins += 1
+                return answer
+        
+        if last_error is None:
+            raise dns.resolver.LifetimeTimeout(timeout=self.timeout, errors=[])
+        raise last_error
+    
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            return {
+                "queries": self.queries,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "dead": [ip for ip, entry in self.health.items() if entry["dead_until"] > now]
+            }
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
 # ================= ENCRYPTION UTILITIES =================
 class EncryptionManager:
     """Handles encryption/decryption of sensitive data like passwords."""
@@ -247,33 +781,884 @@ class EncryptionManager:
 
 # ================= DNS CACHE =================
 class DNSCache:
-    """Thread-safe DNS cache to avoid blocking DNS lookups."""
+    """Sharded LRU DNS cache honouring record TTLs, with negative caching and serve-stale."""
+    
+    SHARDS = 16
     
-    def __init__(self, ttl=300):
-        self.cache = {}
+    # Lookup states
+    MISS = "miss"
+    FRESH = "fresh"
+    PREFETCH = "prefetch"   # fresh, but popular and close to expiry
+    STALE = "stale"         # expired, still served while a refresh runs
+    NEGATIVE = "negative"   # cached NXDOMAIN / no A records
+    
+    def __init__(self, ttl=300, max_entries=4096, min_ttl=30, max_ttl=3600,
+                 negative_ttl=30, stale_ttl=300, prefetch_window=10, prefetch_hits=3,
+                 store: Optional['PersistentDNSStore'] = None):
         self.ttl = ttl
+        self.store = store
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        self.prefetch_window = prefetch_window
+        self.prefetch_hits = prefetch_hits
+        self.shard_capacity = max(1, max_entries // self.SHARDS)
+        # Each shard: name -> [addresses, expires_at, hits]; empty addresses means negative
+        self.shards = [OrderedDict() for _ in range(self.SHARDS)]
+        self.locks = [threading.Lock() for _ in range(self.SHARDS)]
+        self.counters = [dict.fromkeys(("hits", "misses", "stale", "negative", "evictions"), 0)
+                         for _ in range(self.SHARDS)]
+        self.lookups = 0
+        self.lookup_ms_total = 0.0
         self._lock = threading.Lock()
     
+    def _shard(self, domain: str) -> int:
+        return hash(domain) % self.SHARDS
+    
+    def lookup(self, domain: str) -> Tuple[List[str], str]:
+        """Return (addresses, state) for a name; addresses is empty on miss or negative."""
+        index = self._shard(domain)
+        shard = self.shards[index]
+        counters = self.counters[index]
+        now = time.time()
+        with self.locks[index]:
+            entry = shard.get(domain)
+            if entry is None and self.store:
+                # Warm start: names resolved by an earlier run or another proxy process
+                record = self.store.get(domain)
+                if record:
+                    entry = [record[0], record[1], 0]
+                    self._insert_locked(index, domain, entry)
+            if entry is None:
+                counters["misses"] += 1
+                return [], self.MISS
+            
+            addresses, expires_at, hits = entry
+            remaining = expires_at - now
+            if remaining <= -self.stale_ttl or (not addresses and remaining <= 0):
+                del shard[domain]
+                counters["misses"] += 1
+                return [], self.MISS
+            
+            shard.move_to_end(domain)
+            entry[2] = hits + 1
+            if not addresses:
+                counters["negative"] += 1
+                return [], self.NEGATIVE
+            if remaining <= 0:
+                counters["stale"] += 1
+                return addresses, self.STALE
+            counters["hits"] += 1
+            if remaining < self.prefetch_window and hits >= self.prefetch_hits:
+                return addresses, self.PREFETCH
+            return addresses, self.FRESH
+    
+    def peek(self, domain: str) -> Tuple[List[str], Optional[float]]:
+        """Return (addresses, expires_at) without touching counters or LRU order."""
+        index = self._shard(domain)
+        with self.locks[index]:
+            entry = self.shards[index].get(domain)
+            return (list(entry[0]), entry[1]) if entry else ([], None)
+    
     def get(self, domain):
         """Get cached DNS result."""
+        addresses, state = self.lookup(domain)
+        if state in (self.FRESH, self.PREFETCH):
+            return addresses[0]
+        return None
+    
+    def set(self, domain, result, ttl=None):
+        """Cache DNS result (one address or a full answer set)."""
+        addresses = [result] if isinstance(result, str) else list(result)
+        ttl = self.ttl if ttl is None else min(self.max_ttl, max(self.min_ttl, ttl))
+        self._store(domain, addresses, ttl)
+        if self.store:
+            try:
+                self.store.put(domain, addresses, time.time() + ttl)
+            except Exception as e:
+                logger.debug(f"DNS store write failed for {domain}: {e}")
+    
+    def set_negative(self, domain, ttl=None):
+        """Cache a name that does not resolve."""
+        self._store(domain, [], self.negative_ttl if ttl is None else ttl)
+    
+    def _store(self, domain: str, addresses: List[str], ttl: float):
+        index = self._shard(domain)
+        shard = self.shards[index]
+        with self.locks[index]:
+            previous = shard.pop(domain, None)
+            self._insert_locked(index, domain, [addresses, time.time() + ttl, previous[2] if previous else 0])
+    
+    def _insert_locked(self, index: int, domain: str, entry: list):
+        shard = self.shards[index]
+        shard[domain] = entry
+        while len(shard) > self.shard_capacity:
+            shard.popitem(last=False)
+            self.counters[index]["evictions"] += 1
+    
+    def record_lookup(self, latency_ms: float):
+        """Record the latency of an upstream lookup."""
         with self._lock:
-            if domain in self.cache:
-                result, timestamp = self.cache[domain]
-                if time.time() - timestamp < self.ttl:
-                    return result
-                else:
-                    del self.cache[domain]
-            return None
+            self.lookups += 1
+            self.lookup_ms_total += latency_ms
     
-    def set(self, domain, result):
-        """Cache DNS result."""
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters, size and average upstream latency."""
+        totals = dict.fromkeys(("hits", "misses", "stale", "negative", "evictions"), 0)
+        size = 0
+        for lock, shard, counters in zip(self.locks, self.shards, self.counters):
+            with lock:
+                size += len(shard)
+                for key, value in counters.items():
+                    totals[key] += value
         with self._lock:
-            self.cache[domain] = (result, time.time())
+            totals["lookups"] = self.lookups
+            totals["avg_lookup_ms"] = self.lookup_ms_total / self.lookups if self.lookups else 0.0
+        answered = totals["hits"] + totals["stale"] + totals["negative"]
+        requests = answered + totals["misses"]
+        totals["hit_rate"] = answered / requests * 100 if requests else 0.0
+        totals["entries"] = size
+        return totals
     
     def clear(self):
         """Clear all cached entries."""
+        for lock, shard in zip(self.locks, self.shards):
+            with lock:
+                shard.clear()
+
+class PersistentDNSStore:
+    """Memory-mapped name -> addresses table shared across restarts and proxy processes.
+    
+    Fixed-size slots in an open-addressed hash table; each slot carries a sequence
+    number so readers never lock, while writers serialize on a file lock.
+    """
+    
+    MAGIC = b'SDNS'
+    VERSION = 1
+    HEADER = struct.Struct('<4sIId')     # magic, version, slot count, last compaction
+    HEADER_SIZE = 64
+    SLOT = struct.Struct('<IQdHB')       # seq, name hash, expires_at, name length, address count
+    NAME_SIZE = 253
+    MAX_ADDRESSES = 16
+    SLOT_SIZE = 344                      # SLOT header + name + addresses, padded
+    MAX_PROBE = 16
+    COMPACT_INTERVAL = 3600
+    COMPACT_CHECK = 300                  # how often the background thread looks at the last compaction
+    KEEP_EXPIRED = 3600                  # expired records still worth serving stale
+    
+    def __init__(self, path: str, slot_count=8192):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o600)
+        try:
+            with self._file_lock():
+                self.slot_count = self._init_file(slot_count)
+            self.map = mmap.mmap(self.fd, self.HEADER_SIZE + self.slot_count * self.SLOT_SIZE)
+        except Exception:
+            os.close(self.fd)
+            raise
+        self.maybe_compact()
+        # Compaction rewrites the whole table, so it runs here rather than on the put path
+        self.compact_thread = threading.Thread(target=self._compact_loop, daemon=True, name="DNSStoreCompact")
+        self.compact_thread.start()
+    
+    def _init_file(self, slot_count: int) -> int:
+        """Validate the header, (re)creating the table if it is missing or foreign."""
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        header = os.read(self.fd, self.HEADER.size)
+        if len(header) == self.HEADER.size:
+            magic, version, existing, _ = self.HEADER.unpack(header)
+            size = self.HEADER_SIZE + existing * self.SLOT_SIZE
+            if magic == self.MAGIC and version == self.VERSION and os.fstat(self.fd).st_size == size:
+                return existing
+        
+        os.ftruncate(self.fd, 0)
+        os.ftruncate(self.fd, self.HEADER_SIZE + slot_count * self.SLOT_SIZE)
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        os.write(self.fd, self.HEADER.pack(self.MAGIC, self.VERSION, slot_count, time.time()))
+        return slot_count
+    
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive writer lock across threads and (where supported) processes."""
         with self._lock:
-            self.cache.clear()
+            if fcntl is not None:
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self.fd, fcntl.LOCK_UN)
+    
+    @staticmethod
+    def _hash(name: bytes) -> int:
+        # Never 0: a zero hash marks an empty slot
+        return int.from_bytes(hashlib.blake2b(name, digest_size=8).digest(), 'little') | 1
+    
+    def _offset(self, index: int) -> int:
+        return self.HEADER_SIZE + index * self.SLOT_SIZE
+    
+    def _read_slot(self, offset: int) -> Optional[Tuple[int, bytes, float, List[str]]]:
+        """Read one slot consistently; None if a writer kept it busy (or died mid-write)."""
+        for _ in range(8):
+            seq = self.SLOT.unpack_from(self.map, offset)[0]
+            if seq & 1:
+                continue
+            raw = self.map[offset:offset + self.SLOT_SIZE]
+            if self.SLOT.unpack_from(self.map, offset)[0] != seq:
+                continue
+            _, name_hash, expires_at, name_len, count = self.SLOT.unpack_from(raw)
+            name_start = self.SLOT.size
+            name = raw[name_start:name_start + name_len]
+            addr_start = name_start + self.NAME_SIZE
+            addresses = [socket.inet_ntoa(raw[addr_start + i * 4:addr_start + i * 4 + 4]) for i in range(count)]
+            return name_hash, name, expires_at, addresses
+        return None
+    
+    def _write_slot(self, offset: int, name_hash: int, name: bytes, addresses: List[str], expires_at: float):
+        seq = self.SLOT.unpack_from(self.map, offset)[0]
+        if not seq & 1:  # odd means a writer died mid-update; reuse its number
+            seq = (seq + 1) & 0xFFFFFFFF
+        struct.pack_into('<I', self.map, offset, seq)
+        body = bytearray(self.SLOT_SIZE - 4)
+        struct.pack_into('<QdHB', body, 0, name_hash, expires_at, len(name), len(addresses))
+        body[self.SLOT.size - 4:self.SLOT.size - 4 + len(name)] = name
+        addr_start = self.SLOT.size - 4 + self.NAME_SIZE
+        for i, address in enumerate(addresses):
+            body[addr_start + i * 4:addr_start + i * 4 + 4] = socket.inet_aton(address)
+        self.map[offset + 4:offset + self.SLOT_SIZE] = body
+        struct.pack_into('<I', self.map, offset, (seq + 1) & 0xFFFFFFFF)
+    
+    def get(self, domain: str) -> Optional[Tuple[List[str], float]]:
+        """Return (addresses, expires_at) for a stored name."""
+        name = domain.encode()
+        name_hash = self._hash(name)
+        start = name_hash % self.slot_count
+        for probe in range(self.MAX_PROBE):
+            slot = self._read_slot(self._offset((start + probe) % self.slot_count))
+            if slot is None:
+                continue
+            slot_hash, slot_name, expires_at, addresses = slot
+            if slot_hash == 0:
+                return None
+            if slot_hash == name_hash and slot_name == name and addresses:
+                return addresses, expires_at
+        return None
+    
+    def put(self, domain: str, addresses: List[str], expires_at: float):
+        """Store a name's address set, evicting the soonest-expiring record if its probe window is full."""
+        name = domain.encode()
+        addresses = [a for a in addresses if '.' in a][:self.MAX_ADDRESSES]
+        if not addresses or len(name) > self.NAME_SIZE:
+            return
+        with self._file_lock():
+            self._put_locked(name, addresses, expires_at)
+    
+    def _put_locked(self, name: bytes, addresses: List[str], expires_at: float, evict=True) -> bool:
+        name_hash = self._hash(name)
+        start = name_hash % self.slot_count
+        reusable = None
+        # Soonest-expiring record in the window: the victim when nothing else is free
+        victim, victim_expires = None, float("inf")
+        now = time.time()
+        for probe in range(self.MAX_PROBE):
+            offset = self._offset((start + probe) % self.slot_count)
+            slot = self._read_slot(offset)
+            if slot is None:
+                # Left half-written by a crashed process; safe to take over under the file lock
+                if reusable is None:
+                    reusable = offset
+                continue
+            slot_hash, slot_name, slot_expires, _ = slot
+            if slot_hash == name_hash and slot_name == name:
+                reusable = offset
+                break
+            if slot_hash == 0:
+                if reusable is None:
+                    reusable = offset
+                break
+            if reusable is None and slot_expires < now - self.KEEP_EXPIRED:
+                reusable = offset
+            if slot_expires < victim_expires:
+                victim, victim_expires = offset, slot_expires
+        if reusable is None:
+            if not evict or victim is None:
+                return False
+            reusable = victim
+        self._write_slot(reusable, name_hash, name, addresses, expires_at)
+        return True
+    
+    def maybe_compact(self):
+        """Compact if the last compaction is older than COMPACT_INTERVAL."""
+        last_compaction = self.HEADER.unpack_from(self.map, 0)[3]
+        if time.time() - last_compaction > self.COMPACT_INTERVAL:
+            with self._file_lock():
+                self._compact_locked()
+    
+    def _compact_loop(self):
+        while not self._stop_event.wait(self.COMPACT_CHECK):
+            try:
+                self.maybe_compact()
+            except Exception as e:
+                logger.debug(f"DNS store compaction failed: {e}")
+    
+    def _compact_locked(self):
+        """Drop long-expired records and re-insert the rest at their home slots."""
+        cutoff = time.time() - self.KEEP_EXPIRED
+        live = []
+        for index in range(self.slot_count):
+            offset = self._offset(index)
+            slot = self._read_slot(offset)
+            if slot and slot[0]:
+                if slot[2] >= cutoff and slot[3]:
+                    live.append(slot)
+                self._write_slot(offset, 0, b'', [], 0)
+        # Soonest-expiring last, so they are the ones dropped if a probe window overflows
+        live.sort(key=lambda slot: slot[2], reverse=True)
+        for _, name, expires_at, addresses in live:
+            self._put_locked(name, addresses, expires_at, evict=False)
+        struct.pack_into('<d', self.map, 12, time.time())
+        logger.debug(f"DNS store compacted: {len(live)} records kept")
+    
+    def close(self):
+        """Unmap and close the store file."""
+        self._stop_event.set()
+        self.compact_thread.join(timeout=5)
+        try:
+            self.map.close()
+        except BufferError:
+            pass  # a reader still holds a view; the mapping goes away with it
+        os.close(self.fd)
+
+class CoalescingResolver:
+    """Single-flight resolver: concurrent cache misses for one name share a single query."""
+    
+    def __init__(self, cache: DNSCache, lookup: Callable[[str], Optional[Tuple[List[str], Optional[int]]]],
+                 max_workers=8):
+        self.cache = cache
+        self.lookup = lookup
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="DNS")
+        self.inflight: Dict[str, Future] = {}
+        self.coalesced = 0
+        self.refreshes = 0
+        self._lock = threading.Lock()
+    
+    def resolve_future(self, domain: str) -> Future:
+        """Return a future for the domain's address list, joining an in-flight query if any."""
+        addresses, state = self.cache.lookup(domain)
+        if state != DNSCache.MISS:
+            if state in (DNSCache.STALE, DNSCache.PREFETCH):
+                # Answer from cache now; refresh in the background
+                self._start_lookup(domain, refresh=True)
+            future = Future()
+            future.set_result(addresses)
+            return future
+        return self._start_lookup(domain)
+    
+    def resolve(self, domain: str) -> Optional[str]:
+        """Blocking resolve of the first address."""
+        addresses = self.resolve_all(domain)
+        return addresses[0] if addresses else None
+    
+    def resolve_all(self, domain: str) -> List[str]:
+        """Blocking resolve of every address, for worker threads."""
+        try:
+            return self.resolve_future(domain).result()
+        except Exception as e:
+            logger.debug(f"Resolution of {domain} failed: {e}")
+            return []
+    
+    async def resolve_async(self, domain: str) -> Optional[str]:
+        """Resolve the first address without blocking the event loop."""
+        addresses = await self.resolve_all_async(domain)
+        return addresses[0] if addresses else None
+    
+    async def resolve_all_async(self, domain: str) -> List[str]:
+        """Resolve every address without blocking the event loop."""
+        try:
+            return await asyncio.wrap_future(self.resolve_future(domain))
+        except Exception as e:
+            logger.debug(f"Resolution of {domain} failed: {e}")
+            return []
+    
+    def shutdown(self):
+        """Stop accepting lookups."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _start_lookup(self, domain: str, refresh: bool = False) -> Future:
+        with self._lock:
+            future = self.inflight.get(domain)
+            if future:
+                if not refresh:
+                    self.coalesced += 1
+                return future
+            if refresh:
+                self.refreshes += 1
+            future = self.executor.submit(self._lookup, domain)
+            self.inflight[domain] = future
+        return future
+    
+    def _lookup(self, domain: str) -> List[str]:
+        try:
+            start_time = time.time()
+            result = self.lookup(domain)
+            self.cache.record_lookup((time.time() - start_time) * 1000)
+            if result is None:
+                return []  # transient failure: keep any stale entry
+            addresses, ttl = result
+            if not addresses:
+                self.cache.set_negative(domain)
+                return []
+            self.cache.set(domain, addresses, ttl)
+            return addresses
+        finally:
+            with self._lock:
+                self.inflight.pop(domain, None)
+
+# ================= DNS STUB SERVER =================
+class TunnelDNSClient:
+    """DNS-over-TCP client multiplexing pipelined queries on one persistent tunnel channel."""
+    
+    def __init__(self, opener: Callable, timeout=5.0):
+        self.opener = opener
+        self.timeout = timeout
+        self.channel = None
+        # wire id -> [event, response, channel]
+        self.pending: Dict[int, list] = {}
+        self.next_id = random.getrandbits(16)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        # Serializes channel opens without holding _lock across the round trip
+        self._open_lock = threading.Lock()
+    
+    def query(self, wire: bytes) -> bytes:
+        """Send a DNS query through the tunnel and return the response wire message."""
+        try:
+            return self._query_once(wire)
+        except ConnectionError:
+            # Resolvers close idle TCP sessions; DNS is idempotent, so retry once on a fresh channel
+            return self._query_once(wire)
+    
+    def _query_once(self, wire: bytes) -> bytes:
+        waiter = [threading.Event(), None, None]
+        channel = self._ensure_channel()
+        with self._lock:
+            if self.channel is not channel:
+                raise ConnectionError("tunnel DNS channel closed")
+            waiter[2] = channel
+            # Rewrite the id so queries from different clients can't collide on the shared channel
+            while self.next_id in self.pending:
+                self.next_id = (self.next_id + 1) & 0xFFFF
+            query_id = self.next_id
+            self.next_id = (self.next_id + 1) & 0xFFFF
+            self.pending[query_id] = waiter
+        
+        try:
+            with self._send_lock:
+                channel.sendall(struct.pack('!HH', len(wire), query_id) + wire[2:])
+        except Exception as e:
+            self._drop(channel)
+            raise ConnectionError(f"tunnel DNS send failed: {e}")
+        
+        if not waiter[0].wait(self.timeout):
+            with self._lock:
+                self.pending.pop(query_id, None)
+            raise TimeoutError("tunnel DNS query timed out")
+        if waiter[1] is None:
+            raise ConnectionError("tunnel DNS channel closed")
+        return wire[:2] + waiter[1][2:]
+    
+    def _ensure_channel(self):
+        """The shared channel, opened outside _lock so queries and the read loop never wait on it."""
+        with self._lock:
+            if self.channel is not None:
+                return self.channel
+        with self._open_lock:
+            with self._lock:
+                if self.channel is not None:
+                    return self.channel
+            channel = self.opener()
+            with self._lock:
+                self.channel = channel
+            threading.Thread(target=self._read_loop, args=(channel,), daemon=True, name="TunnelDNS").start()
+            return channel
+    
+    def _read_loop(self, channel):
+        buffer = bytearray()
+        try:
+            while True:
+                data = channel.recv(65536)
+                if not data:
+                    break
+                buffer.extend(data)
+                while len(buffer) >= 2:
+                    length = struct.unpack_from('!H', buffer)[0]
+                    if len(buffer) < 2 + length:
+                        break
+                    message = bytes(buffer[2:2 + length])
+                    del buffer[:2 + length]
+                    if len(message) < 12:
+                        continue
+                    with self._lock:
+                        waiter = self.pending.pop(struct.unpack_from('!H', message)[0], None)
+                    if waiter:
+                        waiter[1] = message
+                        waiter[0].set()
+        except Exception as e:
+            logger.debug(f"Tunnel DNS channel error: {e}")
+        finally:
+            self._drop(channel)
+    
+    def _drop(self, channel):
+        """Forget a dead channel and fail the queries that were waiting on it."""
+        with self._lock:
+            if self.channel is channel:
+                self.channel = None
+            failed = [qid for qid, waiter in self.pending.items() if waiter[2] is channel]
+            waiters = [self.pending.pop(qid) for qid in failed]
+        for waiter in waiters:
+            waiter[0].set()
+        try:
+            channel.close()
+        except Exception:
+            pass
+    
+    def close(self):
+        """Close the tunnel channel."""
+        with self._lock:
+            channel = self.channel
+        if channel:
+            self._drop(channel)
+
+class DNSStubServer:
+    """Local UDP/TCP DNS listener: answers from the shared cache, forwards misses through the tunnel."""
+    
+    def __init__(self, port: int, client: TunnelDNSClient, cache: DNSCache, max_workers=16):
+        self.port = port
+        self.client = client
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="DNSStub")
+        self.udp_socket: Optional[socket.socket] = None
+        self.tcp_socket: Optional[socket.socket] = None
+        self.is_running = False
+        self.answered_from_cache = 0
+        self.forwarded = 0
+    
+    def start(self):
+        """Bind both listeners and start serving."""
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_socket.bind(('127.0.0.1', self.port))
+        self.udp_socket.settimeout(1.0)
+        self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tcp_socket.bind(('127.0.0.1', self.port))
+        self.tcp_socket.listen(32)
+        self.tcp_socket.settimeout(1.0)
+        self.is_running = True
+        threading.Thread(target=self._udp_loop, daemon=True, name="DNSStubUDP").start()
+        threading.Thread(target=self._tcp_loop, daemon=True, name="DNSStubTCP").start()
+        logger.info(f"DNS stub listening on 127.0.0.1:{self.port} (UDP/TCP)")
+    
+    def stop(self):
+        """Stop listening and close the tunnel channel."""
+        self.is_running = False
+        for sock in (self.udp_socket, self.tcp_socket):
+            if sock:
+                try:
+                    sock.close()
+                except Exception:
+                    pass
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.client.close()
+    
+    def _udp_loop(self):
+        while self.is_running:
+            try:
+                wire, addr = self.udp_socket.recvfrom(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.executor.submit(self._answer_udp, wire, addr)
+    
+    def _answer_udp(self, wire: bytes, addr: tuple):
+        response = self.handle(wire, udp=True)
+        if response:
+            try:
+                self.udp_socket.sendto(response, addr)
+            except OSError:
+                pass
+    
+    def _tcp_loop(self):
+        while self.is_running:
+            try:
+                conn, _ = self.tcp_socket.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            threading.Thread(target=self._serve_tcp, args=(conn,), daemon=True).start()
+    
+    def _serve_tcp(self, conn: socket.socket):
+        """Serve pipelined length-prefixed queries; responses may return out of order."""
+        send_lock = threading.Lock()
+        
+        def answer(wire):
+            response = self.handle(wire, udp=False)
+            if response:
+                with send_lock:
+                    conn.sendall(struct.pack('!H', len(response)) + response)
+        
+        conn.settimeout(30)
+        buffer = bytearray()
+        try:
+            while self.is_running:
+                data = conn.recv(65536)
+                if not data:
+                    break
+                buffer.extend(data)
+                while len(buffer) >= 2:
+                    length = struct.unpack_from('!H', buffer)[0]
+                    if len(buffer) < 2 + length:
+                        break
+                    self.executor.submit(answer, bytes(buffer[2:2 + length]))
+                    del buffer[:2 + length]
+        except (socket.timeout, OSError):
+            pass
+        finally:
+            conn.close()
+    
+    def handle(self, wire: bytes, udp: bool) -> Optional[bytes]:
+        """Answer one query wire message."""
+        try:
+            request = dns.message.from_wire(wire)
+        except Exception:
+            return None
+        
+        cached = self._answer_from_cache(request)
+        if cached is not None:
+            self.answered_from_cache += 1
+            response_wire = cached
+        else:
+            try:
+                response_wire = self.client.query(wire)
+                self.forwarded += 1
+            except Exception as e:
+                logger.debug(f"DNS stub forward failed: {e}")
+                response = dns.message.make_response(request)
+                response.set_rcode(dns.rcode.SERVFAIL)
+                return response.to_wire()
+            self._remember(request, response_wire)
+        
+        if udp:
+            limit = max(512, request.payload) if request.edns >= 0 else 512
+            if len(response_wire) > limit:
+                # Too big for UDP: tell the client to retry over TCP
+                response = dns.message.make_response(request)
+                response.flags |= dns.flags.TC
+                return response.to_wire()
+        return response_wire
+    
+    def _answer_from_cache(self, request) -> Optional[bytes]:
+        if len(request.question) != 1:
+            return None
+        question = request.question[0]
+        if question.rdclass != dns.rdataclass.IN or question.rdtype not in (dns.rdatatype.A, dns.rdatatype.AAAA):
+            return None
+        
+        name = question.name.to_text(omit_final_dot=True).lower()
+        addresses, state = self.cache.lookup(name)
+        if state not in (DNSCache.FRESH, DNSCache.PREFETCH):
+            return None
+        want_v6 = question.rdtype == dns.rdatatype.AAAA
+        matching = [address for address in addresses if (':' in address) == want_v6]
+        if not matching:
+            return None  # the cache may only hold the other family; ask upstream
+        
+        _, expires_at = self.cache.peek(name)
+        ttl = max(1, int((expires_at or time.time()) - time.time()))
+        response = dns.message.make_response(request)
+        rrset = response.find_rrset(response.answer, question.name, dns.rdataclass.IN, question.rdtype, create=True)
+        for address in matching:
+            rrset.add(dns.rdata.from_text(dns.rdataclass.IN, question.rdtype, address), ttl)
+        return response.to_wire()
+    
+    def _remember(self, request, response_wire: bytes):
+        """Feed forwarded A/AAAA answers into the shared cache, keeping the other family."""
+        try:
+            response = dns.message.from_wire(response_wire)
+        except Exception:
+            return
+        if response.rcode() != dns.rcode.NOERROR or len(request.question) != 1:
+            return
+        question = request.question[0]
+        if question.rdtype not in (dns.rdatatype.A, dns.rdatatype.AAAA):
+            return
+        
+        fetched = []
+        ttl = None
+        for rrset in response.answer:
+            if rrset.rdtype == question.rdtype:
+                fetched.extend(str(rdata) for rdata in rrset)
+                ttl = rrset.ttl if ttl is None else min(ttl, rrset.ttl)
+        if not fetched:
+            return
+        
+        name = question.name.to_text(omit_final_dot=True).lower()
+        existing, _ = self.cache.peek(name)
+        want_v6 = question.rdtype == dns.rdatatype.AAAA
+        others = [address for address in existing if (':' in address) != want_v6]
+        ipv6, ipv4 = (fetched, others) if want_v6 else (others, fetched)
+        self.cache.set(name, [a for pair in zip_longest(ipv6, ipv4) for a in pair if a], ttl)
+
+# ================= ENCRYPTED DNS =================
+class SerializedTLSStream:
+    """Non-blocking TLS socket shared by a reader thread and writers; SSL calls never overlap."""
+    
+    def __init__(self, tls: ssl.SSLSocket):
+        self.tls = tls
+        # Non-blocking so a reader woken by a session ticket or partial record never parks holding the lock
+        self.tls.setblocking(False)
+        self._lock = threading.Lock()
+    
+    def sendall(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            with self._lock:
+                try:
+                    view = view[self.tls.send(view):]
+                    continue
+                except (ssl.SSLWantWriteError, ssl.SSLWantReadError, BlockingIOError):
+                    pass
+            select.select([], [self.tls], [], 1.0)
+    
+    def recv(self, size: int) -> bytes:
+        while True:
+            with self._lock:
+                try:
+                    return self.tls.recv(size)
+                except (ssl.SSLWantReadError, ssl.SSLWantWriteError, BlockingIOError):
+                    pass
+            select.select([self.tls], [], [], 1.0)
+    
+    def close(self):
+        self.tls.close()
+
+class DoTClient:
+    """DNS-over-TLS through a small pool of persistent, pipelined TLS connections."""
+    
+    def __init__(self, address: str, server_name: Optional[str] = None, port=853,
+                 pool_size=2, timeout=5.0, ssl_context: Optional[ssl.SSLContext] = None):
+        self.address = address
+        self.server_name = server_name or address
+        self.port = port
+        self.timeout = timeout
+        self.context = ssl_context or ssl.create_default_context()
+        self.connections = [TunnelDNSClient(self._connect, timeout) for _ in range(pool_size)]
+        self._turn = itertools.count()
+    
+    def _connect(self) -> SerializedTLSStream:
+        sock = socket.create_connection((self.address, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return SerializedTLSStream(self.context.wrap_socket(sock, server_hostname=self.server_name))
+    
+    def query(self, wire: bytes) -> bytes:
+        """Send a query on the next pooled connection."""
+        return self.connections[next(self._turn) % len(self.connections)].query(wire)
+    
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+
+class DoHClient:
+    """DNS-over-HTTPS: HTTP/2 multiplexing via httpx when available, else a keep-alive requests pool."""
+    
+    def __init__(self, url: str, timeout=5.0, pool_size=8, verify=True):
+        self.url = url
+        self.timeout = timeout
+        self.verify = verify
+        self.client = None
+        self.session = None
+        if httpx is not None:
+            try:
+                self.client = httpx.Client(http2=True, timeout=timeout, verify=verify)
+            except ImportError:
+                logger.debug("httpx installed without h2; DoH falls back to HTTP/1.1 keep-alive")
+        if self.client is None:
+            self.session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            self.session.mount('https://', adapter)
+    
+    def query(self, wire: bytes) -> bytes:
+        """POST one query; id 0 on the wire keeps answers HTTP-cacheable (RFC 8484)."""
+        body = b'\x00\x00' + wire[2:]
+        headers = {"content-type": "application/dns-message", "accept": "application/dns-message"}
+        if self.client is not None:
+            response = self.client.post(self.url, content=body, headers=headers)
+        else:
+            response = self.session.post(self.url, data=body, headers=headers,
+                                         timeout=self.timeout, verify=self.verify)
+        response.raise_for_status()
+        return wire[:2] + response.content[2:]
+    
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+        if self.session is not None:
+            self.session.close()
+
+class EncryptedDNSResolver:
+    """Stand-in for dns.resolver.Resolver whose resolve() goes over DoT or DoH."""
+    
+    def __init__(self, protocol: str, nameservers: List[str], url: str = "", timeout=5.0,
+                 ssl_context: Optional[ssl.SSLContext] = None, verify=True):
+        self.protocol = protocol
+        self.nameservers = list(nameservers)
+        self.url = url
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.verify = verify
+        self.backends: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+    
+    def _backend(self, nameserver: str):
+        key = self.url if self.protocol == "doh" else nameserver
+        with self._lock:
+            backend = self.backends.get(key)
+            if backend is None:
+                if self.protocol == "doh":
+                    backend = DoHClient(self.url, self.timeout, verify=self.verify)
+                else:
+                    # For DoT the url field carries the TLS server name, if any
+                    backend = DoTClient(nameserver, self.url or None, timeout=self.timeout,
+                                        ssl_context=self.ssl_context)
+                self.backends[key] = backend
+            return backend
+    
+    def resolve(self, qname: str, rdtype='A'):
+        """Resolve like dns.resolver.Resolver.resolve, raising NXDOMAIN/NoAnswer the same way."""
+        query = dns.message.make_query(qname, rdtype)
+        targets = [self.url] if self.protocol == "doh" else list(self.nameservers)
+        last_error: Exception = dns.resolver.NoNameservers()
+        for nameserver in targets:
+            try:
+                response = dns.message.from_wire(self._backend(nameserver).query(query.to_wire()))
+                break
+            except Exception as e:
+                last_error = e
+                logger.debug(f"{self.protocol.upper()} query to {nameserver} failed: {e}")
+        else:
+            raise last_error
+        return answer_from_response(query, response, nameserver)
+    
+    def close(self):
+        with self._lock:
+            backends = list(self.backends.values())
+            self.backends.clear()
+        for backend in backends:
+            backend.close()
 
 # ================= HEALTH MONITOR =================
 class HealthMonitor:
@@ -312,117 +1697,870 @@ class HealthMonitor:
             
             return True
     
-    def start(self):
-        """Start health monitoring."""
-        self.is_running = True
-        self.monitor_thread = threading.Thread(target=self._monitor_loop, daemon=True)
-        self.monitor_thread.start()
+    def start(self):
+        """Start health monitoring."""
+        self.is_running = True
+        self.monitor_thread = threading.Thread(target=self._monitor_loop, daemon=True)
+        self.monitor_thread.start()
+    
+    def stop(self):
+        """Stop health monitoring."""
+        self.is_running = False
+        if self.monitor_thread:
+            self.monitor_thread.join(timeout=2)
+    
+    def _monitor_loop(self):
+        """Monitor connection health loop."""
+        while self.is_running:
+            time.sleep(self.check_interval)
+            if not self.is_healthy():
+                logger.warning("Connection health check failed")
+    
+    def reset(self):
+        """Reset health monitor."""
+        with self._lock:
+            self.rtt_history.clear()
+            self.unhealthy_count = 0
+
+# ================= NETWORK INTERFACE MANAGER =================
+class NetworkInterfaceManager:
+    """Manages multiple network interfaces for WAN bonding."""
+    
+    MODES = ("round_robin", "random", "fastest", "weighted", "least_connections", "least_bytes", "p2c")
+    
+    def __init__(self, alpha=0.3):
+        self.interfaces = []
+        self.selected_interfaces = []
+        self.current_index = 0
+        self.load_balancing_mode = "round_robin"
+        self.alpha = alpha
+        # name -> measured rtt_ms / throughput (bytes/s, decaying peak) / loss / failure EWMAs and score history
+        self.metrics: Dict[str, Dict[str, Any]] = {}
+        # name -> static weight from the UI (default 1) and smooth weighted round-robin credit
+        self.weights: Dict[str, float] = {}
+        self.wrr_credit: Dict[str, float] = {}
+        self.unknown_modes = set()
+        # Names the user selected, kept while such a link is down so it rejoins when it returns
+        self.wanted = set()
+        # Bumped whenever the interface list or selection changes
+        self.generation = 0
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _read_interfaces() -> List[Dict[str, Any]]:
+        """IPv4 addresses of every interface that is up and running."""
+        interfaces = []
+        addrs = psutil.net_if_addrs()
+        stats = psutil.net_if_stats()
+        
+        for iface_name, addr_list in addrs.items():
+            if iface_name in stats and stats[iface_name].isup:
+                for addr in addr_list:
+                    if addr.family == socket.AF_INET:
+                        # Determine interface type
+                        iface_type = "Unknown"
+                        if "Wi-Fi" in iface_name or "wlan" in iface_name.lower():
+                            iface_type = "Wi-Fi"
+                        elif "Ethernet" in iface_name or "eth" in iface_name.lower():
+                            iface_type = "Ethernet"
+                        elif "LTE" in iface_name or "wwan" in iface_name.lower():
+                            iface_type = "LTE/4G"
+                        
+                        interfaces.append({
+                            "name": iface_name,
+                            "ip": addr.address,
+                            "netmask": addr.netmask,
+                            "type": iface_type,
+                            "mtu": stats[iface_name].mtu,
+                            "speed": stats[iface_name].speed,
+                            "enabled": False
+                        })
+        return interfaces
+    
+    def scan_interfaces(self) -> List[Dict[str, Any]]:
+        """Scan and return available network interfaces."""
+        try:
+            interfaces = self._read_interfaces()
+            with self._lock:
+                for iface in interfaces:
+                    iface["enabled"] = iface["name"] in self.wanted
+                self.interfaces = interfaces
+                self.generation += 1
+            logger.info(f"Found {len(interfaces)} network interface(s)")
+            return interfaces
+            
+        except Exception as e:
+            logger.error(f"Interface scan error: {e}")
+            return []
+    
+    def set_selected_interfaces(self, selected: List[Dict[str, Any]]):
+        """Set selected interfaces for WAN bonding."""
+        with self._lock:
+            self.selected_interfaces = [iface for iface in selected if iface.get('enabled', False)]
+            self.wanted = {iface["name"] for iface in self.selected_interfaces}
+            self.generation += 1
+            logger.info(f"Selected {len(self.selected_interfaces)} interfaces for WAN bonding")
+    
+    def refresh_interfaces(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Re-read live interfaces after a link or address change.
+        
+        Selected interfaces that went down leave the selection and rejoin when they are back;
+        returns the selected ones that were "lost", "returned" or "readdressed".
+        """
+        current = self._read_interfaces()
+        with self._lock:
+            before = {iface["name"]: iface for iface in self.selected_interfaces}
+            self.wanted |= before.keys()
+            for iface in current:
+                iface["enabled"] = iface["name"] in self.wanted
+            listed = [(iface["name"], iface["ip"]) for iface in self.interfaces]
+            self.interfaces = current
+            self.selected_interfaces = [iface for iface in current if iface["enabled"]]
+            after = {iface["name"]: iface for iface in self.selected_interfaces}
+            change = {
+                "lost": [iface for name, iface in before.items() if name not in after],
+                "returned": [iface for name, iface in after.items() if name not in before],
+                "readdressed": [iface for name, iface in after.items()
+                                if name in before and iface["ip"] != before[name]["ip"]],
+            }
+            if listed != [(iface["name"], iface["ip"]) for iface in current] or any(change.values()):
+                self.generation += 1
+        return change
+    
+    def _metric(self, name: str) -> Dict[str, Any]:
+        entry = self.metrics.get(name)
+        if entry is None:
+            entry = self.metrics[name] = {"rtt_ms": None, "throughput": 0.0, "loss": 0.0,
+                                          "failure": 0.0, "samples": 0, "history": deque(maxlen=60)}
+        return entry
+    
+    def _ewma(self, entry: Dict[str, Any], key: str, value: float):
+        entry[key] = value if entry[key] is None else entry[key] + self.alpha * (value - entry[key])
+    
+    def record_rtt(self, name: str, rtt_ms: float):
+        """Round-trip time seen on an interface (tunnel socket srtt or probe connect time)."""
+        with self._lock:
+            entry = self._metric(name)
+            self._ewma(entry, "rtt_ms", rtt_ms)
+            entry["samples"] += 1
+    
+    def record_throughput(self, name: str, bytes_per_second: float):
+        """Tunnel throughput achieved on an interface; the peak decays so a degraded link loses credit."""
+        with self._lock:
+            entry = self._metric(name)
+            entry["throughput"] = max(bytes_per_second, entry["throughput"] * 0.9)
+    
+    def record_loss(self, name: str, ratio: float):
+        """Retransmitted share of segments sent on an interface."""
+        with self._lock:
+            self._ewma(self._metric(name), "loss", min(ratio, 1.0))
+    
+    def record_result(self, name: str, ok: bool):
+        """Outcome of a probe, connect or channel open over an interface."""
+        with self._lock:
+            self._ewma(self._metric(name), "failure", 0.0 if ok else 1.0)
+    
+    def _score_locked(self, name: str) -> Optional[float]:
+        entry = self.metrics.get(name)
+        if not entry or entry["rtt_ms"] is None:
+            return None
+        # Higher is better: inverse RTT, discounted by loss and failures, boosted by proven throughput
+        mbps = entry["throughput"] * 8 / 1e6
+        return (1000 / max(entry["rtt_ms"], 1.0) * (1 - entry["failure"])
+                * (1 - min(10 * entry["loss"], 0.9)) * (1 + math.log2(1 + mbps)))
+    
+    def get_score(self, name: str) -> Optional[float]:
+        with self._lock:
+            return self._score_locked(name)
+    
+    def snapshot_scores(self):
+        """Append the current score of every measured interface to its history."""
+        now = time.time()
+        with self._lock:
+            for name, entry in self.metrics.items():
+                score = self._score_locked(name)
+                if score is not None:
+                    entry["history"].append((now, score))
+    
+    def get_metrics(self) -> Dict[str, Dict[str, Any]]:
+        """Measured metrics, current score and score history per interface."""
+        with self._lock:
+            return {name: dict(entry, history=list(entry["history"]), score=self._score_locked(name))
+                    for name, entry in self.metrics.items()}
+    
+    def get_selected(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self.selected_interfaces)
+    
+    def get_selected_interface(self, name: str) -> Optional[Dict[str, Any]]:
+        """Return the selected interface with this name, if any."""
+        with self._lock:
+            return next((iface for iface in self.selected_interfaces if iface["name"] == name), None)
+    
+    def set_weight(self, name: str, weight: float):
+        """Static share of new connections for an interface in the load-aware modes (0 = only as a last resort)."""
+        weight = float(weight)
+        if not math.isfinite(weight):
+            raise ValueError(f"weight for {name} must be finite, got {weight}")
+        with self._lock:
+            self.weights[name] = max(weight, 0.0)
+    
+    def get_weight(self, name: str) -> float:
+        return self.weights.get(name, 1.0)
+    
+    def _weighted_locked(self, candidates: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # Smooth weighted round robin: picks interleave instead of coming in bursts per interface
+        total = 0.0
+        for iface in candidates:
+            weight = self.get_weight(iface["name"])
+            self.wrr_credit[iface["name"]] = self.wrr_credit.get(iface["name"], 0.0) + weight
+            total += weight
+        iface = max(candidates, key=lambda x: self.wrr_credit[x["name"]])
+        self.wrr_credit[iface["name"]] -= total
+        return iface
+    
+    def get_next_interface(self, mode: str = "round_robin",
+                           loads: Optional[Dict[str, Dict[str, float]]] = None,
+                           candidates: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """Get next interface based on load balancing mode.
+        
+        loads maps interface name to its current {"connections", "outstanding"} (bytes in flight);
+        candidates restricts the choice to these interface names.
+        """
+        with self._lock:
+            selected = self.selected_interfaces
+            if candidates is not None:
+                selected = [iface for iface in selected if iface["name"] in candidates]
+            if not selected:
+                return None
+            loads = loads or {}
+            
+            def usage(iface: Dict[str, Any], key: str) -> float:
+                return loads.get(iface["name"], {}).get(key, 0)
+            
+            def per_weight(iface: Dict[str, Any], cost: float) -> float:
+                weight = self.get_weight(iface["name"])
+                return cost / weight if weight > 0 else float("inf")
+            
+            if mode not in self.MODES and mode not in self.unknown_modes:
+                self.unknown_modes.add(mode)
+                logger.warning(f"Unknown load balancing mode '{mode}', using round_robin")
+            
+            if mode == "random":
+                return random.choice(selected)
+            
+            elif mode == "fastest":
+                # Measured score first; the NIC link speed only orders links never measured
+                return max(selected,
+                           key=lambda x: (self._score_locked(x["name"]) or 0.0, x.get("speed", 0)))
+            
+            elif mode == "weighted":
+                return self._weighted_locked(selected)
+            
+            elif mode == "least_connections":
+                # Connections per unit of weight, counting the one about to be added
+                return min(selected, key=lambda x: (per_weight(x, usage(x, "connections") + 1),
+                                                    -self.get_weight(x["name"])))
+            
+            elif mode == "least_bytes":
+                return min(selected, key=lambda x: (per_weight(x, usage(x, "outstanding") + 65536),
+                                                    per_weight(x, usage(x, "connections") + 1)))
+            
+            elif mode == "p2c":
+                if len(selected) == 1:
+                    return selected[0]
+                first, second = random.sample(selected, 2)
+                cost = lambda x: per_weight(x, usage(x, "connections") + 1 + usage(x, "outstanding") / 65536)
+                return first if cost(first) <= cost(second) else second
+            
+            else:
+                iface = selected[self.current_index % len(selected)]
+                self.current_index += 1
+                return iface
+
+class InterfaceScorer:
+    """Feeds NetworkInterfaceManager with measured RTT, throughput, retransmits and failures per interface."""
+    
+    PROBE_TIMEOUT = 3.0
+    
+    def __init__(self, iface_manager: 'NetworkInterfaceManager',
+                 transports: Callable[[], List[Tuple[str, Any]]],
+                 traffic: Callable[[], Dict[str, Dict[str, int]]],
+                 probe_target: Optional[Tuple[str, int]] = None, interval=5.0, probe_interval=15.0,
+                 subflows: Optional[Callable[[], List[Dict[str, Any]]]] = None):
+        self.iface_manager = iface_manager
+        self.transports = transports
+        self.traffic = traffic
+        # MPTCP subflows (each with its interface and tcp_info) count like tunnel sockets
+        self.subflows = subflows
+        # Opt-in neutral host:port for links without a transport; never the SSH server itself,
+        # whose sshd would log every probe as a preauth disconnect and count it against MaxStartups
+        self.probe_target = probe_target
+        self.interval = interval
+        self.probe_interval = probe_interval
+        # name -> (timestamp, tunnel bytes) at the previous round
+        self.last_bytes: Dict[str, Tuple[float, int]] = {}
+        # (name, socket id or subflow address) -> (total_retrans, segs_out) at the previous round
+        self.last_tcp: Dict[Tuple[str, Any], Tuple[int, int]] = {}
+        self.last_probe: Dict[str, float] = {}
+        # name -> [start time, already counted as failed] of the one probe in flight per interface
+        self.pending_probes: Dict[str, list] = {}
+        self._lock = threading.Lock()
+        self.last_sample = 0.0
+        self.is_running = False
+        self.scorer_thread = None
+        self._stop_event = threading.Event()
+    
+    @staticmethod
+    def parse_tcp_info(raw: bytes) -> Optional[Dict[str, float]]:
+        """Smoothed RTT (ms), retransmit and byte counters from a Linux struct tcp_info."""
+        if len(raw) < 144:
+            return None
+        # 8 x u8, 24 x u32 (tcpi_rtt is the 16th, total_retrans the 24th), 4 x u64 from 104, then segs_out at 136
+        fields = struct.unpack_from('=8B24I', raw)
+        bytes_acked, bytes_received = struct.unpack_from('=QQ', raw, 120)
+        segs_out = struct.unpack_from('=I', raw, 136)[0]
+        return {"rtt_ms": fields[8 + 15] / 1000, "total_retrans": fields[8 + 23], "segs_out": segs_out,
+                "bytes_acked": bytes_acked, "bytes_received": bytes_received}
+    
+    @classmethod
+    def tcp_info(cls, sock: socket.socket) -> Optional[Dict[str, float]]:
+        """TCP_INFO of a socket on Linux; None elsewhere."""
+        if not hasattr(socket, "TCP_INFO"):
+            return None
+        try:
+            return cls.parse_tcp_info(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 256))
+        except OSError:
+            return None
+    
+    def start(self):
+        if self.is_running:
+            return
+        self.is_running = True
+        self._stop_event.clear()
+        self.scorer_thread = threading.Thread(target=self._score_loop, daemon=True, name="IfaceScorer")
+        self.scorer_thread.start()
+    
+    def stop(self):
+        self.is_running = False
+        self._stop_event.set()
+        if self.scorer_thread:
+            self.scorer_thread.join(timeout=3)
+    
+    def sample(self):
+        """One round: TCP_INFO of live tunnel sockets, tunnel byte rates, probes for idle links."""
+        now = time.time()
+        measured = set()
+        transports = self.transports()
+        samples = [(name, id(transport.sock), self.tcp_info(transport.sock)) for name, transport in transports
+                   if isinstance(transport.sock, socket.socket)]
+        if self.subflows:
+            samples += [(subflow["interface"], subflow["local"], subflow) for subflow in self.subflows()
+                        if subflow.get("interface")]
+        for name, key, info in samples:
+            if not info:
+                continue
+            measured.add(name)
+            if info["rtt_ms"] > 0:
+                self.iface_manager.record_rtt(name, info["rtt_ms"])
+            key = (name, key)
+            previous = self.last_tcp.get(key)
+            self.last_tcp[key] = (info["total_retrans"], info["segs_out"])
+            if previous and info["segs_out"] > previous[1]:
+                retrans = max(info["total_retrans"] - previous[0], 0)
+                self.iface_manager.record_loss(name, retrans / (info["segs_out"] - previous[1]))
+        
+        for name, counts in self.traffic().items():
+            total = counts["sent"] + counts["received"]
+            # An interface first seen this round carried all of its bytes since the previous round
+            previous = self.last_bytes.get(name, (self.last_sample, 0) if self.last_sample else None)
+            self.last_bytes[name] = (now, total)
+            if previous and now > previous[0]:
+                self.iface_manager.record_throughput(name, (total - previous[1]) / (now - previous[0]))
+        self.last_sample = now
+        
+        # Links without TCP_INFO are timed with an SSH keepalive on their own transport; links
+        # without a transport get a TCP connect probe only if a neutral target is configured
+        self._expire_probes(now)
+        by_interface = dict(transports)
+        for iface in self.iface_manager.get_selected():
+            name = iface["name"]
+            if name in measured or now - self.last_probe.get(name, 0) < self.probe_interval:
+                continue
+            if name in by_interface:
+                self.last_probe[name] = now
+                self._start_probe(name, lambda transport=by_interface[name]: self._keepalive(transport))
+            elif self.probe_target:
+                self.last_probe[name] = now
+                self._start_probe(name, lambda ip=iface["ip"]: self._connect(ip))
+        
+        self.iface_manager.snapshot_scores()
+    
+    def _start_probe(self, name: str, probe: Callable[[], bool]):
+        """Run a probe off the scoring thread; an interface whose last probe is still out is skipped."""
+        with self._lock:
+            if name in self.pending_probes:
+                return
+            self.pending_probes[name] = [time.time(), False]
+        threading.Thread(target=self._run_probe, args=(name, probe), daemon=True, name=f"Probe-{name}").start()
+    
+    def _run_probe(self, name: str, probe: Callable[[], bool]):
+        start_time = time.time()
+        try:
+            ok = probe()
+        except Exception as e:
+            logger.debug(f"Probe via {name} failed: {e}")
+            ok = False
+        with self._lock:
+            entry = self.pending_probes.pop(name, None)
+        # A late answer was already counted as a failure by _expire_probes
+        if entry is None or entry[1]:
+            return
+        if ok:
+            self.iface_manager.record_rtt(name, (time.time() - start_time) * 1000)
+        self.iface_manager.record_result(name, ok)
+    
+    def _expire_probes(self, now: float):
+        """Count probes unanswered after PROBE_TIMEOUT as failures; they stay pending until they return."""
+        with self._lock:
+            expired = [name for name, entry in self.pending_probes.items()
+                       if not entry[1] and now - entry[0] > self.PROBE_TIMEOUT]
+            for name in expired:
+                self.pending_probes[name][1] = True
+        for name in expired:
+            self.iface_manager.record_result(name, False)
+    
+    @staticmethod
+    def _keepalive(transport) -> bool:
+        """Keepalive global request; any reply (even a refusal) is the pong.
+        
+        paramiko waits for it without a timeout and keeps a single reply slot per transport,
+        which is why only one probe per interface may be in flight.
+        """
+        transport.global_request("keepalive@openssh.com", wait=True)
+        return transport.is_active()
+    
+    def _connect(self, ip: str) -> bool:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.PROBE_TIMEOUT)
+            sock.bind((ip, 0))
+            sock.connect(self.probe_target)
+        return True
+    
+    def _score_loop(self):
+        while self.is_running:
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Interface scoring error: {e}")
+            self._stop_event.wait(self.interval)
+
+class InterfaceWatcher:
+    """Follows link and IPv4 address changes: rtnetlink events on Linux, polling elsewhere."""
+    
+    RTMGRP_LINK = 0x1
+    RTMGRP_IPV4_IFADDR = 0x10
+    
+    def __init__(self, iface_manager: 'NetworkInterfaceManager',
+                 on_change: Callable[[Dict[str, List[Dict[str, Any]]]], None],
+                 poll_interval=1.0, rescan_interval=30.0, settle=0.05):
+        self.iface_manager = iface_manager
+        self.on_change = on_change
+        # Without netlink a dead link is noticed within one poll
+        self.poll_interval = poll_interval
+        # With netlink, a periodic rescan covers events lost to a full socket buffer
+        self.rescan_interval = rescan_interval
+        # Events come in bursts (link down, then its addresses); rescan once they settle
+        self.settle = settle
+        self.events = 0
+        self.mode = None
+        self.is_running = False
+        self.watch_thread = None
+        self._stop_event = threading.Event()
+    
+    def _open_netlink(self) -> Optional[socket.socket]:
+        if not hasattr(socket, "AF_NETLINK"):
+            return None
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            sock.bind((0, self.RTMGRP_LINK | self.RTMGRP_IPV4_IFADDR))
+            sock.setblocking(False)
+            return sock
+        except OSError as e:
+            logger.warning(f"rtnetlink unavailable, polling interfaces instead: {e}")
+            return None
+    
+    @staticmethod
+    def _drain(sock: socket.socket) -> int:
+        """Discard queued notifications; the rescan reads the resulting state anyway."""
+        count = 0
+        while True:
+            try:
+                sock.recv(65536)
+                count += 1
+            except (BlockingIOError, InterruptedError):
+                return count
+            except OSError:
+                # ENOBUFS: notifications were dropped, which the rescan makes up for
+                count += 1
+    
+    def start(self):
+        if self.is_running:
+            return
+        self.is_running = True
+        self._stop_event.clear()
+        self.watch_thread = threading.Thread(target=self._watch_loop, daemon=True, name="IfaceWatcher")
+        self.watch_thread.start()
+    
+    def stop(self):
+        self.is_running = False
+        self._stop_event.set()
+        if self.watch_thread:
+            self.watch_thread.join(timeout=3)
+    
+    def check(self):
+        """Rescan now and report any change of the selected interfaces."""
+        change = self.iface_manager.refresh_interfaces()
+        if any(change.values()):
+            self.on_change(change)
+    
+    def _watch_loop(self):
+        sock = self._open_netlink()
+        self.mode = "netlink" if sock else "polling"
+        logger.info(f"Interface watcher started ({self.mode})")
+        last_scan = time.time()
+        try:
+            while self.is_running:
+                try:
+                    if sock:
+                        readable, _, _ = select.select([sock], [], [], 1.0)
+                        if readable:
+                            self.events += self._drain(sock)
+                            self._stop_event.wait(self.settle)
+                            self.events += self._drain(sock)
+                        elif time.time() - last_scan < self.rescan_interval:
+                            continue
+                    elif self._stop_event.wait(self.poll_interval):
+                        break
+                    last_scan = time.time()
+                    self.check()
+                except Exception as e:
+                    logger.error(f"Interface watcher error: {e}")
+                    self._stop_event.wait(1.0)
+        finally:
+            if sock:
+                sock.close()
+
+# ================= MPTCP =================
+class MPTCPManager:
+    """Kernel Multipath TCP for the SSH socket: subflow endpoints per interface and per-subflow statistics."""
+    
+    def __init__(self):
+        # Endpoint addresses this session added (and will remove)
+        self.endpoints: Dict[str, str] = {}
+        # System-wide path manager limits as found before this session raised them
+        self.saved_limits: Optional[Dict[str, str]] = None
+        self._lock = threading.Lock()
+        self._libc = None
+    
+    @staticmethod
+    def supported() -> bool:
+        """Linux with net.mptcp.enabled = 1."""
+        try:
+            with open("/proc/sys/net/mptcp/enabled", "r") as f:
+                return f.read().strip() == "1"
+        except OSError:
+            return False
+    
+    @staticmethod
+    def create_socket(family=socket.AF_INET) -> Tuple[socket.socket, bool]:
+        """An MPTCP stream socket if the kernel allows it, else plain TCP; returns (socket, is_mptcp)."""
+        try:
+            return socket.socket(family, socket.SOCK_STREAM, IPPROTO_MPTCP), True
+        except OSError as e:
+            logger.debug(f"MPTCP socket unavailable, using TCP: {e}")
+            return socket.socket(family, socket.SOCK_STREAM), False
+    
+    @staticmethod
+    def info(sock: socket.socket) -> Optional[Dict[str, int]]:
+        """struct mptcp_info of a connected socket, or None once it fell back to plain TCP."""
+        try:
+            raw = sock.getsockopt(SOL_MPTCP, MPTCP_INFO, 128)
+        except OSError:
+            return None
+        if len(raw) < struct.calcsize('@6BIIQQQ'):
+            return None
+        fields = struct.unpack_from('@6BIIQQQ', raw)
+        # "subflows" counts the path manager's additional subflows, not the initial one
+        info = {"subflows": fields[0], "add_addr_signal": fields[1], "add_addr_accepted": fields[2],
+                "subflows_max": fields[3], "flags": fields[6]}
+        # Kernel 6.x appends retransmit and byte counters
+        if len(raw) >= struct.calcsize('@6BIIQQQBBBIQQQQ'):
+            extra = struct.unpack_from('@6BIIQQQBBBIQQQQ', raw)
+            info.update(retransmits=extra[14], bytes_sent=extra[16], bytes_received=extra[17])
+        return info
+    
+    def _subflow_data(self, sock: socket.socket, optname: int, entry_size: int, max_subflows=8) -> List[bytes]:
+        # struct mptcp_subflow_data is an in/out header the socket module cannot pass, hence libc
+        import ctypes
+        if self._libc is None:
+            self._libc = ctypes.CDLL(None, use_errno=True)
+        header = struct.calcsize('=4I')
+        buf = ctypes.create_string_buffer(header + entry_size * max_subflows)
+        struct.pack_into('=4I', buf, 0, header, 0, 0, entry_size)
+        optlen = ctypes.c_uint32(len(buf))
+        if self._libc.getsockopt(sock.fileno(), SOL_MPTCP, optname, buf, ctypes.byref(optlen)) != 0:
+            errno_value = ctypes.get_errno()
+            raise OSError(errno_value, os.strerror(errno_value))
+        _, count, _, size_user = struct.unpack_from('=4I', buf)
+        raw = buf.raw
+        return [raw[header + i * size_user:header + (i + 1) * size_user] for i in range(min(count, max_subflows))]
     
-    def stop(self):
-        """Stop health monitoring."""
-        self.is_running = False
-        if self.monitor_thread:
-            self.monitor_thread.join(timeout=2)
+    @staticmethod
+    def _sockaddr(raw: bytes) -> Optional[Tuple[str, int]]:
+        family = struct.unpack_from('=H', raw)[0]
+        if family == socket.AF_INET:
+            return socket.inet_ntop(socket.AF_INET, raw[4:8]), struct.unpack_from('!H', raw, 2)[0]
+        if family == socket.AF_INET6:
+            return socket.inet_ntop(socket.AF_INET6, raw[8:24]), struct.unpack_from('!H', raw, 2)[0]
+        return None
     
-    def _monitor_loop(self):
-        """Monitor connection health loop."""
-        while self.is_running:
-            time.sleep(self.check_interval)
-            if not self.is_healthy():
-                logger.warning("Connection health check failed")
+    def subflows(self, sock: socket.socket) -> List[Dict[str, Any]]:
+        """Local/remote address and tcp_info counters of each subflow (kernel 5.16+); [] otherwise."""
+        try:
+            addrs = self._subflow_data(sock, MPTCP_SUBFLOW_ADDRS, 256)
+            infos = self._subflow_data(sock, MPTCP_TCPINFO, 256)
+        except (OSError, AttributeError) as e:
+            logger.debug(f"MPTCP subflow query failed: {e}")
+            return []
+        result = []
+        for addr, raw in zip(addrs, infos):
+            info = InterfaceScorer.parse_tcp_info(raw)
+            if info:
+                info.update(local=self._sockaddr(addr[:128]), remote=self._sockaddr(addr[128:256]))
+                result.append(info)
+        return result
     
-    def reset(self):
-        """Reset health monitor."""
+    @staticmethod
+    def _ip(*args: str) -> subprocess.CompletedProcess:
+        """Run `ip mptcp ...`; a missing iproute2 or a hung call comes back as a failed result."""
+        try:
+            return subprocess.run(["ip", "mptcp", *args], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                  text=True, timeout=5)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            return subprocess.CompletedProcess(["ip", "mptcp", *args], 127, "", f"ip mptcp unavailable: {e}")
+    
+    def _limits(self) -> Dict[str, str]:
+        """Current limits as {name: value}, from `ip mptcp limits show`."""
+        fields = (self._ip("limits", "show").stdout or "").split()
+        return dict(zip(fields[::2], fields[1::2]))
+    
+    def configure_endpoints(self, interfaces: List[Dict[str, Any]]) -> List[str]:
+        """Make each interface a subflow endpoint (needs CAP_NET_ADMIN); returns the errors, if any."""
+        errors = []
+        wanted = {iface["ip"]: iface["name"] for iface in interfaces}
         with self._lock:
-            self.rtt_history.clear()
-            self.unhealthy_count = 0
+            # The path manager only opens as many subflows as its limit allows
+            limits = self._limits()
+            if int(limits.get("subflows", 0)) < len(wanted):
+                result = self._ip("limits", "set", "subflows", str(min(max(len(wanted), 2), 8)),
+                                  "add_addr_accepted", str(min(max(len(wanted), 2), 8)))
+                if result.returncode != 0:
+                    errors.append(result.stderr.strip() or "ip mptcp limits failed")
+                elif self.saved_limits is None:
+                    self.saved_limits = limits
+            for ip, name in list(self.endpoints.items()):
+                if wanted.get(ip) != name:
+                    self._delete_endpoint(ip)
+            for ip, name in wanted.items():
+                if ip in self.endpoints:
+                    continue
+                result = self._ip("endpoint", "add", ip, "dev", name, "subflow")
+                if result.returncode == 0:
+                    self.endpoints[ip] = name
+                elif "exists" not in result.stderr.lower():
+                    errors.append(f"{name}: {result.stderr.strip() or 'ip mptcp endpoint failed'}")
+        return errors
+    
+    def _delete_endpoint(self, ip: str):
+        shown = self._ip("endpoint", "show").stdout or ""
+        for line in shown.splitlines():
+            parts = line.split()
+            if parts and parts[0] == ip and "id" in parts:
+                self._ip("endpoint", "delete", "id", parts[parts.index("id") + 1])
+        self.endpoints.pop(ip, None)
+    
+    def remove_endpoints(self):
+        """Remove the endpoints this session added and put the limits back as they were."""
+        with self._lock:
+            for ip in list(self.endpoints):
+                try:
+                    self._delete_endpoint(ip)
+                except Exception as e:
+                    logger.debug(f"Could not remove MPTCP endpoint {ip}: {e}")
+            if self.saved_limits is not None:
+                args = [arg for name in ("subflows", "add_addr_accepted") if name in self.saved_limits
+                        for arg in (name, self.saved_limits[name])]
+                result = self._ip("limits", "set", *args)
+                if result.returncode != 0:
+                    logger.debug(f"Could not restore MPTCP limits: {result.stderr.strip()}")
+                self.saved_limits = None
 
-# ================= NETWORK INTERFACE MANAGER =================
-class NetworkInterfaceManager:
-    """Manages multiple network interfaces for WAN bonding."""
+# ================= NETWORK PROFILE CACHE =================
+class NetworkProfileCache:
+    """Expensive measurements (resolver, server address, interface, cipher) remembered per network."""
     
-    def __init__(self):
-        self.interfaces = []
-        self.selected_interfaces = []
-        self.current_index = 0
-        self.load_balancing_mode = "round_robin"
+    def __init__(self, path: str = NETWORK_PROFILE_FILE, max_profiles=32):
+        self.path = path
+        self.max_profiles = max_profiles
+        self.profiles: Dict[str, Dict[str, Any]] = {}
         self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding='utf-8') as f:
+                self.profiles = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable network profile cache: {e}")
     
-    def scan_interfaces(self) -> List[Dict[str, Any]]:
-        """Scan and return available network interfaces."""
-        interfaces = []
-        
+    @staticmethod
+    def _default_gateway() -> Tuple[str, str]:
+        """(gateway ip, gateway mac) of the IPv4 default route; empty strings where unknown."""
+        gateway = mac = ""
         try:
-            addrs = psutil.net_if_addrs()
-            stats = psutil.net_if_stats()
-            
-            for iface_name, addr_list in addrs.items():
-                if iface_name in stats and stats[iface_name].isup:
-                    for addr in addr_list:
-                        if addr.family == socket.AF_INET:
-                            # Determine interface type
-                            iface_type = "Unknown"
-                            if "Wi-Fi" in iface_name or "wlan" in iface_name.lower():
-                                iface_type = "Wi-Fi"
-                            elif "Ethernet" in iface_name or "eth" in iface_name.lower():
-                                iface_type = "Ethernet"
-                            elif "LTE" in iface_name or "wwan" in iface_name.lower():
-                                iface_type = "LTE/4G"
-                            
-                            interfaces.append({
-                                "name": iface_name,
-                                "ip": addr.address,
-                                "netmask": addr.netmask,
-                                "type": iface_type,
-                                "mtu": stats[iface_name].mtu,
-                                "speed": stats[iface_name].speed,
-                                "enabled": False
-                            })
-            
-            self.interfaces = interfaces
-            logger.info(f"Found {len(interfaces)} network interface(s)")
-            return interfaces
-            
+            with open("/proc/net/route") as f:
+                for line in f.readlines()[1:]:
+                    fields = line.split()
+                    if len(fields) > 2 and fields[1] == "00000000":
+                        gateway = socket.inet_ntoa(struct.pack('<I', int(fields[2], 16)))
+                        break
+            with open("/proc/net/arp") as f:
+                for line in f.readlines()[1:]:
+                    fields = line.split()
+                    if fields and fields[0] == gateway:
+                        mac = fields[3]
+                        break
+        except (OSError, ValueError):
+            # Not Linux: the interface set alone keys the profile
+            pass
+        return gateway, mac
+    
+    @classmethod
+    def fingerprint(cls) -> str:
+        """Key for the network we are on: default gateway MAC plus the set of local IPv4 networks."""
+        gateway, mac = cls._default_gateway()
+        networks = []
+        try:
+            for name, addrs in psutil.net_if_addrs().items():
+                for addr in addrs:
+                    if addr.family == socket.AF_INET and addr.netmask and not addr.address.startswith("127."):
+                        network = ipaddress.ip_network(f"{addr.address}/{addr.netmask}", strict=False)
+                        networks.append(f"{name}={network}")
         except Exception as e:
-            logger.error(f"Interface scan error: {e}")
-            return []
+            logger.debug(f"Interface enumeration for fingerprint failed: {e}")
+        material = "|".join([gateway, mac] + sorted(networks))
+        return hashlib.sha256(material.encode()).hexdigest()[:16]
     
-    def set_selected_interfaces(self, selected: List[Dict[str, Any]]):
-        """Set selected interfaces for WAN bonding."""
+    def get(self, fingerprint: str) -> Optional[Dict[str, Any]]:
         with self._lock:
-            self.selected_interfaces = [iface for iface in selected if iface.get('enabled', False)]
-            logger.info(f"Selected {len(self.selected_interfaces)} interfaces for WAN bonding")
+            profile = self.profiles.get(fingerprint)
+            return dict(profile) if profile else None
     
-    def get_next_interface(self, mode: str = "round_robin") -> Optional[Dict[str, Any]]:
-        """Get next interface based on load balancing mode."""
+    def update(self, fingerprint: str, **choices):
+        """Merge measured choices into a network's profile and persist it."""
         with self._lock:
-            if not self.selected_interfaces:
-                return None
-            
-            if mode == "round_robin":
-                iface = self.selected_interfaces[self.current_index % len(self.selected_interfaces)]
-                self.current_index += 1
-                return iface
-            
-            elif mode == "random":
-                return random.choice(self.selected_interfaces)
-            
-            elif mode == "fastest":
-                return max(self.selected_interfaces, key=lambda x: x.get("speed", 0))
-            
-            else:
-                return self.selected_interfaces[0] if self.selected_interfaces else None
+            profile = self.profiles.setdefault(fingerprint, {})
+            profile.update({key: value for key, value in choices.items() if value is not None})
+            profile["updated"] = time.time()
+            if len(self.profiles) > self.max_profiles:
+                oldest = sorted(self.profiles, key=lambda key: self.profiles[key].get("updated", 0))
+                for key in oldest[:len(self.profiles) - self.max_profiles]:
+                    del self.profiles[key]
+            self._save_locked()
+    
+    def forget(self, fingerprint: str):
+        with self._lock:
+            if self.profiles.pop(fingerprint, None) is not None:
+                self._save_locked()
+    
+    def _save_locked(self):
+        try:
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w", encoding='utf-8') as f:
+                json.dump(self.profiles, f, indent=2)
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            logger.warning(f"Could not save network profile cache: {e}")
 
 # ================= TRAFFIC STATISTICS =================
+class ShardedCounter:
+    """Counter with a private cell per thread, so writers never take a lock."""
+    
+    def __init__(self):
+        self._local = threading.local()
+        self._registry_lock = threading.Lock()
+        # (total folded in from finished threads, ((thread, cell), ...)), swapped atomically
+        self._state = (0, ())
+        self._offset = 0
+    
+    def _register(self) -> List[int]:
+        cell = [0]
+        with self._registry_lock:
+            retired, shards = self._state
+            self._state = (retired, shards + ((threading.current_thread(), cell),))
+        self._local.cell = cell
+        return cell
+    
+    def add(self, amount: int = 1):
+        """Add to the calling thread's cell (lock-free after its first call)."""
+        try:
+            cell = self._local.cell
+        except AttributeError:
+            cell = self._register()
+        cell[0] += amount
+    
+    def _raw(self) -> int:
+        retired, shards = self._state
+        return retired + sum(cell[0] for _, cell in shards)
+    
+    def value(self) -> int:
+        """Current total across all threads."""
+        return self._raw() - self._offset
+    
+    def collect(self):
+        """Fold cells of finished threads into the retired total."""
+        with self._registry_lock:
+            retired, shards = self._state
+            # One is_alive() per shard: a thread exiting mid-scan must land in exactly one group
+            alive, dead = [], []
+            for shard in shards:
+                (alive if shard[0].is_alive() else dead).append(shard)
+            if dead:
+                retired += sum(cell[0] for thread, cell in dead)
+                self._state = (retired, tuple(alive))
+    
+    def reset(self):
+        """Start counting from zero again without touching the writers' cells.
+        
+        Only for monotonic totals: a gauge would go negative as work started before the reset ends.
+        """
+        with self._registry_lock:
+            self._offset = self._raw()
+
 class TrafficStats:
     """Track network traffic statistics."""
     
     def __init__(self):
-        self.bytes_sent = 0
-        self.bytes_received = 0
-        self.connections_total = 0
-        self.connections_active = 0
-        self.failed_connections = 0
+        # Hot-path counters are sharded per thread; only the collector and reset lock
+        self._bytes_sent = ShardedCounter()
+        self._bytes_received = ShardedCounter()
+        self._connections_total = ShardedCounter()
+        self._connections_active = ShardedCounter()
+        self._failed_connections = ShardedCounter()
+        # Time to first byte per connection, split by SOCKS reply mode
+        self.ttfb_samples = {"fast_open": deque(maxlen=200), "standard": deque(maxlen=200)}
+        # Tunnel bytes per bound interface: name -> (sent, received)
+        self.interface_bytes: Dict[str, Tuple[ShardedCounter, ShardedCounter]] = {}
         self.start_time = time.time()
         self.upload_speed = 0.0
         self.download_speed = 0.0
@@ -433,40 +2571,68 @@ class TrafficStats:
         self.is_running = False
         self.monitor_thread = None
     
+    def _counters(self) -> List[ShardedCounter]:
+        """Monotonic totals; the active-connections gauge is left out so reset() never re-bases it."""
+        counters = [self._bytes_sent, self._bytes_received, self._connections_total,
+                    self._failed_connections]
+        for pair in list(self.interface_bytes.values()):
+            counters.extend(pair)
+        return counters
+    
+    def interface_counters(self, name: str) -> Tuple[ShardedCounter, ShardedCounter]:
+        """(sent, received) counters for one interface, created on first use."""
+        pair = self.interface_bytes.get(name)
+        if pair is None:
+            with self._lock:
+                pair = self.interface_bytes.setdefault(name, (ShardedCounter(), ShardedCounter()))
+        return pair
+    
     def add_sent(self, bytes_count: int):
-        with self._lock:
-            self.bytes_sent += bytes_count
+        self._bytes_sent.add(bytes_count)
     
     def add_received(self, bytes_count: int):
-        with self._lock:
-            self.bytes_received += bytes_count
+        self._bytes_received.add(bytes_count)
     
     def increment_connection(self):
-        with self._lock:
-            self.connections_total += 1
-            self.connections_active += 1
+        self._connections_total.add(1)
+        self._connections_active.add(1)
     
     def decrement_connection(self):
-        with self._lock:
-            self.connections_active = max(0, self.connections_active - 1)
+        self._connections_active.add(-1)
     
     def increment_failed(self):
+        self._failed_connections.add(1)
+    
+    def record_ttfb(self, ttfb_ms: float, fast_open: bool):
+        """Record request-to-first-response-byte time for one connection."""
         with self._lock:
-            self.failed_connections += 1
+            self.ttfb_samples["fast_open" if fast_open else "standard"].append(ttfb_ms)
+    
+    def _average_ttfb(self, mode: str) -> Optional[float]:
+        samples = list(self.ttfb_samples[mode])
+        return sum(samples) / len(samples) if samples else None
     
     def get_stats(self) -> Dict[str, Any]:
-        with self._lock:
-            uptime = time.time() - self.start_time
-            return {
-                "bytes_sent": self.bytes_sent,
-                "bytes_received": self.bytes_received,
-                "connections_total": self.connections_total,
-                "connections_active": self.connections_active,
-                "failed_connections": self.failed_connections,
-                "uptime": uptime,
-                "upload_speed": self.upload_speed,
-                "download_speed": self.download_speed
-            }
+        """Snapshot of all counters; never blocks writers."""
+        uptime = time.time() - self.start_time
+        return {
+            "bytes_sent": self._bytes_sent.value(),
+            "bytes_received": self._bytes_received.value(),
+            "connections_total": self._connections_total.value(),
+            "connections_active": max(0, self._connections_active.value()),
+            "failed_connections": self._failed_connections.value(),
+            "uptime": uptime,
+            "upload_speed": self.upload_speed,
+            "download_speed": self.download_speed,
+            "ttfb_fast_open_ms": self._average_ttfb("fast_open"),
+            "ttfb_standard_ms": self._average_ttfb("standard"),
+            "interfaces": self.get_interface_bytes()
+        }
+    
+    def get_interface_bytes(self) -> Dict[str, Dict[str, int]]:
+        """Tunnel bytes sent/received per bound interface."""
+        return {name: {"sent": sent.value(), "received": received.value()}
+                for name, (sent, received) in list(self.interface_bytes.items())}
     
     def start(self):
         """Start speed monitoring."""
@@ -481,35 +2647,40 @@ class TrafficStats:
             self.monitor_thread.join(timeout=2)
     
     def _calculate_speeds(self):
-        """Calculate upload/download speeds."""
+        """Calculate upload/download speeds and fold counters of finished threads."""
         while self.is_running:
             time.sleep(1)
             
+            for counter in self._counters() + [self._connections_active]:
+                counter.collect()
+            
             current_time = time.time()
             with self._lock:
                 time_diff = current_time - self.last_update_time
                 
                 if time_diff > 0:
-                    upload_diff = self.bytes_sent - self.last_upload_bytes
-                    download_diff = self.bytes_received - self.last_download_bytes
+                    bytes_sent = self._bytes_sent.value()
+                    bytes_received = self._bytes_received.value()
                     
-                    self.upload_speed = upload_diff / time_diff
-                    self.download_speed = download_diff / time_diff
+                    self.upload_speed = (bytes_sent - self.last_upload_bytes) / time_diff
+                    self.download_speed = (bytes_received - self.last_download_bytes) / time_diff
                     
-                    self.last_upload_bytes = self.bytes_sent
-                    self.last_download_bytes = self.bytes_received
+                    self.last_upload_bytes = bytes_sent
+                    self.last_download_bytes = bytes_received
                     self.last_update_time = current_time
     
     def reset(self):
         with self._lock:
-            self.bytes_sent = 0
-            self.bytes_received = 0
-            self.connections_total = 0
-            self.connections_active = 0
-            self.failed_connections = 0
+            for counter in self._counters():
+                counter.reset()
             self.start_time = time.time()
             self.upload_speed = 0.0
             self.download_speed = 0.0
+            self.last_upload_bytes = 0
+            self.last_download_bytes = 0
+            self.last_update_time = time.time()
+            for samples in self.ttfb_samples.values():
+                samples.clear()
     
     @staticmethod
     def format_bytes(bytes_count: float) -> str:
@@ -520,6 +2691,85 @@ class TrafficStats:
             bytes_count /= 1024.0
         return f"{bytes_count:.2f} PB"
 
+# ================= RELAY BUFFERS =================
+class BufferPool:
+    """Pool of reusable bytearrays so steady-state forwarding allocates nothing."""
+    
+    def __init__(self, buffer_size: int = 65536, max_buffers: int = 512):
+        self.buffer_size = buffer_size
+        self.max_buffers = max_buffers
+        self.allocated = 0
+        self._free: List[bytearray] = []
+        self._lock = threading.Lock()
+    
+    def acquire(self) -> bytearray:
+        """Take a buffer from the pool, allocating only when it is empty."""
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+            self.allocated += 1
+        return bytearray(self.buffer_size)
+    
+    def release(self, buf: bytearray):
+        """Return a buffer for reuse by the next connection."""
+        with self._lock:
+            if len(self._free) < self.max_buffers:
+                self._free.append(buf)
+
+class AdaptiveReadSize:
+    """Read size that grows while a stream is bulk and shrinks when it turns interactive."""
+    
+    MIN_SIZE = 8192
+    
+    def __init__(self, max_size: int):
+        self.max_size = max(self.MIN_SIZE, max_size)
+        self.size = self.MIN_SIZE
+    
+    def update(self, received: int):
+        """Adjust the next read size from how much the last read returned."""
+        if received >= self.size:
+            self.size = min(self.size * 2, self.max_size)
+        elif received < self.size // 4:
+            self.size = max(self.size // 2, self.MIN_SIZE)
+
+class RelayQueue:
+    """Pending bytes for one relay direction, with high/low watermark hysteresis."""
+    
+    def __init__(self, high_watermark: int, low_watermark: int):
+        self.high_watermark = high_watermark
+        self.low_watermark = min(low_watermark, high_watermark)
+        self.pending = bytearray()
+        self.paused = False
+    
+    def __len__(self) -> int:
+        return len(self.pending)
+    
+    def push(self, data):
+        """Queue bytes the destination could not take yet."""
+        self.pending.extend(data)
+        if len(self.pending) >= self.high_watermark:
+            self.paused = True
+    
+    def flush(self, send: Callable) -> int:
+        """Write as much as send() accepts; resumes the producer below the low watermark."""
+        view = memoryview(self.pending)
+        try:
+            sent = send(view)
+        finally:
+            view.release()
+        if sent:
+            del self.pending[:sent]
+        if self.paused and len(self.pending) <= self.low_watermark:
+            self.paused = False
+        return sent
+
+def nonblocking_send(sock, data) -> int:
+    """send() on a non-blocking socket or channel, returning 0 instead of raising when full."""
+    try:
+        return sock.send(data)
+    except (BlockingIOError, InterruptedError, socket.timeout):
+        return 0
+
 # ================= CONNECTION LOGGER =================
 class ConnectionLogger:
     """Log and display last N connections."""
@@ -641,16 +2891,702 @@ class MultiHopSSH:
             self.cleanup()
             return None
     
-    def cleanup(self):
-        """Close all SSH connections in the chain."""
-        for client in reversed(self.clients):
+    def cleanup(self):
+        """Close all SSH connections in the chain."""
+        for client in reversed(self.clients):
+            try:
+                client.close()
+            except:
+                pass
+        self.clients = []
+
+# ================= WARM CHANNEL POOL =================
+class WarmChannelPool:
+    """Keeps pre-opened direct-tcpip channels ready for frequently requested destinations."""
+    
+    MAX_TRACKED = 1024
+    
+    def __init__(self, opener: Callable, per_destination=2, max_channels=32,
+                 hot_threshold=5, window=60, idle_timeout=20, refill_interval=1.0):
+        self.opener = opener
+        self.per_destination = per_destination
+        self.max_channels = max_channels
+        self.hot_threshold = hot_threshold
+        self.window = window
+        self.idle_timeout = idle_timeout
+        self.refill_interval = refill_interval
+        self.requests: Dict[Tuple[str, int], deque] = {}
+        self.idle: Dict[Tuple[str, int], deque] = {}
+        self.idle_count = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self.is_running = False
+        self.refill_thread = None
+    
+    def note_request(self, host: str, port: int):
+        """Record a request so repeatedly used destinations become hot."""
+        key = (host, port)
+        with self._lock:
+            stamps = self.requests.get(key)
+            if stamps is None:
+                if len(self.requests) >= self.MAX_TRACKED:
+                    return
+                stamps = self.requests[key] = deque(maxlen=self.hot_threshold * 4)
+            stamps.append(time.time())
+    
+    def take(self, host: str, port: int):
+        """Return a live pre-opened channel for the destination, or None."""
+        stale = []
+        channel = None
+        with self._lock:
+            entries = self.idle.get((host, port))
+            while entries:
+                candidate, _ = entries.popleft()
+                self.idle_count -= 1
+                if self._is_usable(candidate):
+                    channel = candidate
+                    break
+                stale.append(candidate)
+            if channel:
+                self.hits += 1
+            else:
+                self.misses += 1
+        self._close_all(stale)
+        if channel:
+            self._wakeup.set()
+        return channel
+    
+    def start(self):
+        """Start the background refill thread."""
+        if self.is_running:
+            return
+        self.is_running = True
+        self.refill_thread = threading.Thread(target=self._refill_loop, daemon=True, name="WarmPool")
+        self.refill_thread.start()
+    
+    def stop(self):
+        """Stop refilling and close every idle channel."""
+        self.is_running = False
+        self._wakeup.set()
+        if self.refill_thread:
+            self.refill_thread.join(timeout=2)
+        self.clear()
+    
+    def clear(self):
+        """Close all idle channels, e.g. after the SSH transport was replaced."""
+        with self._lock:
+            channels = [channel for entries in self.idle.values() for channel, _ in entries]
+            self.idle.clear()
+            self.idle_count = 0
+        self._close_all(channels)
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Get pool occupancy and hit counters."""
+        with self._lock:
+            return {"idle": self.idle_count, "destinations": len(self.idle),
+                    "hits": self.hits, "misses": self.misses}
+    
+    @staticmethod
+    def _is_usable(channel) -> bool:
+        transport = channel.get_transport()
+        return (not channel.closed and not channel.eof_received
+                and transport is not None and transport.is_active())
+    
+    @staticmethod
+    def _close_all(channels):
+        for channel in channels:
+            try:
+                channel.close()
+            except Exception:
+                pass
+    
+    def _plan(self) -> Tuple[list, list]:
+        """Evict idle channels and work out which destinations need refilling."""
+        now = time.time()
+        expired = []
+        wanted = []
+        with self._lock:
+            for key, entries in list(self.idle.items()):
+                kept = deque()
+                for channel, opened in entries:
+                    if now - opened < self.idle_timeout and self._is_usable(channel):
+                        kept.append((channel, opened))
+                    else:
+                        expired.append(channel)
+                self.idle_count -= len(entries) - len(kept)
+                if kept:
+                    self.idle[key] = kept
+                else:
+                    del self.idle[key]
+            
+            hot = []
+            for key, stamps in list(self.requests.items()):
+                recent = sum(1 for stamp in stamps if now - stamp < self.window)
+                if recent == 0:
+                    del self.requests[key]
+                elif recent >= self.hot_threshold:
+                    hot.append((recent, key))
+            
+            # Hottest destinations first so the global cap goes where it saves the most round trips
+            budget = self.max_channels - self.idle_count
+            for _, key in sorted(hot, reverse=True):
+                missing = self.per_destination - len(self.idle.get(key, ()))
+                for _ in range(max(0, min(missing, budget))):
+                    wanted.append(key)
+                    budget -= 1
+        return expired, wanted
+    
+    def _refill_loop(self):
+        """Refill pool loop."""
+        while self.is_running:
+            self._wakeup.wait(self.refill_interval)
+            self._wakeup.clear()
+            if not self.is_running:
+                break
+            
+            expired, wanted = self._plan()
+            self._close_all(expired)
+            for key in wanted:
+                if not self.is_running:
+                    break
+                try:
+                    channel = self.opener(*key)
+                except Exception as e:
+                    logger.debug(f"Warm channel open failed for {key[0]}:{key[1]}: {e}")
+                    # The destination has to prove itself hot again before we retry
+                    with self._lock:
+                        self.requests.pop(key, None)
+                    continue
+                if channel is None:
+                    break  # transport is down; retry on the next tick
+                with self._lock:
+                    if self.is_running and self.idle_count < self.max_channels:
+                        self.idle.setdefault(key, deque()).append((channel, time.time()))
+                        self.idle_count += 1
+                        channel = None
+                if channel is not None:
+                    self._close_all([channel])
+
+# ================= SSH TRANSPORT POOL =================
+class ChannelScheduler:
+    """Chooses the transport for a new channel: power of two choices, least outstanding bytes or least channels."""
+    
+    MODES = ("p2c", "least_bytes", "least_channels")
+    MAX_STICKY = 4096
+    
+    def __init__(self, mode="p2c", sticky=True, sticky_ttl=300, sticky_slack=1.5):
+        self.mode = mode if mode in self.MODES else "p2c"
+        self.sticky = sticky
+        self.sticky_ttl = sticky_ttl
+        # A sticky transport is kept while its cost stays within this factor of the best
+        self.sticky_slack = sticky_slack
+        # destination -> (member id, last use)
+        self.affinity: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self.decisions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def load(member: Dict[str, Any]) -> Dict[str, float]:
+        """Live (and opening) channels, bytes in flight (unacknowledged sends plus unread receives), stalled channels."""
+        channels = member["pending"]
+        outstanding = stalled = 0
+        for channel in list(member["channels"]):
+            if channel.closed:
+                continue
+            channels += 1
+            initial = member["initial_windows"].get(channel, channel.out_window_size)
+            outstanding += max(initial - channel.out_window_size, 0) + len(channel.in_buffer)
+            if channel.out_window_size == 0:
+                stalled += 1
+        return {"channels": channels, "outstanding": outstanding, "stalled": stalled}
+    
+    def cost(self, member: Dict[str, Any], load: Dict[str, float]) -> float:
+        """Comparable cost of one more channel; a stalled window counts like a busy megabyte."""
+        open_ms = member["open_ms"] or 0.0
+        return (load["outstanding"] / 65536 + load["channels"] + 16 * load["stalled"]
+                + open_ms / 50)
+    
+    def _count(self, reason: str, member: Dict[str, Any]):
+        self.decisions[reason] = self.decisions.get(reason, 0) + 1
+        member["picks"] += 1
+    
+    def select(self, alive: List[Dict[str, Any]], destination: Optional[str] = None) -> Dict[str, Any]:
+        """Pick a member from the live transports (all of them alive)."""
+        with self._lock:
+            if len(alive) == 1:
+                self._count("only", alive[0])
+                return alive[0]
+            
+            now = time.time()
+            loads = {id(member): self.load(member) for member in alive}
+            costs = {id(member): self.cost(member, loads[id(member)]) for member in alive}
+            best_cost = min(costs.values())
+            
+            if self.sticky and destination:
+                entry = self.affinity.get(destination)
+                if entry and now - entry[1] < self.sticky_ttl:
+                    member = next((m for m in alive if id(m) == entry[0]), None)
+                    if member is not None and costs[id(member)] <= best_cost * self.sticky_slack + 1:
+                        self.affinity[destination] = (entry[0], now)
+                        self.affinity.move_to_end(destination)
+                        self._count("sticky", member)
+                        return member
+            
+            if self.mode == "least_bytes":
+                member = min(alive, key=lambda m: (loads[id(m)]["outstanding"], loads[id(m)]["channels"]))
+            elif self.mode == "least_channels":
+                member = min(alive, key=lambda m: loads[id(m)]["channels"])
+            else:
+                first, second = random.sample(alive, 2)
+                member = first if costs[id(first)] <= costs[id(second)] else second
+            self._count(self.mode, member)
+            
+            if self.sticky and destination:
+                self.affinity[destination] = (id(member), now)
+                self.affinity.move_to_end(destination)
+                while len(self.affinity) > self.MAX_STICKY:
+                    self.affinity.popitem(last=False)
+            return member
+    
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.decisions)
+
+class SSHTransportPool:
+    """Several authenticated transports to the same server, so one packetizer thread is not the ceiling."""
+    
+    def __init__(self, connector: Optional[Callable[..., Tuple[paramiko.SSHClient, Optional[str]]]],
+                 min_transports=1, max_transports=1, channels_per_transport=16,
+                 idle_timeout=120, check_interval=10, scheduler: Optional[ChannelScheduler] = None,
+                 interface_picker: Optional[Callable[[Dict[str, Dict[str, float]]], Optional[str]]] = None):
+        self.connector = connector
+        self.scheduler = scheduler or ChannelScheduler()
+        # Multi-WAN: chooses the interface for a channel from per-interface loads before the scheduler picks a transport
+        self.interface_picker = interface_picker
+        self.min_transports = max(1, min_transports)
+        self.max_transports = max(self.min_transports, max_transports)
+        self.channels_per_transport = channels_per_transport
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        # Member 0 is the proxy's primary ssh_client; the others are owned by the pool
+        self.members: List[Dict[str, Any]] = []
+        # Multi-WAN bonding: interfaces that must each keep at least one transport
+        self.bond_interfaces: List[Dict[str, Any]] = []
+        self.grown = 0
+        self.retired = 0
+        self.growing = False
+        self._lock = threading.Lock()
+        self.is_running = False
+        self.maintenance_thread = None
+        self._stop_event = threading.Event()
+    
+    @staticmethod
+    def _new_member(client: paramiko.SSHClient, interface: Optional[str]) -> Dict[str, Any]:
+        return {"client": client, "transport": client.get_transport(), "interface": interface,
+                "channels": weakref.WeakSet(), "initial_windows": weakref.WeakKeyDictionary(),
+                "pending": 0, "opened": 0, "picks": 0, "open_ms": None, "last_used": time.time()}
+    
+    @staticmethod
+    def _alive(member: Dict[str, Any]) -> bool:
+        transport = member["transport"]
+        return transport is not None and transport.is_active()
+    
+    @staticmethod
+    def live_channels(member: Dict[str, Any]) -> int:
+        return sum(1 for channel in list(member["channels"]) if not channel.closed)
+    
+    def set_primary(self, client: paramiko.SSHClient, interface: Optional[str] = None):
+        """Install (or replace after a reconnect) the proxy's own transport as member 0."""
+        with self._lock:
+            member = self._new_member(client, interface)
+            if self.members:
+                self.members[0] = member
+            else:
+                self.members.append(member)
+    
+    def bond(self, interfaces: List[Dict[str, Any]]):
+        """Keep one transport bound to each of these interfaces (multi-WAN bonding)."""
+        with self._lock:
+            self.bond_interfaces = list(interfaces)
+    
+    def capacity(self) -> int:
+        return max(self.max_transports, len(self.bond_interfaces))
+    
+    def can_grow(self) -> bool:
+        return self.connector is not None and self.capacity() > 1
+    
+    def bound_transports(self) -> List[Tuple[str, Any]]:
+        """(interface, transport) of every live transport bound to an interface."""
+        with self._lock:
+            return [(member["interface"], member["transport"]) for member in self.members
+                    if member["interface"] and self._alive(member)]
+    
+    def interface_of(self, transport) -> Optional[str]:
+        """Name of the interface a transport is bound to, if any."""
+        with self._lock:
+            for member in self.members:
+                if member["transport"] is transport:
+                    return member["interface"]
+        return None
+    
+    def acquire(self, destination: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Member the scheduler picks for the next channel, or None if all transports are down."""
+        with self._lock:
+            alive = [member for member in self.members if self._alive(member)]
+            if not alive:
+                return None
+            load = min(self.live_channels(member) for member in alive)
+            grow = (load >= self.channels_per_transport and len(self.members) < self.capacity()
+                    and self.can_grow() and not self.growing and self.is_running)
+            if grow:
+                self.growing = True
+        if grow:
+            threading.Thread(target=self._grow, daemon=True, name="SSHPoolGrow").start()
+        if self.interface_picker and self.bond_interfaces:
+            alive = self._on_picked_interface(alive)
+        member = self.scheduler.select(alive, destination)
+        with self._lock:
+            # Counted as load until track() or release(), so concurrent opens don't all pile onto it
+            member["pending"] += 1
+        return member
+    
+    def drop_interface(self, name: str) -> int:
+        """Close every transport bound to an interface whose link died; returns the channels cut.
+        
+        The primary stays as member 0 (dead, so never scheduled) until the proxy reconnects it.
+        """
+        with self._lock:
+            dropped = [member for member in self.members if member["interface"] == name]
+            self.members = [member for index, member in enumerate(self.members)
+                            if index == 0 or member["interface"] != name]
+            self.retired += sum(1 for member in dropped if member is not self.members[0])
+        channels = sum(self.live_channels(member) for member in dropped)
+        for member in dropped:
+            self._close(member)
+        return channels
+    
+    def wake(self):
+        """Run a maintenance pass now (e.g. to give a returning interface its transport)."""
+        if self.is_running:
+            threading.Thread(target=self._maintain, daemon=True, name="SSHPoolWake").start()
+    
+    def _on_picked_interface(self, alive: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Live members on the interface the picker chooses from their combined loads."""
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for member in alive:
+            if member["interface"]:
+                groups.setdefault(member["interface"], []).append(member)
+        if len(groups) < 2:
+            return alive
+        loads = {}
+        for name, members in groups.items():
+            member_loads = [ChannelScheduler.load(member) for member in members]
+            loads[name] = {"connections": sum(load["channels"] for load in member_loads),
+                           "outstanding": sum(load["outstanding"] for load in member_loads)}
+        return groups.get(self.interface_picker(loads)) or alive
+    
+    def release(self, member: Dict[str, Any]):
+        """The open that acquire() was for failed."""
+        with self._lock:
+            member["pending"] = max(member["pending"] - 1, 0)
+    
+    def track(self, member: Dict[str, Any], channel):
+        """Count a channel opened on a member until it closes."""
+        with self._lock:
+            member["pending"] = max(member["pending"] - 1, 0)
+            member["channels"].add(channel)
+            # Remote window right after the open; what it lacks later is still unacknowledged
+            member["initial_windows"][channel] = channel.out_window_size
+            member["opened"] += 1
+            member["last_used"] = time.time()
+    
+    def record_open(self, transport, latency_ms: float, alpha=0.2):
+        """Fold a channel-open latency into the EWMA of the transport it was opened on."""
+        with self._lock:
+            for member in self.members:
+                if member["transport"] is transport:
+                    previous = member["open_ms"]
+                    member["open_ms"] = latency_ms if previous is None else previous + alpha * (latency_ms - previous)
+                    break
+    
+    def _grow(self, iface: Optional[Dict[str, Any]] = None):
+        """Authenticate one more transport in the background, optionally bound to an interface."""
+        try:
+            client, interface = self.connector(iface)
+            with self._lock:
+                # A bonded interface left without a transport gets one even at capacity; idle extras retire later
+                if self.is_running and (iface is not None or len(self.members) < self.capacity()):
+                    self.members.append(self._new_member(client, interface))
+                    self.grown += 1
+                    client = None
+            if client is not None:
+                client.close()
+            else:
+                logger.info(f"SSH transport pool grew to {len(self.members)}")
+        except Exception as e:
+            logger.warning(f"Could not add SSH transport: {e}")
+        finally:
+            with self._lock:
+                self.growing = False
+    
+    def start(self):
+        """Open the configured minimum of transports and start idle retirement."""
+        if self.is_running:
+            return
+        self.is_running = True
+        self._stop_event.clear()
+        self.maintenance_thread = threading.Thread(target=self._maintenance_loop, daemon=True, name="SSHPool")
+        self.maintenance_thread.start()
+    
+    def stop(self):
+        """Stop maintenance and close every transport the pool opened (not the primary)."""
+        self.is_running = False
+        self._stop_event.set()
+        if self.maintenance_thread:
+            self.maintenance_thread.join(timeout=3)
+        with self._lock:
+            extras = self.members[1:]
+            del self.members[1:]
+        for member in extras:
+            self._close(member)
+    
+    @staticmethod
+    def _close(member: Dict[str, Any]):
+        try:
+            member["client"].close()
+        except Exception:
+            pass
+    
+    def _maintain(self):
+        """Drop dead transports, retire idle ones above the minimum, and top up to the minimum."""
+        now = time.time()
+        with self._lock:
+            closing = []
+            kept = self.members[:1]
+            remaining = len(self.members)
+            bonded = {iface["name"] for iface in self.bond_interfaces}
+            for member in self.members[1:]:
+                idle = self.live_channels(member) == 0 and now - member["last_used"] > self.idle_timeout
+                # The last transport on a bonded interface is never retired for idleness
+                if idle and member["interface"] in bonded:
+                    idle = sum(1 for other in self.members
+                               if other["interface"] == member["interface"] and self._alive(other)) > 1
+                if not self._alive(member) or (idle and remaining > self.min_transports):
+                    closing.append(member)
+                    remaining -= 1
+                else:
+                    kept.append(member)
+            self.members = kept
+            self.retired += len(closing)
+        for member in closing:
+            logger.info(f"Retiring SSH transport ({member['opened']} channels served)")
+            self._close(member)
+        
+        while self.is_running:
+            with self._lock:
+                count = len(self.members)
+                grow = (0 < count < self.min_transports and self.can_grow() and not self.growing)
+                if grow:
+                    self.growing = True
+            if not grow:
+                break
+            self._grow()
+            if len(self.members) <= count:
+                break
+        
+        # Every bonded interface without a live transport gets one
+        with self._lock:
+            covered = {member["interface"] for member in self.members if self._alive(member)}
+            missing = [iface for iface in self.bond_interfaces if iface["name"] not in covered]
+        for iface in missing:
+            if not self.is_running or not self.members:
+                break
+            with self._lock:
+                if self.growing:
+                    break
+                self.growing = True
+            self._grow(iface)
+    
+    def _maintenance_loop(self):
+        while self.is_running:
             try:
-                client.close()
-            except:
-                pass
-        self.clients = []
+                self._maintain()
+            except Exception as e:
+                logger.error(f"SSH transport pool error: {e}")
+            self._stop_event.wait(self.check_interval)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            members = list(self.members)
+            stats = {
+                "transports": len(members),
+                "channels": [self.live_channels(member) for member in members],
+                "grown": self.grown,
+                "retired": self.retired
+            }
+        stats["per_transport"] = [dict(
+            ChannelScheduler.load(member),
+            interface=member["interface"],
+            open_ms=member["open_ms"],
+            picks=member["picks"],
+            opened=member["opened"]
+        ) for member in members]
+        stats["decisions"] = self.scheduler.get_stats()
+        return stats
+
+# ================= SOCKS5 HANDSHAKE PARSER =================
+class SOCKS5HandshakeParser:
+    """Incremental parser for the SOCKS5 greeting and request, fed whatever each read returns."""
+    
+    METHOD_REPLY = b"\x05\x00"
+    
+    def __init__(self):
+        self._buffer = bytearray()
+        self.greeting_done = False
+        self.request: Optional[Tuple[int, int, str, int]] = None  # (command, addr_type, host, port)
+        self.early_data = b''
+        self.invalid = False
+        self.reply_code: Optional[int] = None  # set when the request must be refused
+    
+    @property
+    def done(self) -> bool:
+        return self.request is not None or self.invalid or self.reply_code is not None
+    
+    def feed(self, data: bytes):
+        """Consume bytes from the client; check done/greeting_done afterwards."""
+        self._buffer.extend(data)
+        if not self.greeting_done:
+            self._parse_greeting()
+        if self.greeting_done and not self.done:
+            self._parse_request()
+    
+    def _parse_greeting(self):
+        buf = self._buffer
+        if len(buf) < 2:
+            return
+        if buf[0] != 5:
+            self.invalid = True
+            return
+        greeting_len = 2 + buf[1]
+        if len(buf) < greeting_len:
+            return
+        del buf[:greeting_len]
+        self.greeting_done = True
+    
+    def _parse_request(self):
+        buf = self._buffer
+        if len(buf) < 4:
+            return
+        if buf[0] != 5:
+            self.invalid = True
+            return
+        command, addr_type = buf[1], buf[3]
+        
+        if addr_type == 1:  # IPv4
+            addr_len, offset = 4, 4
+        elif addr_type == 3:  # Domain name
+            if len(buf) < 5:
+                return
+            addr_len, offset = buf[4], 5
+        elif addr_type == 4:  # IPv6
+            addr_len, offset = 16, 4
+        else:
+            self.reply_code = 0x08  # Address type not supported
+            return
+        
+        request_len = offset + addr_len + 2
+        if len(buf) < request_len:
+            return
+        
+        raw_addr = bytes(buf[offset:offset + addr_len])
+        if addr_type == 1:
+            host = socket.inet_ntoa(raw_addr)
+        elif addr_type == 4:
+            host = socket.inet_ntop(socket.AF_INET6, raw_addr)
+        else:
+            host = raw_addr.decode('utf-8', errors='ignore')
+        port = struct.unpack('>H', buf[request_len - 2:request_len])[0]
+        
+        # Anything after the request is application data the client pipelined
+        self.early_data = bytes(buf[request_len:])
+        del buf[:]
+        
+        if command != 1:
+            self.reply_code = 0x07  # Command not supported
+            return
+        self.request = (command, addr_type, host, port)
+
+# ================= CONNECTION RACING =================
+class AddressRanker:
+    """Per-address channel-open latency and failure history used to order race candidates."""
+    
+    def __init__(self, max_entries=4096, failure_memory=300, alpha=0.3):
+        self.max_entries = max_entries
+        self.failure_memory = failure_memory
+        self.alpha = alpha
+        self.entries: OrderedDict = OrderedDict()  # address -> [ewma_ms, successes, failures, last_failure]
+        self._lock = threading.Lock()
+    
+    def _entry(self, address: str) -> list:
+        entry = self.entries.get(address)
+        if entry is None:
+            entry = self.entries[address] = [None, 0, 0, 0.0]
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(address)
+        return entry
+    
+    def record_success(self, address: str, latency_ms: float):
+        with self._lock:
+            entry = self._entry(address)
+            entry[0] = latency_ms if entry[0] is None else entry[0] + self.alpha * (latency_ms - entry[0])
+            entry[1] += 1
+            entry[3] = 0.0
+    
+    def record_failure(self, address: str):
+        with self._lock:
+            entry = self._entry(address)
+            entry[2] += 1
+            entry[3] = time.time()
+    
+    def order(self, addresses: List[str]) -> List[str]:
+        """Known-fast addresses first, untried ones in resolver order, recent failures last."""
+        now = time.time()
+        with self._lock:
+            def key(item):
+                position, address = item
+                entry = self.entries.get(address)
+                if entry is None:
+                    return (1, 0.0, position)
+                if entry[3] and now - entry[3] < self.failure_memory:
+                    return (2, 0.0, position)
+                if entry[0] is None:
+                    return (1, 0.0, position)
+                return (0, entry[0], position)
+            return [address for _, address in sorted(enumerate(addresses), key=key)]
+    
+    def get_stats(self, address: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self.entries.get(address)
+            if entry is None:
+                return None
+            return {"latency_ms": entry[0], "successes": entry[1], "failures": entry[2]}
 
 # ================= ADVANCED SOCKS5 PROXY =================
+class SOCKS5ReplyError(Exception):
+    """Connection setup failure carrying the SOCKS5 reply code to send back."""
+    
+    def __init__(self, reply_code: int, message: str = ""):
+        super().__init__(message or f"SOCKS5 reply {reply_code}")
+        self.reply_code = reply_code
+
+def socks5_reply(reply_code: int) -> bytes:
+    """Build a SOCKS5 reply with a zeroed IPv4 bind address."""
+    return b"\x05" + bytes([reply_code]) + b"\x00\x01\x00\x00\x00\x00\x00\x00"
+
 class AdvancedSOCKS5Proxy(threading.Thread):
     """Enhanced SOCKS5 proxy with all advanced features."""
     
@@ -681,11 +3617,82 @@ class AdvancedSOCKS5Proxy(threading.Thread):
         # Thread pool management
         self.max_workers = int(config.get("max_threads", 100))
         self.executor: Optional[ThreadPoolExecutor] = None
-        self.thread_count = 0
-        self.thread_count_lock = threading.Lock()
+        self.thread_count = ShardedCounter()
+        
+        # Data-plane engine: "thread" (pool worker per client) or "asyncio"
+        self.engine = config.get("proxy_engine", "thread")
+        if self.engine == "asyncio" and platform.system() == "Windows":
+            # SelectorEventLoop's select() stops at 512 sockets and every client also watches
+            # paramiko's channel pipe, so the loop would fail after a couple of hundred clients
+            log_callback("[!] asyncio engine is not supported on Windows, using the thread engine")
+            self.engine = "thread"
+        self.async_engine: Optional['AsyncSOCKS5Engine'] = None
+        
+        # Forwarding buffers shared by all connections
+        self.buffer_pool = BufferPool()
+        
+        # Per-direction flow control: stop reading a side once this much is queued for the other
+        self.relay_high_watermark = int(config.get("relay_high_watermark", 262144))
+        self.relay_low_watermark = int(config.get("relay_low_watermark", 65536))
+        
+        # Remote DNS: hand domain names to the exit server instead of resolving them here
+        self.remote_dns = bool(servers[-1].get("remote_dns", False)) if servers else False
+        
+        # Optimistic mode: reply success before the channel open round trip completes
+        self.fast_open = bool(config.get("socks_fast_open", False))
+        
+        # Pre-opened channels for hot destinations
+        self.warm_pool: Optional[WarmChannelPool] = None
+        if config.get("warm_channel_pool", False):
+            self.warm_pool = WarmChannelPool(
+                self._open_warm_channel,
+                max_channels=int(config.get("warm_pool_max_channels", 32))
+            )
+        
+        # Extra authenticated transports to the same server (single-server sessions only)
+        self.transport_pool = SSHTransportPool(
+            self._connect_pool_transport if len(servers) == 1 else None,
+            min_transports=int(config.get("ssh_transports_min", 1)),
+            max_transports=int(config.get("ssh_transports_max", 1)),
+            channels_per_transport=int(config.get("ssh_channels_per_transport", 16)),
+            scheduler=ChannelScheduler(config.get("channel_scheduler", "p2c"), bool(config.get("channel_sticky", True))),
+            interface_picker=self._pick_interface
+        )
+        
+        # Kernel MPTCP for the bonded SSH socket (falls back to TCP per connection)
+        self.mptcp: Optional[MPTCPManager] = None
+        self.mptcp_active = False
+        if config.get("mptcp_enabled") and config.get("wan_bonding_enabled") and len(servers) == 1:
+            self.mptcp = MPTCPManager()
+        
+        # Measured per-interface scores for WAN load balancing
+        self.interface_scorer: Optional[InterfaceScorer] = None
+        if config.get("wan_bonding_enabled") and servers:
+            self.interface_scorer = InterfaceScorer(
+                iface_manager,
+                self.transport_pool.bound_transports,
+                stats.get_interface_bytes,
+                probe_target=self._probe_target(config.get("interface_probe_target", "")),
+                subflows=lambda: (self.get_mptcp_stats() or {}).get("subflows", [])
+            )
+        
+        # Reroute around bonded links that drop, change address or come back
+        self.interface_watcher: Optional[InterfaceWatcher] = None
+        if config.get("wan_bonding_enabled") and servers:
+            self.interface_watcher = InterfaceWatcher(iface_manager, self._on_interfaces_changed)
         
         # DNS Cache and Health Monitor
-        self.dns_cache = DNSCache(ttl=300)
+        self.dns_store = self._open_dns_store() if config.get("dns_persistent_cache", True) else None
+        self.dns_cache = DNSCache(ttl=300, store=self.dns_store)
+        self.dns_resolver = CoalescingResolver(self.dns_cache, self._lookup_domain)
+        self.aaaa_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="DNS6")
+        
+        # Happy Eyeballs: staggered channel opens across resolved addresses (RFC 8305)
+        self.address_ranker = AddressRanker()
+        self.race_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="Race")
+        self.race_stagger = 0.25
+        self.race_max_attempts = 4
+        self.aaaa_grace = 0.05
         self.health_monitor = HealthMonitor()
         
         # Active channels tracking
@@ -695,7 +3702,13 @@ class AdvancedSOCKS5Proxy(threading.Thread):
         # DNS optimization
         self.best_dns_name = None
         self.best_dns_ip = None
-        self.dns_tester = DNSTester()
+        self.dns_tester = DNSTester(servers=DNSTester.parse_server_list(config.get("dns_custom_servers", [])))
+        
+        # Measured choices remembered per network, so a known network connects without probing first
+        self.profile_cache = NetworkProfileCache() if config.get("network_profile_cache", True) else None
+        self.network_id: Optional[str] = None
+        self.network_profile: Optional[Dict[str, Any]] = None
+        self.control_interface: Optional[str] = None
 
         # اضافه کردن تنظیمات مدیریت اتصال
         self.ssh_keepalive_interval = 30  # ارسال keepalive هر 30 ثانیه
@@ -710,9 +3723,40 @@ class AdvancedSOCKS5Proxy(threading.Thread):
             dns_servers.append(self.config["dns_primary"])
         if self.config.get("dns_secondary"): 
             dns_servers.append(self.config["dns_secondary"])
-        if dns_servers: 
+        self.dns_protocol = config.get("dns_protocol", "udp")
+        if self.dns_protocol in ("dot", "doh"):
+            self.resolver = EncryptedDNSResolver(
+                self.dns_protocol, dns_servers or ["1.1.1.1"], config.get("dns_url", ""),
+                timeout=float(config.get("dns_timeout", 5))
+            )
+        elif dns_servers: 
             self.resolver.nameservers = dns_servers
         
+        # Local DNS listener forwarding over the tunnel
+        self.dns_stub: Optional[DNSStubServer] = None
+        if config.get("dns_stub_enabled", False):
+            self.dns_stub = DNSStubServer(
+                int(config.get("dns_stub_port", 5300)),
+                TunnelDNSClient(self._open_dns_channel),
+                self.dns_cache
+            )
+        
+        # Keeps re-ranking nameservers for the whole session
+        self.resolver_ranker: Optional[ResolverRanker] = None
+        if (config.get("dns_optimization", True) and config.get("dns_live_ranking", True)
+                and not self.remote_dns and self.dns_protocol == "udp"):
+            self.resolver_ranker = ResolverRanker(self.resolver, self.dns_tester, on_switch=self._on_dns_switch)
+        
+        # Hedged lookups: primary first, the next resolver only once the primary is slower than its p90
+        self.hedged_resolver: Optional[HedgedResolver] = None
+        if self.dns_protocol == "udp":
+            self.hedged_resolver = HedgedResolver(
+                self.resolver,
+                config.get("dns_fallback_list", []) if config.get("dns_fallback_enabled", True) else [],
+                ranker=self.resolver_ranker,
+                timeout=float(config.get("dns_timeout", 5))
+            )
+        
         self.daemon = True
         
     def optimize_dns(self) -> bool:
@@ -747,21 +3791,112 @@ class AdvancedSOCKS5Proxy(threading.Thread):
             self.log_callback(f"[!] DNS optimization failed: {e}")
             return False
 
+    def _on_dns_switch(self, name: str, ip: str):
+        """Reflect a live resolver switch in the status shown by the GUI."""
+        self.best_dns_name = name
+        self.best_dns_ip = ip
+        self.log_callback(f"[*] DNS switched to faster resolver: {name} ({ip})")
+
+    def _apply_network_profile(self):
+        """Use the choices measured the last time we were on this network."""
+        profile = self.network_profile
+        resolver = profile.get("resolver")
+        if resolver and self.dns_protocol == "udp" and self.config.get("dns_optimization", True):
+            self.best_dns_name = resolver["name"]
+            self.best_dns_ip = resolver["ip"]
+            self.resolver.nameservers = [self.best_dns_ip]
+            self.config["current_dns"] = {"name": self.best_dns_name, "ip": self.best_dns_ip, "selected_by": "system"}
+            self.log_callback(f"[⚡] Known network: using cached DNS {self.best_dns_name} ({self.best_dns_ip})")
+        if profile.get("cipher"):
+            logger.info(f"Known network {self.network_id}: preferring cipher {profile['cipher']}")
+
+    def _cached_server_socket(self, server: Dict[str, Any], timeout: float) -> Optional[socket.socket]:
+        """Connect straight to the server address that worked on this network, skipping name resolution."""
+        profile = self.network_profile or {}
+        if profile.get("server_host") != f"{server['host']}:{server['port']}" or not profile.get("server_address"):
+            return None
+        try:
+            return socket.create_connection((profile["server_address"], int(server['port'])), timeout=timeout)
+        except OSError as e:
+            logger.debug(f"Cached server address {profile['server_address']} failed: {e}")
+            return None
+
+    def _cached_interface(self) -> Optional[Dict[str, Any]]:
+        """The interface that carried the tunnel last time on this network, if it is still selected."""
+        name = (self.network_profile or {}).get("interface")
+        if not name:
+            return None
+        return self.iface_manager.get_selected_interface(name)
+
+    def _transport_factory(self, cipher: str) -> Callable:
+        """Transport factory that negotiates the cached cipher first, keeping the rest as fallbacks."""
+        def factory(sock, **kwargs):
+            transport = paramiko.Transport(sock, **kwargs)
+            options = transport.get_security_options()
+            if cipher in options.ciphers:
+                options.ciphers = (cipher,) + tuple(c for c in options.ciphers if c != cipher)
+            return transport
+        return factory
+
+    def _remember_network(self):
+        """Store what this connect measured; on a known network, re-validate in the background."""
+        transport = self.ssh_client.get_transport() if self.ssh_client else None
+        choices = {"cipher": transport.remote_cipher if transport else None}
+        if len(self.servers) == 1 and transport:
+            try:
+                choices["server_host"] = f"{self.servers[0]['host']}:{self.servers[0]['port']}"
+                choices["server_address"] = transport.getpeername()[0]
+            except OSError:
+                pass
+        if self.control_interface:
+            choices["interface"] = self.control_interface
+        choices["resolver"] = self._measured_resolver()
+        self.profile_cache.update(self.network_id, **choices)
+        
+        known = self.network_profile is not None
+        threading.Thread(target=self._revalidate_network, args=(known,), daemon=True, name="NetProfile").start()
+
+    def _measured_resolver(self) -> Optional[Dict[str, str]]:
+        """The resolver picked by measurement; the all-failed default is not worth remembering."""
+        if not self.best_dns_ip or self.best_dns_name == "Default":
+            return None
+        return {"name": self.best_dns_name, "ip": self.best_dns_ip}
+
+    def _revalidate_network(self, known: bool):
+        """Re-measure with the tunnel already up and refresh the cached profile."""
+        try:
+            if known and self.config.get("dns_optimization", True) and self.dns_protocol == "udp":
+                self.dns_tester.test_rounds = int(self.config.get("dns_test_rounds", 3))
+                result = self.dns_tester.find_best_dns()
+                # A probe where everything failed says nothing about the cached choice
+                if result["ip"] and result["name"] != "Default" and result["ip"] != self.best_dns_ip:
+                    self.resolver.nameservers = [result["ip"]]
+                    self._on_dns_switch(result["name"], result["ip"])
+            
+            self.profile_cache.update(self.network_id, resolver=self._measured_resolver())
+        except Exception as e:
+            logger.debug(f"Network profile revalidation failed: {e}")
+
+    def _open_dns_store(self) -> Optional[PersistentDNSStore]:
+        """Open the on-disk DNS cache; the proxy runs memory-only if it cannot."""
+        try:
+            return PersistentDNSStore(DNS_CACHE_FILE)
+        except Exception as e:
+            logger.warning(f"Persistent DNS cache unavailable: {e}")
+            return None
+
     def get_thread_count(self) -> int:
         """Get current active thread count."""
-        with self.thread_count_lock:
-            return self.thread_count
+        self.thread_count.collect()
+        return max(0, self.thread_count.value())
     
     def increment_thread_count(self):
         """Increment thread counter."""
-        with self.thread_count_lock:
-            self.thread_count += 1
+        self.thread_count.add(1)
     
     def decrement_thread_count(self):
         """Decrement thread counter."""
-        with self.thread_count_lock:
-            if self.thread_count > 0:
-                self.thread_count -= 1
+        self.thread_count.add(-1)
     
     def reset_connections(self):
         """Reset all connections and thread pool."""
@@ -785,10 +3920,11 @@ class AdvancedSOCKS5Proxy(threading.Thread):
             self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="SOCKS")
             old_executor.shutdown(wait=False, cancel_futures=True)
         
-        with self.thread_count_lock:
-            self.thread_count = 0
+        # thread_count is a gauge: the handlers of the channels closed above decrement it as they exit
+        
+        if self.warm_pool:
+            self.warm_pool.clear()
         
-        self.dns_cache.clear()
         self.health_monitor.reset()
         
         # اضافه کردن: بازسازی اتصال SSH
@@ -831,6 +3967,8 @@ class AdvancedSOCKS5Proxy(threading.Thread):
                 
                 # برقراری مجدد اتصال
                 self._establish_ssh_connection()
+                if self.warm_pool:
+                    self.warm_pool.clear()
                 self.log_callback("[✓] Connection recovered successfully")
                 return True
                 
@@ -846,11 +3984,40 @@ class AdvancedSOCKS5Proxy(threading.Thread):
         """Main thread execution with auto-reconnect support."""
         while self.running and self.connection_attempts < self.max_reconnect_attempts:
             try:
-                # Optimize DNS if enabled
-                if self.config.get("dns_optimization", True):
+                if self.profile_cache and self.network_id is None:
+                    self.network_id = NetworkProfileCache.fingerprint()
+                    self.network_profile = self.profile_cache.get(self.network_id)
+                    if self.network_profile:
+                        self._apply_network_profile()
+                
+                # Optimize DNS if enabled (plain UDP resolvers only), once per session
+                if self.config.get("dns_optimization", True) and self.dns_protocol == "udp" and not self.best_dns_ip:
                     self.optimize_dns()
                 
+                if self.mptcp and not self.mptcp.endpoints:
+                    self._configure_mptcp()
+                
                 self._establish_ssh_connection()
+                if self.profile_cache:
+                    self._remember_network()
+                if self._bonding_active():
+                    self.transport_pool.bond(self.iface_manager.selected_interfaces)
+                    self.log_callback(f"[*] Bonding {len(self.iface_manager.selected_interfaces)} interfaces: one SSH transport each")
+                self.transport_pool.start()
+                if self.interface_scorer:
+                    self.interface_scorer.start()
+                if self.interface_watcher:
+                    self.interface_watcher.start()
+                if self.warm_pool:
+                    self.warm_pool.start()
+                if self.resolver_ranker:
+                    self.resolver_ranker.start()
+                if self.dns_stub and not self.dns_stub.is_running:
+                    try:
+                        self.dns_stub.start()
+                        self.log_callback(f"[*] DNS stub listening on 127.0.0.1:{self.dns_stub.port}")
+                    except OSError as e:
+                        self.log_callback(f"[!] DNS stub could not bind port {self.dns_stub.port}: {e}")
                 self._start_socks_server()
                 break
             except Exception as e:
@@ -895,58 +4062,22 @@ class AdvancedSOCKS5Proxy(threading.Thread):
                 raise Exception("Multi-hop connection failed")
         else:
             # Single server connection
-            server = self.servers[0]
-            self.ssh_client = paramiko.SSHClient()
-            self.ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            
-            self.log_callback(f"[*] Connecting to {server['host']}:{server['port']}...")
-            
-            connect_kwargs = {
-                "hostname": server['host'],
-                "port": int(server['port']),
-                "username": server['username'],
-                "timeout": timeout,
-                "banner_timeout": timeout
-            }
-            
-            # Key-based or password authentication
-            if server.get('key_file') and os.path.exists(server['key_file']):
-                connect_kwargs['key_filename'] = server['key_file']
-            else:
-                connect_kwargs['password'] = server.get('password', '')
-            
-            # Bind to specific interface if multi-WAN is enabled
-            if self.config.get('wan_bonding_enabled'):
-                iface = self.iface_manager.get_next_interface(
-                    self.config.get('load_balancing_mode', 'round_robin')
-                )
-                if iface:
-                    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    try:
-                        sock.bind((iface['ip'], 0))
-                        sock.settimeout(timeout)
-                        sock.connect((server['host'], int(server['port'])))
-                        connect_kwargs['sock'] = sock
-                        self.log_callback(f"[*] Using interface: {iface['name']} ({iface['type']}) - {iface['ip']}")
-                    except Exception as e:
-                        logger.warning(f"Failed to bind to interface {iface['name']}: {e}")
-                        sock.close()
-                    
-                    except Exception as e:
-                        if 'sock' in locals() and sock:
-                            try:
-                                sock.close()
-                            except:
-                                pass
-                        raise
-            
-            self.ssh_client.connect(**connect_kwargs)
+            self.ssh_client, self.control_interface = self._connect_ssh_client()
             self.log_callback(f"[✓] Connected successfully")
         
         transport = self.ssh_client.get_transport()
         if not transport or not transport.is_active():
             raise Exception("SSH transport is not active")
 
+        self._tune_transport(transport)
+        self.transport_pool.set_primary(self.ssh_client, self.control_interface)
+        
+        self.log_callback(f"[✓] SSH tunnel established (Keepalive: 15s)")
+        self.status_callback(True, self.ssh_client)
+
+    @staticmethod
+    def _tune_transport(transport: paramiko.Transport):
+        """Keepalive and socket settings shared by every tunnel transport."""
         # 🔧 keepalive به روش صحیح
         if transport:
             transport.set_keepalive(15)  # ارسال keepalive هر 15 ثانیه
@@ -958,14 +4089,180 @@ class AdvancedSOCKS5Proxy(threading.Thread):
             sock = transport.sock
             if sock:
                 sock.settimeout(30)  # تنظیم timeout سوکت
+
+    def _connect_ssh_client(self, iface: Optional[Dict[str, Any]] = None,
+                            announce: bool = True) -> Tuple[paramiko.SSHClient, Optional[str]]:
+        """Authenticate one SSH client to the (single) server; returns it and the interface it is bound to."""
+        timeout = self.timeout
+        server = self.servers[0]
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        bound_interface = None
         
-        self.log_callback(f"[✓] SSH tunnel established (Keepalive: 15s)")
-        self.status_callback(True, self.ssh_client)
+        if announce:
+            self.log_callback(f"[*] Connecting to {server['host']}:{server['port']}...")
+        
+        connect_kwargs = {
+            "hostname": server['host'],
+            "port": int(server['port']),
+            "username": server['username'],
+            "timeout": timeout,
+            "banner_timeout": timeout
+        }
+        
+        # Key-based or password authentication
+        if server.get('key_file') and os.path.exists(server['key_file']):
+            connect_kwargs['key_filename'] = server['key_file']
+        else:
+            connect_kwargs['password'] = server.get('password', '')
+        
+        cipher = (self.network_profile or {}).get("cipher")
+        if cipher:
+            connect_kwargs['transport_factory'] = self._transport_factory(cipher)
+        
+        # Bind to specific interface if multi-WAN is enabled
+        if iface is None and self.config.get('wan_bonding_enabled'):
+            iface = self._cached_interface() or self.iface_manager.get_next_interface(
+                self.config.get('load_balancing_mode', 'round_robin')
+            )
+        if iface:
+            if self.mptcp:
+                sock, _ = self.mptcp.create_socket()
+            else:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                sock.bind((iface['ip'], 0))
+                sock.settimeout(timeout)
+                sock.connect((server['host'], int(server['port'])))
+                connect_kwargs['sock'] = sock
+                bound_interface = iface['name']
+                if announce:
+                    self.log_callback(f"[*] Using interface: {iface['name']} ({iface['type']}) - {iface['ip']}")
+                    if self.mptcp:
+                        # Fallback is settled by the handshake: no MP_CAPABLE from the server means plain TCP
+                        self.mptcp_active = MPTCPManager.info(sock) is not None
+                        self.log_callback("[*] MPTCP negotiated: the kernel bonds subflows over the selected interfaces"
+                                          if self.mptcp_active else "[*] MPTCP not negotiated (server or path), using TCP")
+            except Exception as e:
+                logger.warning(f"Failed to bind to interface {iface['name']}: {e}")
+                self.iface_manager.record_result(iface['name'], False)
+                sock.close()
+        
+        if 'sock' not in connect_kwargs:
+            sock = self._cached_server_socket(server, timeout)
+            if sock:
+                connect_kwargs['sock'] = sock
+        
+        client.connect(**connect_kwargs)
+        return client, bound_interface
+
+    @staticmethod
+    def _probe_target(value: str) -> Optional[Tuple[str, int]]:
+        """Parse the optional "host:port" used to probe links that have no transport."""
+        host, _, port = str(value or "").rpartition(":")
+        if not host or not port.isdigit():
+            return None
+        return host.strip("[]"), int(port)
+
+    def _bonding_active(self) -> bool:
+        """Per-channel multi-WAN: one transport per selected interface (single-server sessions, no MPTCP)."""
+        return (bool(self.config.get('wan_bonding_enabled')) and self.config.get('wan_bonding_per_channel', True)
+                and len(self.servers) == 1 and len(self.iface_manager.selected_interfaces) > 1
+                and not self.mptcp_active)
+
+    def _configure_mptcp(self):
+        """Add a subflow endpoint for every selected interface, or give up on MPTCP if the host lacks it."""
+        if not MPTCPManager.supported():
+            self.log_callback("[!] MPTCP unavailable (needs Linux with net.mptcp.enabled=1), using TCP")
+            self.mptcp = None
+            return
+        selected = self.iface_manager.get_selected()
+        errors = self.mptcp.configure_endpoints(selected)
+        for error in errors:
+            self.log_callback(f"[!] MPTCP endpoint setup: {error}")
+        if errors and not self.mptcp.endpoints:
+            # Without endpoints MPTCP is one subflow; per-interface transports bond better
+            self.log_callback("[!] No MPTCP endpoints could be added, using TCP bonding")
+            self.mptcp.remove_endpoints()
+            self.mptcp = None
+            return
+        if self.mptcp.endpoints:
+            self.log_callback(f"[*] MPTCP subflow endpoints: {', '.join(sorted(self.mptcp.endpoints.values()))}")
+
+    def get_mptcp_stats(self) -> Optional[Dict[str, Any]]:
+        """MPTCP connection info and per-subflow counters of the primary SSH socket."""
+        if not self.mptcp_active or not self.ssh_client:
+            return None
+        transport = self.ssh_client.get_transport()
+        sock = transport.sock if transport else None
+        if not isinstance(sock, socket.socket):
+            return None
+        info = MPTCPManager.info(sock)
+        if info is None:
+            return None
+        names = {iface["ip"]: iface["name"] for iface in self.iface_manager.interfaces}
+        subflows = self.mptcp.subflows(sock)
+        for subflow in subflows:
+            subflow["interface"] = names.get(subflow["local"][0]) if subflow["local"] else None
+        return {"info": info, "subflows": subflows}
+
+    def _on_interfaces_changed(self, change: Dict[str, List[Dict[str, Any]]]):
+        """Drop transports on links that died or changed address, and re-bond what is selected now."""
+        if self.mptcp_active:
+            # The kernel moves data to the surviving subflows; only the endpoints follow the change
+            self.mptcp.configure_endpoints(self.iface_manager.get_selected())
+            for iface in change["lost"] + change["readdressed"]:
+                reason = "went down" if iface in change["lost"] else f"changed address to {iface['ip']}"
+                self.log_callback(f"[!] Interface {iface['name']} {reason}: MPTCP continues on the remaining subflows")
+            for iface in change["returned"]:
+                self.log_callback(f"[+] Interface {iface['name']} is back ({iface['ip']}), added as MPTCP endpoint")
+            return
+        primary_lost = False
+        for iface in change["lost"] + change["readdressed"]:
+            cut = self.transport_pool.drop_interface(iface["name"])
+            self.iface_manager.record_result(iface["name"], False)
+            primary_lost = primary_lost or iface["name"] == self.control_interface
+            reason = "went down" if iface in change["lost"] else f"changed address to {iface['ip']}"
+            self.log_callback(f"[!] Interface {iface['name']} {reason}: {cut} channel(s) closed, new ones avoid it")
+        for iface in change["returned"]:
+            self.log_callback(f"[+] Interface {iface['name']} is back ({iface['ip']}), rejoining the pool")
+        
+        if self.transport_pool.bond_interfaces or self._bonding_active():
+            self.transport_pool.bond(self.iface_manager.get_selected())
+        self.transport_pool.wake()
+        if primary_lost and self.running:
+            threading.Thread(target=self.recover_connection, daemon=True, name="RecoverSSH").start()
+
+    def _pick_interface(self, loads: Dict[str, Dict[str, float]]) -> Optional[str]:
+        """Interface for the next bonded channel, by the configured load balancing mode."""
+        iface = self.iface_manager.get_next_interface(
+            self.config.get('load_balancing_mode', 'round_robin'), loads, list(loads)
+        )
+        return iface["name"] if iface else None
+
+    def _interface_meter(self, channel) -> Optional[Tuple[ShardedCounter, ShardedCounter]]:
+        """Per-interface (sent, received) counters for a channel's transport, if it is bound to one."""
+        interface = self.transport_pool.interface_of(channel.get_transport())
+        return self.stats.interface_counters(interface) if interface else None
+
+    def _connect_pool_transport(self, iface: Optional[Dict[str, Any]] = None) -> Tuple[paramiko.SSHClient, Optional[str]]:
+        """Connector for the transport pool: a quiet, tuned extra login."""
+        client, interface = self._connect_ssh_client(iface, announce=False)
+        if iface and interface != iface['name']:
+            # Binding failed and it went out the default route; that would not add a link
+            client.close()
+            raise OSError(f"could not bind a transport to {iface['name']}")
+        self._tune_transport(client.get_transport())
+        return client, interface
 
     def _start_socks_server(self):
         """Start SOCKS5 server with ThreadPool."""
         local_port = int(self.config.get('local_port', 1080))
         
+        if self.engine == "asyncio":
+            self._start_async_server(local_port)
+            return
+        
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind(('127.0.0.1', local_port))
@@ -997,6 +4294,14 @@ class AdvancedSOCKS5Proxy(threading.Thread):
                 if self.running:
                     logger.error(f"Accept error: {e}")
 
+    def _start_async_server(self, local_port: int):
+        """Serve SOCKS5 clients from a single asyncio event loop."""
+        self.async_engine = AsyncSOCKS5Engine(self, '127.0.0.1', local_port)
+        loop_name = "uvloop" if uvloop is not None else "asyncio"
+        self.log_callback(f"[*] SOCKS5 Server listening on 127.0.0.1:{local_port} ({loop_name} engine)")
+        logger.info(f"SOCKS5 async server started on port {local_port} using {loop_name}")
+        self.async_engine.run()
+
     def _handle_client_wrapper(self, client, addr):
         """Wrapper for thread pool execution."""
         try:
@@ -1014,123 +4319,62 @@ class AdvancedSOCKS5Proxy(threading.Thread):
         destination = "unknown"
         
         try:
-            # SOCKS5 greeting
-            greeting = client_socket.recv(262)
-            if not greeting or len(greeting) < 2:
-                return
-            
-            client_socket.send(b"\x05\x00")
+            # One recv per arriving segment; a pipelined greeting + request is parsed from a single read
+            parser = SOCKS5HandshakeParser()
+            method_replied = False
+            reply_prefix = b''
+            while not parser.done:
+                data = client_socket.recv(4096)
+                if not data:
+                    return
+                parser.feed(data)
+                if parser.greeting_done and not method_replied:
+                    method_replied = True
+                    if parser.done:
+                        # Pipelined request: method selection rides along with the request reply
+                        reply_prefix = parser.METHOD_REPLY
+                    else:
+                        client_socket.send(parser.METHOD_REPLY)
             
-            # SOCKS5 request
-            data = client_socket.recv(4)
-            if not data or len(data) < 4 or data[1] != 1:
+            if parser.invalid:
                 return
-
-            addr_type = data[3]
-            dest_addr = ""
-            
-            # Parse destination address
-            if addr_type == 1:  # IPv4
-                dest_addr = socket.inet_ntoa(client_socket.recv(4))
-            
-            elif addr_type == 3:  # Domain name
-                domain_len = ord(client_socket.recv(1))
-                domain = client_socket.recv(domain_len).decode('utf-8', errors='ignore')
-                dest_addr = domain
-                
-                # DNS resolution با fallback به DNS عمومی
-                cached_ip = self.dns_cache.get(domain)
-                if cached_ip:
-                    dest_addr = cached_ip
-                else:
-                    # ابتدا از DNS تنظیم شده استفاده کنید
-                    try:
-                        answers = self.resolver.resolve(domain, 'A')
-                        if answers:
-                            dest_addr = str(answers[0])
-                            self.dns_cache.set(domain, dest_addr)
-                            logger.info(f"DNS resolved {domain} -> {dest_addr} via configured DNS")
-                    except Exception as e:
-                        logger.debug(f"Primary DNS resolution failed: {e}")
-                        # اگر DNS اصلی جواب نداد، از DNS محلی سیستم استفاده کنید
-                        try:
-                            dest_addr = socket.gethostbyname(domain)
-                            self.dns_cache.set(domain, dest_addr)
-                            logger.info(f"DNS resolved {domain} -> {dest_addr} via system DNS")
-                        except socket.gaierror:
-                            logger.error(f"All DNS resolutions failed for {domain}")
-                            client_socket.send(b"\x05\x04\x00\x01\x00\x00\x00\x00\x00\x00")
-                            return
-            
-            elif addr_type == 4:  # IPv6 - باید فعال شود
-                dest_addr = socket.inet_ntop(socket.AF_INET6, client_socket.recv(16))
-            
-            else:
-                # Unsupported address type
-                client_socket.send(b"\x05\x08\x00\x01\x00\x00\x00\x00\x00\x00")  # Address type not supported
+            if parser.reply_code is not None:
+                client_socket.send(reply_prefix + socks5_reply(parser.reply_code))
                 return
-
-            # دریافت پورت
-            dest_port = struct.unpack('>H', client_socket.recv(2))[0]
-            destination = f"{dest_addr}:{dest_port}"
             
-            # Log connection
-            self.connection_logger.add_connection(client_info, destination)
+            _, addr_type, dest_addr, dest_port = parser.request
+            request_time = time.time()
+            fast_open = self.fast_open
+            if fast_open:
+                # The client's first flight queues in the socket buffer while we resolve and open
+                client_socket.send(reply_prefix + socks5_reply(0x00))
             
-            # Log traffic if enabled
-            if self.config.get("log_traffic"):
-                self.log_callback(f"[Traffic] {client_info} -> {destination}")
-            
-            logger.debug(f"Connecting to {dest_addr}:{dest_port}")
-
-            # Create SSH tunnel with RTT measurement
-            transport = self.ssh_client.get_transport()
-            if not transport or not transport.is_active():
-                logger.error("SSH transport is not active - attempting to reconnect")
-                self.log_callback("[!] SSH connection lost, reconnecting...")
-                
-                # تلاش برای بازسازی اتصال
-                try:
-                    self._establish_ssh_connection()
-                    transport = self.ssh_client.get_transport()
-                except Exception as e:
-                    logger.error(f"Reconnection failed: {e}")
-                    client_socket.send(b"\x05\x01\x00\x01\x00\x00\x00\x00\x00\x00")
-                    self.stats.increment_failed()
+            candidates = None
+            if addr_type == 3 and not self.remote_dns:  # Domain name
+                candidates = self._resolve_destination(dest_addr)
+                if not candidates:
+                    self._refuse_client(client_socket, reply_prefix + socks5_reply(0x04), fast_open)
                     return
             
-            try:
-                start_time = time.time()
-                remote_socket = transport.open_channel(
-                    "direct-tcpip", 
-                    (dest_addr, dest_port), 
-                    addr,
-                    timeout=10
-                )
-                rtt = (time.time() - start_time) * 1000
-                self.health_monitor.add_rtt(rtt)
-                
-                # Track active channel
-                with self.channels_lock:
-                    self.active_channels.add(remote_socket)
-                    
-            except Exception as e:
-                logger.debug(f"Channel open failed for {dest_addr}:{dest_port}: {e}")
-                client_socket.send(b"\x05\x05\x00\x01\x00\x00\x00\x00\x00\x00")
-                self.stats.increment_failed()
-                return
+            destination = f"{dest_addr}:{dest_port}"
+            self._log_destination(client_info, destination)
             
-            if not remote_socket:
-                logger.error(f"Failed to open channel to {dest_addr}:{dest_port}")
-                client_socket.send(b"\x05\x01\x00\x01\x00\x00\x00\x00\x00\x00")
+            try:
+                remote_socket = self._open_remote_channel(dest_addr, dest_port, addr, candidates)
+            except SOCKS5ReplyError as e:
+                self._refuse_client(client_socket, reply_prefix + socks5_reply(e.reply_code), fast_open)
                 self.stats.increment_failed()
                 return
 
             # Send success response
-            client_socket.send(b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00")
+            if not fast_open:
+                client_socket.send(reply_prefix + socks5_reply(0x00))
             
-            # Forward data
-            self.forward_data(client_socket, remote_socket)
+            # Forward data, starting with anything the client sent ahead of the reply
+            self.forward_data(
+                client_socket, remote_socket, parser.early_data,
+                first_byte_callback=lambda: self.stats.record_ttfb((time.time() - request_time) * 1000, fast_open)
+            )
             
         except Exception as e:
             logger.error(f"Client handling error: {e}")
@@ -1143,40 +4387,376 @@ class AdvancedSOCKS5Proxy(threading.Thread):
             
             # Properly close and untrack channel
             if remote_socket:
+                self.untrack_channel(remote_socket)
+
+    @staticmethod
+    def _refuse_client(client_socket: socket.socket, reply: bytes, fast_open: bool):
+        """Send a failure reply, or reset the connection if success was already sent optimistically."""
+        if not fast_open:
+            client_socket.send(reply)
+            return
+        # A success reply cannot be taken back; RST tells the client the stream is dead
+        linger = struct.pack('hh' if platform.system() == "Windows" else 'ii', 1, 0)
+        try:
+            client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, linger)
+        except OSError:
+            pass
+        client_socket.close()
+
+    def _resolve_destination(self, domain: str) -> List[str]:
+        """Resolve a SOCKS5 domain request to its addresses, empty if every resolver failed."""
+        return self.dns_resolver.resolve_all(domain)
+
+    def _lookup_domain(self, domain: str) -> Optional[Tuple[List[str], Optional[int]]]:
+        """Query the configured DNS for A and AAAA, then the system resolver; runs on the DNS executor.
+        
+        Returns (addresses, ttl), ([], None) if the name does not exist, or None on failure.
+        """
+        # AAAA runs alongside A; once A answers it gets only a short grace period (RFC 8305)
+        aaaa = self.aaaa_executor.submit(self._query_records, domain, 'AAAA')
+        ipv4, ttl4, not_found = self._query_records(domain, 'A')
+        if ipv4:
+            wait([aaaa], timeout=self.aaaa_grace)
+        else:
+            wait([aaaa])
+        
+        if aaaa.done():
+            ipv6, ttl6, _ = aaaa.result()
+        else:
+            ipv6, ttl6 = [], None
+            aaaa.add_done_callback(lambda f: self._merge_late_aaaa(domain, ipv4, ttl4, f))
+        
+        # DNS resolution با fallback به DNS عمومی
+        # ابتدا از DNS تنظیم شده استفاده کنید
+        if ipv4 or ipv6:
+            addresses = self._interleave_families(ipv6, ipv4)
+            ttl = min(t for t in (ttl4, ttl6) if t is not None)
+            logger.info(f"DNS resolved {domain} -> {addresses[0]} (+{len(addresses) - 1}) via configured DNS")
+            return addresses, ttl
+        
+        # اگر DNS اصلی جواب نداد، از DNS محلی سیستم استفاده کنید
+        try:
+            infos = socket.getaddrinfo(domain, None, proto=socket.IPPROTO_TCP)
+            ipv6 = list(dict.fromkeys(info[4][0] for info in infos if info[0] == socket.AF_INET6))
+            ipv4 = list(dict.fromkeys(info[4][0] for info in infos if info[0] == socket.AF_INET))
+            addresses = self._interleave_families(ipv6, ipv4)
+            logger.info(f"DNS resolved {domain} -> {addresses[0]} via system DNS")
+            return addresses, None
+        except socket.gaierror as e:
+            logger.error(f"All DNS resolutions failed for {domain}")
+            if not_found or e.errno == socket.EAI_NONAME:
+                return [], None
+            return None
+
+    def _query_records(self, domain: str, rdtype: str) -> Tuple[List[str], Optional[int], bool]:
+        """Resolve one record type: (addresses, ttl, name_does_not_exist)."""
+        # The hedged resolver records per-nameserver health (and feeds the ranker) itself
+        resolver = self.hedged_resolver or self.resolver
+        try:
+            answers = resolver.resolve(domain, rdtype)
+            return [str(answer) for answer in answers], answers.rrset.ttl, False
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+            logger.debug(f"Configured DNS has no {rdtype} record for {domain}: {e}")
+            return [], None, True
+        except Exception as e:
+            logger.debug(f"Configured DNS {rdtype} resolution failed: {e}")
+            return [], None, False
+
+    def _merge_late_aaaa(self, domain: str, ipv4: List[str], ttl4: Optional[int], future: Future):
+        """Add AAAA records that arrived after the A answer was already cached."""
+        try:
+            ipv6, ttl6, _ = future.result()
+        except Exception:
+            return
+        if ipv6:
+            ttl = min(t for t in (ttl4, ttl6) if t is not None)
+            self.dns_cache.set(domain, self._interleave_families(ipv6, ipv4), ttl)
+
+    @staticmethod
+    def _interleave_families(ipv6: List[str], ipv4: List[str]) -> List[str]:
+        """Alternate address families, IPv6 first (RFC 8305 section 4)."""
+        return [address for pair in zip_longest(ipv6, ipv4) for address in pair if address]
+
+    def _log_destination(self, client_info: str, destination: str):
+        """Record a requested destination in the connection history."""
+        self.connection_logger.add_connection(client_info, destination)
+        
+        # Log traffic if enabled
+        if self.config.get("log_traffic"):
+            self.log_callback(f"[Traffic] {client_info} -> {destination}")
+        
+        logger.debug(f"Connecting to {destination}")
+
+    def _open_remote_channel(self, dest_addr: str, dest_port: int, origin: tuple,
+                             candidates: Optional[List[str]] = None):
+        """Open and track a direct-tcpip channel, raising SOCKS5ReplyError on failure.
+        
+        With several resolved candidates for a domain the opens are raced.
+        """
+        if self.warm_pool:
+            self.warm_pool.note_request(dest_addr, dest_port)
+            channel = self.warm_pool.take(dest_addr, dest_port)
+            if channel:
+                with self.channels_lock:
+                    self.active_channels.add(channel)
+                return channel
+        
+        # Create SSH tunnel with RTT measurement, on the least busy pooled transport
+        member = self.transport_pool.acquire(dest_addr)
+        if member is None:
+            logger.error("SSH transport is not active - attempting to reconnect")
+            self.log_callback("[!] SSH connection lost, reconnecting...")
+            
+            # تلاش برای بازسازی اتصال
+            try:
+                self._establish_ssh_connection()
+                member = self.transport_pool.acquire(dest_addr)
+            except Exception as e:
+                logger.error(f"Reconnection failed: {e}")
+                raise SOCKS5ReplyError(0x01, f"Reconnection failed: {e}")
+            if member is None:
+                raise SOCKS5ReplyError(0x01, "SSH transport is not active")
+        transport = member["transport"]
+        
+        try:
+            if candidates and len(candidates) > 1:
+                channel = self._race_channels(transport, candidates, dest_port, origin)
+            else:
+                target = candidates[0] if candidates else dest_addr
+                try:
+                    channel = self._timed_open(transport, target, dest_port, origin)
+                except Exception as e:
+                    logger.debug(f"Channel open failed for {target}:{dest_port}: {e}")
+                    raise SOCKS5ReplyError(0x05, str(e))
+            
+            if not channel:
+                logger.error(f"Failed to open channel to {dest_addr}:{dest_port}")
+                raise SOCKS5ReplyError(0x01)
+        except Exception:
+            self.transport_pool.release(member)
+            raise
+        
+        # Track active channel
+        self.transport_pool.track(member, channel)
+        with self.channels_lock:
+            self.active_channels.add(channel)
+        return channel
+
+    def _timed_open(self, transport, address: str, dest_port: int, origin: tuple):
+        """Open one direct-tcpip channel, feeding its latency to the health monitor and ranker."""
+        start_time = time.time()
+        interface = self.transport_pool.interface_of(transport)
+        try:
+            channel = transport.open_channel("direct-tcpip", (address, dest_port), origin, timeout=10)
+        except Exception:
+            self.address_ranker.record_failure(address)
+            if interface and not transport.is_active():
+                # Only a dead transport says something about the link; a refused destination does not
+                self.iface_manager.record_result(interface, False)
+            raise
+        rtt = (time.time() - start_time) * 1000
+        self.health_monitor.add_rtt(rtt)
+        self.address_ranker.record_success(address, rtt)
+        self.transport_pool.record_open(transport, rtt)
+        if interface:
+            self.iface_manager.record_result(interface, True)
+        return channel
+
+    def _race_channels(self, transport, candidates: List[str], dest_port: int, origin: tuple):
+        """Start an open every race_stagger seconds (sooner on failure); first success wins."""
+        ordered = self.address_ranker.order(candidates)[:self.race_max_attempts]
+        attempts: Dict[Future, str] = {}
+        pending = set()
+        winner = None
+        last_error = None
+        next_index = 0
+        
+        while winner is None and (next_index < len(ordered) or pending):
+            if next_index < len(ordered):
+                future = self.race_executor.submit(self._timed_open, transport, ordered[next_index], dest_port, origin)
+                attempts[future] = ordered[next_index]
+                pending.add(future)
+                next_index += 1
+            timeout = self.race_stagger if next_index < len(ordered) else None
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    channel = future.result()
+                except Exception as e:
+                    last_error = e
+                    logger.debug(f"Race attempt to {attempts[future]}:{dest_port} failed: {e}")
+                    continue
+                if winner is None and channel:
+                    winner = channel
+                    logger.debug(f"Race to port {dest_port} won by {attempts[future]}")
+                elif channel:
+                    channel.close()
+        
+        # Losers still in flight are closed as soon as their open completes
+        for future in pending:
+            if not future.cancel():
+                future.add_done_callback(self._close_race_loser)
+        
+        if winner is None:
+            raise SOCKS5ReplyError(0x05, str(last_error))
+        return winner
+
+    @staticmethod
+    def _close_race_loser(future: Future):
+        try:
+            channel = future.result()
+        except Exception:
+            return
+        if channel:
+            channel.close()
+
+    def _open_dns_channel(self):
+        """Open the channel to the upstream resolver used by the DNS stub."""
+        transport = self.ssh_client.get_transport() if self.ssh_client else None
+        if not transport or not transport.is_active():
+            raise ConnectionError("SSH transport is not active")
+        upstream = self.config.get("dns_stub_upstream", "1.1.1.1")
+        return transport.open_channel("direct-tcpip", (upstream, 53), ('127.0.0.1', 0), timeout=10)
+
+    def _open_warm_channel(self, dest_addr: str, dest_port: int):
+        """Open an untracked channel for the warm pool; None while the transport is down."""
+        member = self.transport_pool.acquire(dest_addr)
+        if member is None:
+            return None
+        target = dest_addr
+        try:
+            if not self.remote_dns:
                 try:
-                    remote_socket.close()
-                except:
-                    pass
-                
-                with self.channels_lock:
-                    self.active_channels.discard(remote_socket)
+                    ipaddress.ip_address(dest_addr)
+                except ValueError:
+                    candidates = self._resolve_destination(dest_addr)
+                    if not candidates:
+                        raise OSError(f"cannot resolve {dest_addr}")
+                    target = self.address_ranker.order(candidates)[0]
+            channel = self._timed_open(member["transport"], target, dest_port, ('127.0.0.1', 0))
+        except Exception:
+            self.transport_pool.release(member)
+            raise
+        self.transport_pool.track(member, channel)
+        return channel
+
+    def untrack_channel(self, channel):
+        """Close a channel and drop it from active tracking."""
+        try:
+            channel.close()
+        except Exception:
+            pass
+        
+        with self.channels_lock:
+            self.active_channels.discard(channel)
 
-    def forward_data(self, client: socket.socket, remote):
-        """Bidirectional data forwarding with optimized timeout."""
+    def forward_data(self, client: socket.socket, remote, early_data: bytes = b'',
+                     first_byte_callback: Optional[Callable] = None):
+        """Flow-controlled bidirectional forwarding over pooled buffers with adaptive read sizes."""
+        pool = self.buffer_pool
+        upload_buf = pool.acquire()
+        upload_view = memoryview(upload_buf)
+        # Reads never exceed the pooled buffer or the channel's max packet size
+        upload_size = AdaptiveReadSize(min(pool.buffer_size, getattr(remote, 'out_max_packet_size', 32768)))
+        download_size = AdaptiveReadSize(min(pool.buffer_size, getattr(remote, 'in_max_packet_size', 32768)))
+        
+        # Bytes read from one side but not yet accepted by the other
+        to_remote = RelayQueue(self.relay_high_watermark, self.relay_low_watermark)
+        to_client = RelayQueue(self.relay_high_watermark, self.relay_low_watermark)
+        client_eof = False
+        remote_eof = False
+        # EOF is passed on as a half-close once the queue behind it has drained
+        remote_shut = False
+        client_shut = False
+        
+        if early_data:
+            to_remote.push(early_data)
+            self.stats.add_sent(len(early_data))
+        
+        meter = self._interface_meter(remote)
+        
+        client.setblocking(False)
+        remote.settimeout(0.0)
+        
         try:
             while self.running:
-                # Reduced timeout from 10s to 0.5s for better responsiveness
-                r, w, x = select.select([client, remote], [], [], 0.5)
+                # A half-closing client still gets its response: shut down only the write side
+                # behind the drained queue and keep relaying the other direction
+                if client_eof and not to_remote and not remote_shut:
+                    remote.shutdown_write()
+                    remote_shut = True
+                if remote_eof and not to_client and not client_shut:
+                    client.shutdown(socket.SHUT_WR)
+                    client_shut = True
+                # Done once both directions finished, or the channel closed under a drained download
+                if remote_shut and client_shut:
+                    break
+                if client_shut and getattr(remote, 'closed', False):
+                    break
                 
-                if not r:
-                    continue
+                # A side is only read while the opposite queue is below its watermark
+                readers = []
+                if not client_eof and not to_remote.paused:
+                    readers.append(client)
+                if not remote_eof and not to_client.paused:
+                    readers.append(remote)
+                writers = [client] if to_client else []
+                # Channels have no writable fd, so poll the SSH window while data waits on it
+                timeout = 0.01 if to_remote else 0.5
+                
+                if readers or writers:
+                    r, w, x = select.select(readers, writers, [], timeout)
+                else:
+                    # Only the upload queue is waiting on the SSH window; Windows rejects an empty select()
+                    time.sleep(timeout)
+                    r = w = []
+                
+                if to_remote:
+                    to_remote.flush(lambda view: nonblocking_send(remote, view))
+                if client in w:
+                    to_client.flush(lambda view: nonblocking_send(client, view))
                 
                 if client in r:
-                    data = client.recv(8192)
-                    if not data:
-                        break
-                    remote.send(data)
-                    self.stats.add_sent(len(data))
+                    try:
+                        received = client.recv_into(upload_buf, upload_size.size)
+                    except BlockingIOError:
+                        received = None
+                    if received == 0:
+                        client_eof = True
+                    elif received:
+                        self.stats.add_sent(received)
+                        if meter:
+                            meter[0].add(received)
+                        upload_size.update(received)
+                        # Write straight from the pooled buffer; only a remainder gets queued
+                        sent = 0 if to_remote else nonblocking_send(remote, upload_view[:received])
+                        if sent < received:
+                            to_remote.push(upload_view[sent:received])
                 
                 if remote in r:
-                    data = remote.recv(8192)
-                    if not data:
-                        break
-                    client.send(data)
-                    self.stats.add_received(len(data))
+                    # paramiko channels have no recv_into; recv hands over its buffered bytes
+                    try:
+                        data = remote.recv(download_size.size)
+                    except socket.timeout:
+                        data = None
+                    if data is not None and not data:
+                        remote_eof = True
+                    elif data:
+                        if first_byte_callback:
+                            first_byte_callback()
+                            first_byte_callback = None
+                        self.stats.add_received(len(data))
+                        if meter:
+                            meter[1].add(len(data))
+                        download_size.update(len(data))
+                        sent = 0 if to_client else nonblocking_send(client, data)
+                        if sent < len(data):
+                            to_client.push(memoryview(data)[sent:])
         except Exception as e:
             logger.debug(f"Forward data error: {e}")
         finally:
+            upload_view.release()
+            pool.release(upload_buf)
             try:
                 remote.close()
             except:
@@ -1193,6 +4773,40 @@ class AdvancedSOCKS5Proxy(threading.Thread):
             except:
                 pass
         
+        if self.async_engine:
+            self.async_engine.stop()
+        
+        if self.warm_pool:
+            self.warm_pool.stop()
+        
+        self.transport_pool.stop()
+        
+        if self.interface_scorer:
+            self.interface_scorer.stop()
+        
+        if self.interface_watcher:
+            self.interface_watcher.stop()
+        
+        if self.mptcp:
+            self.mptcp.remove_endpoints()
+        
+        if self.resolver_ranker:
+            self.resolver_ranker.stop()
+        
+        if self.dns_stub:
+            self.dns_stub.stop()
+        
+        self.dns_resolver.shutdown()
+        if self.hedged_resolver:
+            self.hedged_resolver.shutdown()
+        if isinstance(self.resolver, EncryptedDNSResolver):
+            self.resolver.close()
+        self.aaaa_executor.shutdown(wait=False, cancel_futures=True)
+        self.race_executor.shutdown(wait=False, cancel_futures=True)
+        if self.dns_store:
+            self.dns_cache.store = None
+            self.dns_store.close()
+        
         # Shutdown thread pool
         if self.executor:
             logger.info("Shutting down thread pool...")
@@ -1219,6 +4833,260 @@ class AdvancedSOCKS5Proxy(threading.Thread):
         
         self.log_callback("[*] Proxy server stopped")
 
+# ================= ASYNCIO DATA-PLANE ENGINE =================
+class AsyncSOCKS5Engine:
+    """SOCKS5 data plane running every client as coroutines on one event loop."""
+    
+    READ_SIZE = 32768
+    
+    def __init__(self, proxy: AdvancedSOCKS5Proxy, host: str, port: int, open_workers: int = 32):
+        self.proxy = proxy
+        self.host = host
+        self.port = port
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._stop_event: Optional[asyncio.Event] = None
+        # paramiko's open_channel blocks until the server confirms, so channel
+        # opens (and DNS lookups) are the only work handed to threads
+        self._open_executor = ThreadPoolExecutor(max_workers=open_workers, thread_name_prefix="SOCKS-Open")
+    
+    @staticmethod
+    def new_event_loop() -> asyncio.AbstractEventLoop:
+        """Create a uvloop loop when available, else a selector loop (needed for add_reader)."""
+        if uvloop is not None:
+            return uvloop.new_event_loop()
+        if platform.system() == "Windows":
+            return asyncio.SelectorEventLoop()
+        return asyncio.new_event_loop()
+    
+    def run(self):
+        """Run the event loop until stop() is called."""
+        self.loop = self.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._serve())
+        finally:
+            try:
+                pending = [t for t in asyncio.all_tasks(self.loop) if not t.done()]
+                for task in pending:
+                    task.cancel()
+                if pending:
+                    self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            finally:
+                self.loop.close()
+                self._open_executor.shutdown(wait=False, cancel_futures=True)
+    
+    def stop(self):
+        """Stop serving; safe to call from any thread."""
+        loop = self.loop
+        if loop and not loop.is_closed() and self._stop_event:
+            try:
+                loop.call_soon_threadsafe(self._stop_event.set)
+            except RuntimeError:
+                pass
+    
+    async def _serve(self):
+        self._stop_event = asyncio.Event()
+        self._server = await asyncio.start_server(
+            self._handle_client, self.host, self.port,
+            reuse_address=True, backlog=1024
+        )
+        try:
+            await self._stop_event.wait()
+        finally:
+            self._server.close()
+            await self._server.wait_closed()
+    
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Handle one SOCKS5 client from handshake to teardown."""
+        addr = writer.get_extra_info('peername')[:2]
+        channel = None
+        self.proxy.stats.increment_connection()
+        self.proxy.increment_thread_count()
+        
+        try:
+            request_time = time.time()
+            channel = await self._negotiate(reader, writer, addr)
+            if channel:
+                await self._relay(reader, writer, channel, request_time)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # Engine shutdown; swallowed so the stream callback doesn't log it
+            pass
+        except Exception as e:
+            logger.error(f"Async client handling error: {e}")
+            self.proxy.stats.increment_failed()
+        finally:
+            try:
+                writer.close()
+            except Exception:
+                pass
+            if channel:
+                self.proxy.untrack_channel(channel)
+            self.proxy.stats.decrement_connection()
+            self.proxy.decrement_thread_count()
+    
+    async def _negotiate(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, addr: tuple):
+        """Run the SOCKS5 handshake and open the tunnel channel; None if the request was refused."""
+        loop = asyncio.get_running_loop()
+        client_info = f"{addr[0]}:{addr[1]}"
+        
+        parser = SOCKS5HandshakeParser()
+        method_replied = False
+        while not parser.done:
+            data = await reader.read(4096)
+            if not data:
+                return None
+            parser.feed(data)
+            if parser.greeting_done and not method_replied:
+                # Pipelined requests get this coalesced with the request reply below
+                writer.write(parser.METHOD_REPLY)
+                method_replied = True
+                if not parser.done:
+                    await writer.drain()
+        
+        if parser.invalid:
+            return None
+        if parser.reply_code is not None:
+            writer.write(socks5_reply(parser.reply_code))
+            return None
+        
+        _, addr_type, dest_addr, dest_port = parser.request
+        fast_open = self.proxy.fast_open
+        if fast_open:
+            writer.write(socks5_reply(0x00))
+        
+        candidates = None
+        if addr_type == 3 and not self.proxy.remote_dns:  # Domain name
+            candidates = await self.proxy.dns_resolver.resolve_all_async(dest_addr)
+            if not candidates:
+                self._refuse(writer, 0x04, fast_open)
+                return None
+        
+        self.proxy._log_destination(client_info, f"{dest_addr}:{dest_port}")
+        
+        try:
+            channel = await loop.run_in_executor(
+                self._open_executor, self.proxy._open_remote_channel, dest_addr, dest_port, addr, candidates
+            )
+        except SOCKS5ReplyError as e:
+            self._refuse(writer, e.reply_code, fast_open)
+            self.proxy.stats.increment_failed()
+            return None
+        
+        if parser.early_data:
+            channel.setblocking(0)
+            await self._channel_send(channel, parser.early_data)
+            self.proxy.stats.add_sent(len(parser.early_data))
+        
+        if not fast_open:
+            writer.write(socks5_reply(0x00))
+        await writer.drain()
+        return channel
+    
+    @staticmethod
+    def _refuse(writer: asyncio.StreamWriter, reply_code: int, fast_open: bool):
+        """Send a failure reply, or abort with RST after an optimistic success reply."""
+        if not fast_open:
+            writer.write(socks5_reply(reply_code))
+            return
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            linger = struct.pack('hh' if platform.system() == "Windows" else 'ii', 1, 0)
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, linger)
+            except OSError:
+                pass
+        writer.transport.abort()
+    
+    async def _relay(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, channel,
+                     request_time: float):
+        """Forward both directions until both have ended, passing each EOF on as a half-close."""
+        channel.setblocking(0)
+        # drain() blocks past the high watermark, which stops channel reads and lets
+        # the SSH window throttle the server instead of buffering in memory
+        writer.transport.set_write_buffer_limits(
+            high=self.proxy.relay_high_watermark, low=self.proxy.relay_low_watermark
+        )
+        upstream = asyncio.ensure_future(self._client_to_channel(reader, channel))
+        downstream = asyncio.ensure_future(self._channel_to_client(channel, writer, request_time))
+        pending = {upstream, downstream}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # An error ends both directions; so does a closed channel, which accepts no more data
+            if any(task.exception() for task in done) or channel.closed:
+                break
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in (upstream, downstream):
+            if task.done() and not task.cancelled() and task.exception() \
+                    and not isinstance(task.exception(), (ConnectionError, socket.error)):
+                logger.debug(f"Async forward error: {task.exception()}")
+    
+    async def _client_to_channel(self, reader: asyncio.StreamReader, channel):
+        meter = self.proxy._interface_meter(channel)
+        while self.proxy.running:
+            data = await reader.read(self.READ_SIZE)
+            if not data:
+                break
+            await self._channel_send(channel, data)
+            self.proxy.stats.add_sent(len(data))
+            if meter:
+                meter[0].add(len(data))
+        channel.shutdown_write()
+    
+    async def _channel_send(self, channel, data: bytes):
+        """Write all of data to a non-blocking channel, yielding while its window is full."""
+        view = memoryview(data)
+        delay = 0.001
+        while view:
+            try:
+                sent = channel.send(view)
+            except socket.timeout:
+                # No SSH window available; paramiko offers no writable fd to wait on
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.05)
+                continue
+            if sent <= 0:
+                raise ConnectionError("SSH channel closed")
+            view = view[sent:]
+            delay = 0.001
+    
+    async def _channel_to_client(self, channel, writer: asyncio.StreamWriter, request_time: float):
+        loop = asyncio.get_running_loop()
+        meter = self.proxy._interface_meter(channel)
+        first_byte = True
+        readable = asyncio.Event()
+        fd = channel.fileno()
+        while self.proxy.running:
+            try:
+                data = channel.recv(self.READ_SIZE)
+            except socket.timeout:
+                # Watched only while waiting: the pipe stays readable while in_buffer holds
+                # data, so a reader left registered during drain() would spin the loop
+                readable.clear()
+                loop.add_reader(fd, readable.set)
+                try:
+                    if not channel.recv_ready():
+                        await readable.wait()
+                finally:
+                    loop.remove_reader(fd)
+                continue
+            if not data:
+                if writer.can_write_eof():
+                    writer.write_eof()
+                break
+            if first_byte:
+                self.proxy.stats.record_ttfb((time.time() - request_time) * 1000, self.proxy.fast_open)
+                first_byte = False
+            writer.write(data)
+            await writer.drain()
+            self.proxy.stats.add_received(len(data))
+            if meter:
+                meter[1].add(len(data))
+
 # ================= ULTIMATE GUI APPLICATION =================
 class TunnelProApp(ctk.CTk):
     """Ultimate SSH Tunnel application with all features."""
@@ -1254,6 +5122,11 @@ class TunnelProApp(ctk.CTk):
         self.connection_logger = ConnectionLogger(max_connections=50)
         self.dns_tester = DNSTester()
         self.app_config = self.load_config()
+        for name, weight in self.app_config.get("settings", {}).get("interface_weights", {}).items():
+            try:
+                self.iface_manager.set_weight(name, weight)
+            except (TypeError, ValueError) as e:
+                logger.warning(f"Ignoring saved interface weight: {e}")
         
         self.proxy_thread: Optional[AdvancedSOCKS5Proxy] = None
         self.ssh_active_client: Optional[paramiko.SSHClient] = None
@@ -1495,6 +5368,14 @@ class TunnelProApp(ctk.CTk):
             command=self.browse_key_file
         ).pack(side="left", padx=(5, 0))
         
+        # Resolve domain names on the SSH server (next to the destination)
+        self.var_remote_dns = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(
+            self.frame_server,
+            text="Resolve DNS on server (remote DNS)",
+            variable=self.var_remote_dns
+        ).grid(row=3, column=0, columnspan=3, padx=10, pady=(5, 0), sticky="w")
+        
         # Save button
         ctk.CTkButton(
             self.frame_server, 
@@ -1503,7 +5384,7 @@ class TunnelProApp(ctk.CTk):
             fg_color="#27ae60",
             hover_color="#2ecc71",
             height=35
-        ).grid(row=3, column=0, columnspan=3, padx=10, pady=(10, 15), sticky="ew")
+        ).grid(row=4, column=0, columnspan=3, padx=10, pady=(10, 15), sticky="ew")
         
         self.frame_server.grid_columnconfigure(1, weight=1)
 
@@ -1564,9 +5445,24 @@ class TunnelProApp(ctk.CTk):
             command=self.save_dns
         ).grid(row=2, column=0, padx=5, pady=(3, 10), sticky="ew")
         
+        # Resolver transport: plain UDP, DNS-over-TLS or DNS-over-HTTPS
+        self.var_dns_protocol = tk.StringVar(value="udp")
+        ctk.CTkOptionMenu(
+            self.frame_dns,
+            values=["udp", "dot", "doh"],
+            variable=self.var_dns_protocol,
+            width=100
+        ).grid(row=3, column=0, padx=5, pady=3, sticky="ew")
+        
+        self.ent_dns_url = ctk.CTkEntry(
+            self.frame_dns,
+            placeholder_text="DoH URL / DoT TLS host (optional)"
+        )
+        self.ent_dns_url.grid(row=3, column=1, padx=5, pady=3, sticky="ew")
+        
         # ========== CURRENT DNS STATUS FRAME - اینجا اضافه شود ==========
         self.current_dns_frame = ctk.CTkFrame(self.frame_dns)
-        self.current_dns_frame.grid(row=3, column=0, columnspan=2, padx=5, pady=(10, 5), sticky="ew")
+        self.current_dns_frame.grid(row=4, column=0, columnspan=2, padx=5, pady=(10, 5), sticky="ew")
         
         ctk.CTkLabel(
             self.current_dns_frame,
@@ -1664,11 +5560,41 @@ class TunnelProApp(ctk.CTk):
                                 self.lbl_current_dns.configure(text=f"Custom DNS ({dns1})")
                         else:
                             self.lbl_current_dns.configure(text="Using system default DNS")
+                
+                self.update_dns_ranking_display()
             except Exception as e:
                 logger.debug(f"DNS status update error: {e}")
             
             time.sleep(2)
 
+    def update_dns_ranking_display(self):
+        """Show the proxy's live nameserver ranking in the DNS tab."""
+        ranker = getattr(self.proxy_thread, 'resolver_ranker', None) if self.proxy_thread else None
+        if ranker:
+            lines = [f"{'':2}{'Name':<25} {'IP':<16} {'Latency':>9} {'Fail':>6} {'Samples':>8}", "-" * 70]
+            for entry in ranker.get_ranking():
+                latency = f"{entry['latency_ms']:.1f} ms" if entry['latency_ms'] is not None else "--"
+                marker = "▶ " if entry["active"] else "  "
+                lines.append(f"{marker}{entry['name'][:25]:<25} {entry['ip']:<16} {latency:>9} "
+                             f"{entry['failure_rate']:>5.0f}% {entry['samples']:>8}")
+            lines.append(f"\nAutomatic switches this session: {ranker.switches}")
+        else:
+            lines = ["Connect to start live resolver ranking."]
+        
+        hedged = getattr(self.proxy_thread, 'hedged_resolver', None) if self.proxy_thread else None
+        if hedged:
+            hedge_stats = hedged.get_stats()
+            lines.append(f"Hedged queries: {hedge_stats['hedges']} of {hedge_stats['queries']} lookups, "
+                         f"{hedge_stats['hedge_wins']} answered by the hedge")
+            if hedge_stats["dead"]:
+                lines.append(f"Skipping unresponsive: {', '.join(hedge_stats['dead'])}")
+        text = "\n".join(lines)
+        
+        self.dns_ranking_text.configure(state="normal")
+        self.dns_ranking_text.delete("1.0", "end")
+        self.dns_ranking_text.insert("end", text)
+        self.dns_ranking_text.configure(state="disabled")
+
     def setup_multihop_tab(self):
         """Setup multi-hop tunneling configuration."""
         main_frame = ctk.CTkScrollableFrame(self.tab_multihop)
@@ -1848,6 +5774,22 @@ class TunnelProApp(ctk.CTk):
         self.scroll_interfaces = ctk.CTkScrollableFrame(self.frame_interfaces)
         self.scroll_interfaces.pack(fill="both", expand=True, padx=15, pady=(0, 10))
         
+        self.lbl_iface_traffic = ctk.CTkLabel(
+            self.frame_interfaces,
+            text="Tunnel traffic per interface: --",
+            font=("Consolas", 11),
+            justify="left"
+        )
+        self.lbl_iface_traffic.pack(pady=(0, 10))
+        
+        self.lbl_mptcp = ctk.CTkLabel(
+            self.frame_interfaces,
+            text="",
+            font=("Consolas", 11),
+            justify="left"
+        )
+        self.lbl_mptcp.pack(pady=(0, 10))
+        
         ctk.CTkButton(
             self.frame_interfaces,
             text="🔍 Scan Network Interfaces",
@@ -1958,6 +5900,30 @@ class TunnelProApp(ctk.CTk):
         )
         self.lbl_conn_rate.pack(pady=10)
         
+        self.lbl_ttfb = ctk.CTkLabel(
+            conn_frame,
+            text="TTFB: -- ms",
+            font=("Consolas", 12),
+            text_color="#3498db"
+        )
+        self.lbl_ttfb.pack(pady=2)
+        
+        self.lbl_dns_cache = ctk.CTkLabel(
+            conn_frame,
+            text="DNS Cache: --",
+            font=("Consolas", 12),
+            text_color="#9b59b6"
+        )
+        self.lbl_dns_cache.pack(pady=2)
+        
+        self.lbl_transports = ctk.CTkLabel(
+            conn_frame,
+            text="SSH Transports: --",
+            font=("Consolas", 12),
+            text_color="#1abc9c"
+        )
+        self.lbl_transports.pack(pady=2)
+        
         # Session Info
         session_frame = ctk.CTkFrame(stats_container)
         session_frame.grid(row=1, column=0, columnspan=2, padx=10, pady=10, sticky="nsew")
@@ -2110,6 +6076,18 @@ class TunnelProApp(ctk.CTk):
         self.ent_dns_test_rounds.insert(0, "3")
         self.ent_dns_test_rounds.pack(side="left")
         
+        # Extra resolvers to test alongside the built-in list
+        ctk.CTkLabel(
+            config_frame,
+            text="Extra DNS Servers (one per line: IP or Name=IP):",
+        ).pack(anchor="w", padx=15, pady=(10, 0))
+        
+        self.txt_dns_custom_servers = ctk.CTkTextbox(config_frame, font=("Consolas", 11), height=80)
+        self.txt_dns_custom_servers.insert(
+            "1.0", "\n".join(self.app_config.get("settings", {}).get("dns_custom_servers", []))
+        )
+        self.txt_dns_custom_servers.pack(fill="x", padx=15, pady=5)
+        
         # Test button
         ctk.CTkButton(
             config_frame,
@@ -2139,6 +6117,24 @@ class TunnelProApp(ctk.CTk):
         )
         self.dns_results_text.pack(fill="both", expand=True, padx=15, pady=(0, 15))
         
+        # Live ranking maintained by the running proxy
+        ranking_frame = ctk.CTkFrame(main_frame)
+        ranking_frame.pack(fill="both", expand=True, pady=(0, 15))
+        
+        ctk.CTkLabel(
+            ranking_frame,
+            text="Live Resolver Ranking",
+            font=("Roboto", 16, "bold")
+        ).pack(anchor="w", padx=15, pady=(15, 10))
+        
+        self.dns_ranking_text = ctk.CTkTextbox(
+            ranking_frame,
+            font=("Consolas", 11),
+            height=150,
+            state="disabled"
+        )
+        self.dns_ranking_text.pack(fill="both", expand=True, padx=15, pady=(0, 15))
+        
         # Apply button
         self.btn_apply_dns = ctk.CTkButton(
             main_frame,
@@ -2327,6 +6323,133 @@ class TunnelProApp(ctk.CTk):
             command=self.save_settings
         ).pack(anchor="w", padx=20, pady=5)
         
+        # Live resolver ranking (needs DNS optimization)
+        self.var_dns_live_ranking = ctk.BooleanVar(
+            value=self.app_config.get("settings", {}).get("dns_live_ranking", True)
+        )
+        ctk.CTkCheckBox(
+            general_frame,
+            text="Live DNS Resolver Ranking (keep re-ranking nameservers during the session)",
+            variable=self.var_dns_live_ranking,
+            command=self.save_settings
+        ).pack(anchor="w", padx=20, pady=5)
+        
+        # Optimistic SOCKS5 reply
+        self.var_fast_open = ctk.BooleanVar(
+            value=self.app_config.get("settings", {}).get("socks_fast_open", False)
+        )
+        ctk.CTkCheckBox(
+            general_frame,
+            text="Optimistic SOCKS5 Reply (fast open, saves one tunnel RTT per connection)",
+            variable=self.var_fast_open,
+            command=self.save_settings
+        ).pack(anchor="w", padx=20, pady=5)
+        
+        # Warm channel pool
+        self.var_warm_pool = ctk.BooleanVar(
+            value=self.app_config.get("settings", {}).get("warm_channel_pool", False)
+        )
+        ctk.CTkCheckBox(
+            general_frame,
+            text="Warm Channel Pool (pre-open channels to frequently used destinations)",
+            variable=self.var_warm_pool,
+            command=self.save_settings
+        ).pack(anchor="w", padx=20, pady=5)
+        
+        # Per-network cache of optimization results
+        self.var_network_profiles = ctk.BooleanVar(
+            value=self.app_config.get("settings", {}).get("network_profile_cache", True)
+        )
+        ctk.CTkCheckBox(
+            general_frame,
+            text="Remember Optimization Results per Network (instant connect on known networks)",
+            variable=self.var_network_profiles,
+            command=self.save_settings
+        ).pack(anchor="w", padx=20, pady=5)
+        
+        # Local DNS stub over the tunnel
+        stub_frame = ctk.CTkFrame(general_frame, fg_color="transparent")
+        stub_frame.pack(fill="x", padx=20, pady=5)
+        
+        self.var_dns_stub = ctk.BooleanVar(
+            value=self.app_config.get("settings", {}).get("dns_stub_enabled", False)
+        )
+        ctk.CTkCheckBox(
+            stub_frame,
+            text="Local DNS Stub over Tunnel, port:",
+            variable=self.var_dns_stub,
+            command=self.save_settings
+        ).pack(side="left")
+        
+        self.ent_dns_stub_port = ctk.CTkEntry(stub_frame, width=80)
+        self.ent_dns_stub_port.insert(0, str(self.app_config.get("settings", {}).get("dns_stub_port", 5300)))
+        self.ent_dns_stub_port.pack(side="left", padx=10)
+        
+        # Parallel SSH transports
+        transports_frame = ctk.CTkFrame(general_frame, fg_color="transparent")
+        transports_frame.pack(fill="x", padx=20, pady=5)
+        
+        ctk.CTkLabel(
+            transports_frame,
+            text="SSH Transports (min / max):",
+            font=("Roboto", 12)
+        ).pack(side="left", padx=(0, 10))
+        
+        self.ent_transports_min = ctk.CTkEntry(transports_frame, width=60)
+        self.ent_transports_min.insert(0, str(self.app_config.get("settings", {}).get("ssh_transports_min", 1)))
+        self.ent_transports_min.pack(side="left")
+        
+        self.ent_transports_max = ctk.CTkEntry(transports_frame, width=60)
+        self.ent_transports_max.insert(0, str(self.app_config.get("settings", {}).get("ssh_transports_max", 1)))
+        self.ent_transports_max.pack(side="left", padx=10)
+        
+        self.var_channel_scheduler = tk.StringVar(
+            value=self.app_config.get("settings", {}).get("channel_scheduler", "p2c")
+        )
+        ctk.CTkOptionMenu(
+            transports_frame,
+            values=list(ChannelScheduler.MODES),
+            variable=self.var_channel_scheduler,
+            command=lambda x: self.save_settings()
+        ).pack(side="left")
+        
+        self.var_channel_sticky = ctk.BooleanVar(
+            value=self.app_config.get("settings", {}).get("channel_sticky", True)
+        )
+        ctk.CTkCheckBox(
+            transports_frame,
+            text="Sticky destinations",
+            variable=self.var_channel_sticky,
+            command=self.save_settings
+        ).pack(side="left", padx=10)
+        
+        # Proxy engine
+        engine_frame = ctk.CTkFrame(general_frame, fg_color="transparent")
+        engine_frame.pack(fill="x", padx=20, pady=(10, 0))
+        
+        ctk.CTkLabel(
+            engine_frame,
+            text="Proxy Engine:",
+            font=("Roboto", 12)
+        ).pack(side="left", padx=(0, 10))
+        
+        self.var_proxy_engine = tk.StringVar(
+            value=self.app_config.get("settings", {}).get("proxy_engine", "thread")
+        )
+        ctk.CTkOptionMenu(
+            engine_frame,
+            values=["thread", "asyncio"],
+            variable=self.var_proxy_engine,
+            command=lambda x: self.save_settings()
+        ).pack(side="left")
+        
+        ctk.CTkLabel(
+            engine_frame,
+            text="asyncio scales to thousands of connections (uses uvloop if installed; Linux/macOS only)",
+            font=("Roboto", 10),
+            text_color="gray"
+        ).pack(side="left", padx=10)
+        
         # Connection timeout
         timeout_frame = ctk.CTkFrame(general_frame, fg_color="transparent")
         timeout_frame.pack(fill="x", padx=20, pady=10)
@@ -2369,6 +6492,26 @@ class TunnelProApp(ctk.CTk):
             command=self.save_settings
         ).pack(anchor="w", padx=20, pady=5)
         
+        self.var_wan_per_channel = ctk.BooleanVar(
+            value=self.app_config.get("settings", {}).get("wan_bonding_per_channel", True)
+        )
+        ctk.CTkCheckBox(
+            wan_frame,
+            text="Stripe Channels Across Interfaces (one SSH transport per selected interface)",
+            variable=self.var_wan_per_channel,
+            command=self.save_settings
+        ).pack(anchor="w", padx=20, pady=5)
+        
+        self.var_mptcp = ctk.BooleanVar(
+            value=self.app_config.get("settings", {}).get("mptcp_enabled", False)
+        )
+        ctk.CTkCheckBox(
+            wan_frame,
+            text="Kernel MPTCP (Linux: one SSH connection, a subflow per interface, TCP fallback)",
+            variable=self.var_mptcp,
+            command=self.save_settings
+        ).pack(anchor="w", padx=20, pady=5)
+        
         # Load balancing mode
         lb_frame = ctk.CTkFrame(wan_frame, fg_color="transparent")
         lb_frame.pack(fill="x", padx=20, pady=10)
@@ -2384,7 +6527,7 @@ class TunnelProApp(ctk.CTk):
         )
         lb_menu = ctk.CTkOptionMenu(
             lb_frame,
-            values=["round_robin", "random", "fastest"],
+            values=list(NetworkInterfaceManager.MODES),
             variable=self.var_lb_mode,
             command=lambda x: self.save_settings()
         )
@@ -2396,6 +6539,7 @@ class TunnelProApp(ctk.CTk):
                  "• Select multiple interfaces in 'Network Monitor' tab\n"
                  "• Traffic will be distributed across selected interfaces\n"
                  "• Increases total bandwidth and provides redundancy\n"
+                 "• weighted / least_* / p2c use the per-interface weights set in 'Network Monitor'\n"
                  "• Enable WAN bonding first, then scan and select interfaces",
             font=("Roboto", 10),
             text_color="gray",
@@ -2645,8 +6789,21 @@ class TunnelProApp(ctk.CTk):
             settings["connection_timeout"] = int(self.ent_timeout.get())
             settings["theme"] = self.var_theme.get()
             settings["wan_bonding_enabled"] = self.var_wan_bonding.get()
+            settings["wan_bonding_per_channel"] = self.var_wan_per_channel.get()
+            settings["mptcp_enabled"] = self.var_mptcp.get()
             settings["load_balancing_mode"] = self.var_lb_mode.get()
             settings["dns_optimization"] = self.var_dns_optimization.get()
+            settings["dns_live_ranking"] = self.var_dns_live_ranking.get()
+            settings["proxy_engine"] = self.var_proxy_engine.get()
+            settings["socks_fast_open"] = self.var_fast_open.get()
+            settings["warm_channel_pool"] = self.var_warm_pool.get()
+            settings["dns_stub_enabled"] = self.var_dns_stub.get()
+            settings["network_profile_cache"] = self.var_network_profiles.get()
+            settings["ssh_transports_min"] = int(self.ent_transports_min.get())
+            settings["ssh_transports_max"] = int(self.ent_transports_max.get())
+            settings["channel_scheduler"] = self.var_channel_scheduler.get()
+            settings["channel_sticky"] = self.var_channel_sticky.get()
+            settings["dns_stub_port"] = int(self.ent_dns_stub_port.get())
             settings["reconnect_max_attempts"] = int(self.ent_max_attempts.get())
             settings["reconnect_initial_delay"] = int(self.ent_initial_delay.get())
             
@@ -2729,12 +6886,28 @@ class TunnelProApp(ctk.CTk):
         self.var_auto_reconnect.set(settings.get("auto_reconnect", True))
         self.var_log_traffic.set(settings.get("log_traffic", False))
         self.var_dns_optimization.set(settings.get("dns_optimization", True))
+        self.var_dns_live_ranking.set(settings.get("dns_live_ranking", True))
+        self.var_proxy_engine.set(settings.get("proxy_engine", "thread"))
+        self.var_fast_open.set(settings.get("socks_fast_open", False))
+        self.var_warm_pool.set(settings.get("warm_channel_pool", False))
+        self.var_dns_stub.set(settings.get("dns_stub_enabled", False))
+        self.var_network_profiles.set(settings.get("network_profile_cache", True))
+        self.ent_transports_min.delete(0, "end")
+        self.ent_transports_min.insert(0, str(settings.get("ssh_transports_min", 1)))
+        self.ent_transports_max.delete(0, "end")
+        self.ent_transports_max.insert(0, str(settings.get("ssh_transports_max", 1)))
+        self.var_channel_scheduler.set(settings.get("channel_scheduler", "p2c"))
+        self.var_channel_sticky.set(settings.get("channel_sticky", True))
+        self.ent_dns_stub_port.delete(0, "end")
+        self.ent_dns_stub_port.insert(0, str(settings.get("dns_stub_port", 5300)))
         
         self.ent_timeout.delete(0, "end")
         self.ent_timeout.insert(0, str(settings.get("connection_timeout", 10)))
         
         self.var_theme.set(settings.get("theme", "dark-blue"))
         self.var_wan_bonding.set(settings.get("wan_bonding_enabled", False))
+        self.var_wan_per_channel.set(settings.get("wan_bonding_per_channel", True))
+        self.var_mptcp.set(settings.get("mptcp_enabled", False))
         self.var_lb_mode.set(settings.get("load_balancing_mode", "round_robin"))
         
         self.ent_max_attempts.delete(0, "end")
@@ -2848,6 +7021,8 @@ class TunnelProApp(ctk.CTk):
         if "key_file" in server:
             self.ent_key_file.insert(0, server["key_file"])
         
+        self.var_remote_dns.set(server.get("remote_dns", False))
+        
         self.log(f"Loaded server configuration: {name}")
 
     def load_dns(self, name: str):
@@ -2866,6 +7041,10 @@ class TunnelProApp(ctk.CTk):
         self.ent_dns_2.delete(0, "end")
         self.ent_dns_2.insert(0, dns.get("secondary", ""))
         
+        self.var_dns_protocol.set(dns.get("protocol", "udp"))
+        self.ent_dns_url.delete(0, "end")
+        self.ent_dns_url.insert(0, dns.get("url", ""))
+        
         self.log(f"Loaded DNS preset: {name}")
 
     def save_server(self):
@@ -2884,7 +7063,8 @@ class TunnelProApp(ctk.CTk):
             "host": host,
             "port": self.ent_port.get(),
             "username": self.ent_user.get(),
-            "password": self.ent_pass.get()
+            "password": self.ent_pass.get(),
+            "remote_dns": self.var_remote_dns.get()
         }
         
         key_file = self.ent_key_file.get().strip()
@@ -2905,7 +7085,9 @@ class TunnelProApp(ctk.CTk):
         
         self.app_config["dns_presets"][name] = {
             "primary": self.ent_dns_1.get(),
-            "secondary": self.ent_dns_2.get()
+            "secondary": self.ent_dns_2.get(),
+            "protocol": self.var_dns_protocol.get(),
+            "url": self.ent_dns_url.get().strip()
         }
         
         self.save_config()
@@ -2989,12 +7171,19 @@ class TunnelProApp(ctk.CTk):
         """Scan and display network interfaces with selection checkboxes."""
         self.log("Scanning network interfaces...")
         
+        interfaces = self.iface_manager.scan_interfaces()
+        if interfaces:
+            self.log(f"Found {len(interfaces)} network interface(s)")
+        self.render_interfaces(interfaces)
+    
+    def render_interfaces(self, interfaces: List[Dict[str, Any]]):
+        """Show interfaces with selection checkboxes, weights and scores."""
+        self.iface_generation = self.iface_manager.generation
+        
         # Clear existing interface widgets
         for widget in self.scroll_interfaces.winfo_children():
             widget.destroy()
         
-        interfaces = self.iface_manager.scan_interfaces()
-        
         if not interfaces:
             ctk.CTkLabel(
                 self.scroll_interfaces,
@@ -3004,10 +7193,9 @@ class TunnelProApp(ctk.CTk):
             ).pack(pady=20)
             return
         
-        self.log(f"Found {len(interfaces)} network interface(s)")
-        
         # Store interface checkbox variables
         self.interface_vars = []
+        self.iface_score_labels = {}
         
         for idx, iface in enumerate(interfaces):
             frame = ctk.CTkFrame(self.scroll_interfaces)
@@ -3046,6 +7234,18 @@ class TunnelProApp(ctk.CTk):
                 text_color="#3498db"
             ).pack(side="left", padx=10)
             
+            # Static weight for the weighted / least-* / p2c modes
+            ent_weight = ctk.CTkEntry(header, width=50)
+            ent_weight.insert(0, f"{self.iface_manager.get_weight(iface['name']):g}")
+            ent_weight.pack(side="right")
+            ent_weight.bind("<Return>", lambda e, n=iface['name'], w=ent_weight: self.set_interface_weight(n, w))
+            ent_weight.bind("<FocusOut>", lambda e, n=iface['name'], w=ent_weight: self.set_interface_weight(n, w))
+            ctk.CTkLabel(
+                header,
+                text="Weight:",
+                font=("Roboto", 11)
+            ).pack(side="right", padx=5)
+            
             # Details
             details = ctk.CTkFrame(frame, fg_color="transparent")
             details.pack(fill="x", padx=15, pady=(0, 10))
@@ -3060,6 +7260,17 @@ class TunnelProApp(ctk.CTk):
                 font=("Consolas", 11),
                 text_color="gray"
             ).pack(side="left")
+            
+            # Measured score and its recent history
+            score_label = ctk.CTkLabel(
+                frame,
+                text=self.format_interface_score(self.iface_manager.get_metrics().get(iface['name'])),
+                font=("Consolas", 11),
+                text_color="#2ecc71",
+                anchor="w"
+            )
+            score_label.pack(fill="x", padx=15, pady=(0, 10))
+            self.iface_score_labels[iface['name']] = score_label
         
         # Add "Select All" and "Deselect All" buttons
         button_frame = ctk.CTkFrame(self.scroll_interfaces, fg_color="transparent")
@@ -3092,6 +7303,38 @@ class TunnelProApp(ctk.CTk):
             text_color="#2ecc71" if selected_count > 0 else "gray"
         ).pack(side="left", padx=20)
     
+    @staticmethod
+    def format_interface_score(metrics: Optional[Dict[str, Any]]) -> str:
+        """One-line score summary with a sparkline of the score history."""
+        if not metrics or metrics["score"] is None:
+            return "Score: not measured yet"
+        history = [score for _, score in metrics["history"][-30:]]
+        sparkline = ""
+        if history:
+            low, high = min(history), max(history)
+            blocks = "▁▂▃▄▅▆▇█"
+            sparkline = "".join(blocks[int((score - low) / (high - low) * 7) if high > low else 3] for score in history)
+        return (f"Score: {metrics['score']:.1f} | RTT {metrics['rtt_ms']:.1f} ms | "
+                f"{metrics['throughput'] * 8 / 1e6:.1f} Mbps | loss {metrics['loss'] * 100:.1f}% | "
+                f"fail {metrics['failure'] * 100:.0f}%  {sparkline}")
+
+    def set_interface_weight(self, name: str, entry):
+        """Apply and save the weight typed for an interface."""
+        try:
+            weight = float(entry.get())
+            if not math.isfinite(weight) or weight < 0:
+                raise ValueError
+        except ValueError:
+            entry.delete(0, "end")
+            entry.insert(0, f"{self.iface_manager.get_weight(name):g}")
+            return
+        if weight == self.iface_manager.get_weight(name):
+            return
+        self.iface_manager.set_weight(name, weight)
+        self.app_config["settings"].setdefault("interface_weights", {})[name] = weight
+        self.save_config()
+        self.log(f"Interface {name} weight set to {weight:g}")
+
     def toggle_interface_selection(self, idx, var):
         """Toggle interface selection for WAN bonding."""
         if idx < len(self.iface_manager.interfaces):
@@ -3148,7 +7391,8 @@ class TunnelProApp(ctk.CTk):
                     "host": self.ent_host.get().strip(),
                     "port": self.ent_port.get().strip(),
                     "username": self.ent_user.get().strip(),
-                    "password": self.ent_pass.get()
+                    "password": self.ent_pass.get(),
+                    "remote_dns": self.var_remote_dns.get()
                 }
                 
                 key_file = self.ent_key_file.get().strip()
@@ -3182,16 +7426,42 @@ class TunnelProApp(ctk.CTk):
                     "local_port": self.ent_local_port.get().strip(),
                     "dns_primary": self.ent_dns_1.get().strip(),
                     "dns_secondary": self.ent_dns_2.get().strip(),
+                    "dns_protocol": self.var_dns_protocol.get(),
+                    "dns_url": self.ent_dns_url.get().strip(),
+                    "dns_fallback_enabled": self.app_config.get("settings", {}).get("dns_fallback_enabled", True),
+                    "dns_fallback_list": self.app_config.get("settings", {}).get("dns_fallback_list", ["8.8.8.8", "1.1.1.1", "9.9.9.9"]),
+                    "dns_timeout": self.app_config.get("settings", {}).get("dns_timeout", 5),
                     "auto_reconnect": self.app_config.get("settings", {}).get("auto_reconnect", True),
                     "connection_timeout": self.app_config.get("settings", {}).get("connection_timeout", 10),
                     "log_traffic": self.app_config.get("settings", {}).get("log_traffic", False),
                     "wan_bonding_enabled": self.app_config.get("settings", {}).get("wan_bonding_enabled", False),
+                    "wan_bonding_per_channel": self.app_config.get("settings", {}).get("wan_bonding_per_channel", True),
+                    "mptcp_enabled": self.app_config.get("settings", {}).get("mptcp_enabled", False),
                     "load_balancing_mode": self.app_config.get("settings", {}).get("load_balancing_mode", "round_robin"),
                     "max_threads": self.app_config.get("settings", {}).get("max_threads", 100),
                     "dns_test_rounds": self.app_config.get("settings", {}).get("dns_test_rounds", 3),
                     "dns_optimization": self.app_config.get("settings", {}).get("dns_optimization", True),
                     "reconnect_max_attempts": self.app_config.get("settings", {}).get("reconnect_max_attempts", 5),
-                    "reconnect_initial_delay": self.app_config.get("settings", {}).get("reconnect_initial_delay", 5)
+                    "reconnect_initial_delay": self.app_config.get("settings", {}).get("reconnect_initial_delay", 5),
+                    "proxy_engine": self.app_config.get("settings", {}).get("proxy_engine", "thread"),
+                    "relay_high_watermark": self.app_config.get("settings", {}).get("relay_high_watermark", 262144),
+                    "relay_low_watermark": self.app_config.get("settings", {}).get("relay_low_watermark", 65536),
+                    "socks_fast_open": self.app_config.get("settings", {}).get("socks_fast_open", False),
+                    "warm_channel_pool": self.app_config.get("settings", {}).get("warm_channel_pool", False),
+                    "warm_pool_max_channels": self.app_config.get("settings", {}).get("warm_pool_max_channels", 32),
+                    "dns_persistent_cache": self.app_config.get("settings", {}).get("dns_persistent_cache", True),
+                    "dns_custom_servers": self.app_config.get("settings", {}).get("dns_custom_servers", []),
+                    "dns_live_ranking": self.app_config.get("settings", {}).get("dns_live_ranking", True),
+                    "dns_stub_enabled": self.app_config.get("settings", {}).get("dns_stub_enabled", False),
+                    "dns_stub_port": self.app_config.get("settings", {}).get("dns_stub_port", 5300),
+                    "dns_stub_upstream": self.app_config.get("settings", {}).get("dns_stub_upstream", "1.1.1.1"),
+                    "network_profile_cache": self.app_config.get("settings", {}).get("network_profile_cache", True),
+                    "interface_probe_target": self.app_config.get("settings", {}).get("interface_probe_target", ""),
+                    "ssh_transports_min": self.app_config.get("settings", {}).get("ssh_transports_min", 1),
+                    "ssh_transports_max": self.app_config.get("settings", {}).get("ssh_transports_max", 1),
+                    "ssh_channels_per_transport": self.app_config.get("settings", {}).get("ssh_channels_per_transport", 16),
+                    "channel_scheduler": self.app_config.get("settings", {}).get("channel_scheduler", "p2c"),
+                    "channel_sticky": self.app_config.get("settings", {}).get("channel_sticky", True)
                 }
                 
                 # Start proxy thread
@@ -3341,6 +7611,58 @@ class TunnelProApp(ctk.CTk):
                     rate = (stats["connections_total"] / stats["uptime"]) * 60
                     self.lbl_conn_rate.configure(text=f"Rate: {rate:.1f}/min")
                 
+                # Time to first byte per SOCKS reply mode
+                ttfb_parts = []
+                if stats["ttfb_fast_open_ms"] is not None:
+                    ttfb_parts.append(f"{stats['ttfb_fast_open_ms']:.0f} ms fast open")
+                if stats["ttfb_standard_ms"] is not None:
+                    ttfb_parts.append(f"{stats['ttfb_standard_ms']:.0f} ms standard")
+                self.lbl_ttfb.configure(text=f"TTFB: {' | '.join(ttfb_parts) or '--'}")
+                
+                # DNS cache effectiveness
+                if self.proxy_thread and self.proxy_thread.is_alive():
+                    dns_stats = self.proxy_thread.dns_cache.get_stats()
+                    self.lbl_dns_cache.configure(
+                        text=f"DNS Cache: {dns_stats['hit_rate']:.0f}% hits, {dns_stats['entries']} names, "
+                             f"{dns_stats['avg_lookup_ms']:.0f} ms/lookup"
+                    )
+                    pool_stats = self.proxy_thread.transport_pool.get_stats()
+                    decisions = ", ".join(f"{reason} {count}" for reason, count in pool_stats["decisions"].items())
+                    self.lbl_transports.configure(
+                        text=f"SSH Transports: {pool_stats['transports']} "
+                             f"({'/'.join(str(count) for count in pool_stats['channels'])} channels, "
+                             f"{'/'.join(str(row['outstanding'] // 1024) for row in pool_stats['per_transport'])} KB in flight)"
+                             + (f"\nScheduler: {decisions}" if decisions else "")
+                    )
+                
+                # Interface list changed under us (link up/down, new address): redraw it
+                if getattr(self, "iface_generation", None) not in (None, self.iface_manager.generation):
+                    self.iface_generation = self.iface_manager.generation
+                    self.after(0, lambda: self.render_interfaces(self.iface_manager.interfaces))
+                
+                # Live interface scores in the Network Monitor list
+                if getattr(self, "iface_score_labels", None):
+                    iface_metrics = self.iface_manager.get_metrics()
+                    for name, label in self.iface_score_labels.items():
+                        label.configure(text=self.format_interface_score(iface_metrics.get(name)))
+                
+                # Bytes carried by each bonded interface
+                if stats["interfaces"]:
+                    self.lbl_iface_traffic.configure(text="Tunnel traffic per interface:\n" + "\n".join(
+                        f"{name}: ↑ {TrafficStats.format_bytes(counts['sent'])}  ↓ {TrafficStats.format_bytes(counts['received'])}"
+                        for name, counts in sorted(stats["interfaces"].items())
+                    ))
+                
+                # MPTCP subflows of the SSH connection
+                mptcp = self.proxy_thread.get_mptcp_stats() if self.proxy_thread else None
+                if mptcp:
+                    self.lbl_mptcp.configure(text=f"MPTCP: {len(mptcp['subflows'])} subflow(s)\n" + "\n".join(
+                        f"{subflow['interface'] or subflow['local'][0]} → {subflow['remote'][0]}: "
+                        f"RTT {subflow['rtt_ms']:.1f} ms  ↑ {TrafficStats.format_bytes(subflow['bytes_acked'])}  "
+                        f"↓ {TrafficStats.format_bytes(subflow['bytes_received'])}  retrans {subflow['total_retrans']}"
+                        for subflow in mptcp["subflows"]
+                    ))
+                
                 # Uptime
                 uptime = self.format_uptime(stats["uptime"])
                 self.lbl_uptime.configure(text=f"Uptime: {uptime}")
@@ -3432,6 +7754,14 @@ class TunnelProApp(ctk.CTk):
                 except:
                     test_rounds = 3
                 
+                custom_lines = [
+                    line.strip() for line in self.txt_dns_custom_servers.get("1.0", "end").splitlines() if line.strip()
+                ]
+                self.app_config.setdefault("settings", {})["dns_custom_servers"] = custom_lines
+                self.save_config()
+                
+                self.dns_tester.servers = dict(DNSTester.DNS_SERVERS)
+                self.dns_tester.servers.update(DNSTester.parse_server_list(custom_lines))
                 self.dns_tester.target_host = domain
                 self.dns_tester.test_rounds = test_rounds
                 
@@ -3446,15 +7776,19 @@ class TunnelProApp(ctk.CTk):
                     # Show best result
                     best_text = f"✓ BEST DNS: {result['name']}\n"
                     best_text += f"  IP Address: {result['ip']}\n"
-                    best_text += f"  Average Response Time: {result['avg_time']:.2f} ms\n\n"
+                    best_text += f"  Median Response Time: {result['median']:.2f} ms "
+                    best_text += f"(p90 {result['p90']:.2f} ms, jitter {result['jitter']:.2f} ms)\n\n"
                     
                     self.dns_results_text.insert("end", best_text)
                     self.dns_results_text.insert("end", "All Test Results:\n")
-                    self.dns_results_text.insert("end", "-" * 60 + "\n")
+                    self.dns_results_text.insert("end", f"{'Name':<25} {'IP':<15} {'Median':>9} {'p90':>9} {'Jitter':>8}\n")
+                    self.dns_results_text.insert("end", "-" * 75 + "\n")
                     
                     # Show all results
                     for name, dns_result in result.get("all_results", {}).items():
-                        line = f"{name:<25} {dns_result['ip']:<15} {dns_result['avg_time']:>6.2f} ms ({dns_result['success_rate']:.0f}%)\n"
+                        line = (f"{name:<25} {dns_result['ip']:<15} {dns_result['median']:>6.2f} ms "
+                                f"{dns_result['p90']:>6.2f} ms {dns_result['jitter']:>5.2f} ms "
+                                f"({dns_result['success_rate']:.0f}%)\n")
                         self.dns_results_text.insert("end", line)
                     
                     # Enable apply button
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""Benchmark UDP / DoT / DoH resolver backends against a local stand-in server.
+
+Usage: python benchmarks/dns_backends.py [--queries 500] [--concurrency 16]
+"""
+
+import argparse
+import datetime
+import os
+import socket
+import socketserver
+import ssl
+import struct
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import dns.message
+import dns.rrset
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Integrated_Edition import DNSTester, DoHClient, DoTClient  # noqa: E402
+
+ANSWER_IP = "192.0.2.1"
+
+
+def answer(wire: bytes) -> bytes:
+    """Answer every question with a fixed A record."""
+    query = dns.message.from_wire(wire)
+    response = dns.message.make_response(query)
+    question = query.question[0]
+    response.answer.append(dns.rrset.from_text(question.name, 60, 'IN', 'A', ANSWER_IP))
+    return response.to_wire()
+
+
+def make_certificate(directory: str):
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder()
+            .subject_name(name).issuer_name(name)
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(minutes=1))
+            .not_valid_after(now + datetime.timedelta(days=1))
+            .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost")]), critical=False)
+            .sign(key, hashes.SHA256()))
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    return cert_path, key_path
+
+
+class UDPHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        data, sock = self.request
+        sock.sendto(answer(data), self.client_address)
+
+
+class DoTHandler(socketserver.BaseRequestHandler):
+    """RFC 7858: length-prefixed messages, answered in order, connection kept open."""
+
+    def handle(self):
+        stream = self.request.makefile('rb')
+        while True:
+            header = stream.read(2)
+            if len(header) < 2:
+                return
+            wire = stream.read(struct.unpack('!H', header)[0])
+            response = answer(wire)
+            self.request.sendall(struct.pack('!H', len(response)) + response)
+
+
+class DoTServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, context):
+        self.context = context
+        super().__init__(address, DoTHandler)
+
+    def get_request(self):
+        sock, addr = super().get_request()
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return self.context.wrap_socket(sock, server_side=True), addr
+
+
+class DoHHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        wire = self.rfile.read(int(self.headers["Content-Length"]))
+        body = answer(wire)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/dns-message")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    cert_path, key_path = make_certificate(tempfile.mkdtemp())
+    server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    server_context.load_cert_chain(cert_path, key_path)
+    client_context = ssl.create_default_context(cafile=cert_path)
+
+    socketserver.ThreadingUDPServer.daemon_threads = True
+    udp_port = start(socketserver.ThreadingUDPServer(("127.0.0.1", 0), UDPHandler))
+    dot_port = start(DoTServer(("127.0.0.1", 0), server_context))
+    doh_server = ThreadingHTTPServer(("127.0.0.1", 0), DoHHandler)
+    doh_server.daemon_threads = True
+    doh_server.socket = server_context.wrap_socket(doh_server.socket, server_side=True)
+    doh_port = start(doh_server)
+
+    dot = DoTClient("127.0.0.1", "localhost", dot_port, ssl_context=client_context)
+    doh = DoHClient(f"https://localhost:{doh_port}/dns-query", pool_size=args.concurrency, verify=cert_path)
+
+    def dot_no_reuse(wire: bytes) -> bytes:
+        # Baseline: a fresh TCP + TLS handshake for every lookup
+        with socket.create_connection(("127.0.0.1", dot_port), timeout=5) as raw:
+            with client_context.wrap_socket(raw, server_hostname="localhost") as tls:
+                tls.sendall(struct.pack('!H', len(wire)) + wire)
+                stream = tls.makefile('rb')
+                return stream.read(struct.unpack('!H', stream.read(2))[0])
+
+    backends = {
+        "udp": lambda wire: DNSTester.udp_exchange(wire, "127.0.0.1", udp_port),
+        "dot (pooled, pipelined)": dot.query,
+        "dot (handshake per query)": dot_no_reuse,
+        "doh (keep-alive)" if doh.client is None else "doh (http/2)": doh.query,
+    }
+
+    tester = DNSTester("example.com")
+    results = tester.benchmark_backends(backends, args.queries, args.concurrency)
+    print(f"{'backend':<28}{'ok':>7}{'median ms':>11}{'p90 ms':>9}{'qps':>9}")
+    for name, stats in results.items():
+        print(f"{name:<28}{stats['success_rate']:>6.0f}%{stats.get('median', 0):>11.2f}"
+              f"{stats.get('p90', 0):>9.2f}{stats['qps']:>9.0f}")
+
+    dot.close()
+    doh.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Simulate heterogeneous WAN links and report how evenly each load balancing mode loads them.
+
+Flows arrive as a Poisson process with heavy-tailed sizes; every link shares its capacity
+equally among its active flows. Each new flow goes to the interface NetworkInterfaceManager
+picks, given the live per-link loads. Weights are the link capacities, as a user would set them.
+
+Usage: python benchmarks/interface_balancing.py [--flows 20000] [--load 0.7] [--seed 1]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Integrated_Edition import NetworkInterfaceManager  # noqa: E402
+
+# name, capacity (Mbps), round-trip time (ms)
+LINKS = [
+    ("fiber", 100, 8),
+    ("wifi", 40, 15),
+    ("lte", 20, 55),
+    ("adsl", 8, 30),
+]
+MEAN_FLOW_BYTES = 1_000_000
+
+
+def flow_size(rng: random.Random) -> float:
+    """Pareto sizes (alpha 1.3): mostly small flows, a few elephants."""
+    alpha = 1.3
+    scale = MEAN_FLOW_BYTES * (alpha - 1) / alpha
+    return min(scale / (1 - rng.random()) ** (1 / alpha), 200 * MEAN_FLOW_BYTES)
+
+
+def simulate(mode: str, flows: int, load: float, seed: int):
+    rng = random.Random(seed)
+    random.seed(seed)
+    manager = NetworkInterfaceManager()
+    manager.selected_interfaces = [{"name": name, "ip": "0.0.0.0", "type": "sim", "speed": mbps}
+                                   for name, mbps, _ in LINKS]
+    capacity = {name: mbps * 1e6 / 8 for name, mbps, _ in LINKS}
+    rtt = {name: ms / 1000 for name, _, ms in LINKS}
+    for name, mbps, ms in LINKS:
+        manager.set_weight(name, mbps)
+        # What InterfaceScorer would have measured, so "fastest" has something to go on
+        manager.record_rtt(name, ms)
+        manager.record_throughput(name, capacity[name])
+
+    arrival_rate = load * sum(capacity.values()) / MEAN_FLOW_BYTES
+    active = {name: [] for name in capacity}  # [remaining bytes, arrival time]
+    served = {name: 0.0 for name in capacity}
+    assigned = {name: 0 for name in capacity}
+    completions = []
+    now = 0.0
+    next_arrival = rng.expovariate(arrival_rate)
+    arrived = 0
+
+    def advance(until: float):
+        dt = until - now
+        for name, running in active.items():
+            if running:
+                share = capacity[name] / len(running) * dt
+                for flow in running:
+                    flow[0] -= share
+                served[name] += capacity[name] * dt
+
+    while arrived < flows or any(active.values()):
+        # Earliest flow completion across all links
+        finish_at, finish_link = float("inf"), None
+        for name, running in active.items():
+            if running:
+                t = now + min(flow[0] for flow in running) * len(running) / capacity[name]
+                if t < finish_at:
+                    finish_at, finish_link = t, name
+        if arrived < flows and next_arrival < finish_at:
+            advance(next_arrival)
+            now = next_arrival
+            loads = {name: {"connections": len(running), "outstanding": sum(flow[0] for flow in running)}
+                     for name, running in active.items()}
+            name = manager.get_next_interface(mode, loads)["name"]
+            active[name].append([flow_size(rng), now])
+            assigned[name] += 1
+            arrived += 1
+            next_arrival = now + rng.expovariate(arrival_rate)
+        else:
+            advance(finish_at)
+            now = finish_at
+            running = active[finish_link]
+            done = min(running, key=lambda flow: flow[0])
+            running.remove(done)
+            completions.append(now - done[1] + rtt[finish_link])
+
+    utilization = {name: served[name] / (capacity[name] * now) for name in capacity}
+    values = list(utilization.values())
+    # Jain's fairness index of per-link utilization: 1.0 = every link equally busy for its capacity
+    jain = sum(values) ** 2 / (len(values) * sum(v * v for v in values))
+    completions.sort()
+    return {
+        "utilization": utilization,
+        "assigned": assigned,
+        "jain": jain,
+        "fct_mean": statistics.fmean(completions),
+        "fct_p99": completions[int(len(completions) * 0.99)],
+        "duration": now,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--flows", type=int, default=20000)
+    parser.add_argument("--load", type=float, default=0.7, help="offered load as a share of total capacity")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--modes", nargs="*", default=list(NetworkInterfaceManager.MODES))
+    args = parser.parse_args()
+
+    print("links: " + ", ".join(f"{name} {mbps} Mbps/{ms} ms" for name, mbps, ms in LINKS)
+          + f"; offered load {args.load:.0%}, {args.flows} flows\n")
+    header = "".join(f"{name + ' util':>12}" for name, _, _ in LINKS)
+    print(f"{'mode':<19}{header}{'jain':>7}{'fct ms':>9}{'p99 ms':>9}")
+    for mode in args.modes:
+        result = simulate(mode, args.flows, args.load, args.seed)
+        utils = "".join(f"{result['utilization'][name]:>12.0%}" for name, _, _ in LINKS)
+        print(f"{mode:<19}{utils}{result['jain']:>7.3f}{result['fct_mean'] * 1000:>9.0f}"
+              f"{result['fct_p99'] * 1000:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""Compare kernel MPTCP with userspace bonding over two shaped links between network namespaces.
+
+Needs root, iproute2 and Linux with net.mptcp.enabled=1. Namespaces tp-cli and tp-srv are joined
+by one veth link per rate (shaped with tbf, plus netem delay where the kernel has it). The same
+upload then runs over:
+  - tcp (one link): a single TCP connection on the first link
+  - userspace bonding: one TCP connection bound to each link, each pulling the next chunk when it
+    has room, the way the transport pool stripes channels over per-interface transports
+  - mptcp: one MPTCP connection with a subflow endpoint per link (set up by MPTCPManager)
+The namespaces are deleted afterwards.
+
+Usage: sudo python benchmarks/mptcp_bonding.py [--size-mb 64] [--rates 40,20] [--delays 10,30]
+"""
+
+import argparse
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Integrated_Edition import IPPROTO_MPTCP, MPTCPManager  # noqa: E402
+
+CLIENT_NS = "tp-cli"
+SERVER_NS = "tp-srv"
+SERVER_IP = "10.90.100.1"
+PORT = 5201
+CHUNK = 256 * 1024
+
+
+def sh(*args: str, check=True) -> subprocess.CompletedProcess:
+    return subprocess.run(args, check=check, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+
+def link_ips(index: int):
+    return f"10.90.{index}.1", f"10.90.{index}.2"
+
+
+def setup(rates, delays) -> bool:
+    """Namespaces, one shaped veth link per rate, and source routing so each link is its own path.
+    
+    Returns False if the delays could not be applied (no netem).
+    """
+    teardown()
+    sh("ip", "netns", "add", CLIENT_NS)
+    sh("ip", "netns", "add", SERVER_NS)
+    for ns in (CLIENT_NS, SERVER_NS):
+        sh("ip", "-n", ns, "link", "set", "lo", "up")
+        sh("ip", "-n", ns, "mptcp", "limits", "set", "subflows", "4", "add_addr_accepted", "4")
+    sh("ip", "-n", SERVER_NS, "addr", "add", f"{SERVER_IP}/32", "dev", "lo")
+    netem = True
+    for index, (rate, delay) in enumerate(zip(rates, delays)):
+        client_dev, server_dev = f"tpc{index}", f"tps{index}"
+        client_ip, server_ip = link_ips(index)
+        sh("ip", "link", "add", client_dev, "netns", CLIENT_NS, "type", "veth",
+           "peer", "name", server_dev, "netns", SERVER_NS)
+        sh("ip", "-n", CLIENT_NS, "addr", "add", f"{client_ip}/24", "dev", client_dev)
+        sh("ip", "-n", SERVER_NS, "addr", "add", f"{server_ip}/24", "dev", server_dev)
+        sh("ip", "-n", CLIENT_NS, "link", "set", client_dev, "up")
+        sh("ip", "-n", SERVER_NS, "link", "set", server_dev, "up")
+        # Traffic from this link's address leaves through this link
+        table = str(100 + index)
+        sh("ip", "-n", CLIENT_NS, "rule", "add", "from", client_ip, "table", table)
+        sh("ip", "-n", CLIENT_NS, "route", "add", SERVER_IP, "via", server_ip, "dev", client_dev, "table", table)
+        if index == 0:
+            sh("ip", "-n", CLIENT_NS, "route", "add", SERVER_IP, "via", server_ip, "dev", client_dev)
+        # Upload direction is shaped: delay (if netem exists) with the rate limit below it
+        tc = ["ip", "netns", "exec", CLIENT_NS, "tc", "qdisc", "add", "dev", client_dev]
+        parent = ["root"]
+        if netem and delay and sh(*tc, "root", "handle", "1:", "netem", "delay", f"{delay}ms", check=False).returncode == 0:
+            parent = ["parent", "1:1"]
+        elif delay:
+            netem = False
+        sh(*tc, *parent, "tbf", "rate", f"{rate}mbit", "burst", "64kbit", "latency", "400ms")
+    return netem
+
+
+def teardown():
+    for ns in (CLIENT_NS, SERVER_NS):
+        sh("ip", "netns", "del", ns, check=False)
+
+
+def serve():
+    """Sink: read each connection to EOF and answer with the byte count (MPTCP listener, accepts TCP too)."""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM, IPPROTO_MPTCP)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("0.0.0.0", PORT))
+    listener.listen(16)
+
+    def sink(conn):
+        total = 0
+        with conn:
+            while True:
+                data = conn.recv(1 << 20)
+                if not data:
+                    break
+                total += len(data)
+            conn.sendall(struct.pack("!Q", total))
+
+    print("ready", flush=True)
+    while True:
+        conn, _ = listener.accept()
+        threading.Thread(target=sink, args=(conn,), daemon=True).start()
+
+
+def finish(sock: socket.socket) -> int:
+    sock.shutdown(socket.SHUT_WR)
+    reply = b""
+    while len(reply) < 8:
+        data = sock.recv(8 - len(reply))
+        if not data:
+            break
+        reply += data
+    return struct.unpack("!Q", reply)[0] if len(reply) == 8 else 0
+
+
+def upload_single(size: int, source: str) -> int:
+    with socket.socket() as sock:
+        sock.bind((source, 0))
+        sock.connect((SERVER_IP, PORT))
+        payload = memoryview(bytes(CHUNK))
+        sent = 0
+        while sent < size:
+            sock.sendall(payload[:min(CHUNK, size - sent)])
+            sent += min(CHUNK, size - sent)
+        return finish(sock)
+
+
+def upload_bonded(size: int, sources) -> int:
+    chunks = [min(CHUNK, size - offset) for offset in range(0, size, CHUNK)]
+    lock = threading.Lock()
+    received = []
+    payload = memoryview(bytes(CHUNK))
+
+    def worker(source):
+        with socket.socket() as sock:
+            sock.bind((source, 0))
+            sock.connect((SERVER_IP, PORT))
+            while True:
+                with lock:
+                    if not chunks:
+                        break
+                    length = chunks.pop()
+                sock.sendall(payload[:length])
+            received.append(finish(sock))
+
+    threads = [threading.Thread(target=worker, args=(source,)) for source in sources]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(received)
+
+
+def upload_mptcp(size: int, interfaces) -> int:
+    manager = MPTCPManager()
+    for error in manager.configure_endpoints(interfaces):
+        print(f"endpoint: {error}")
+    try:
+        sock, _ = manager.create_socket()
+        with sock:
+            sock.bind((interfaces[0]["ip"], 0))
+            sock.connect((SERVER_IP, PORT))
+            if MPTCPManager.info(sock) is None:
+                print("note: MPTCP fell back to TCP")
+            payload = memoryview(bytes(CHUNK))
+            sent = 0
+            while sent < size:
+                sock.sendall(payload[:min(CHUNK, size - sent)])
+                sent += min(CHUNK, size - sent)
+            subflows = manager.subflows(sock)
+            received = finish(sock)
+        for subflow in subflows:
+            print(f"  subflow {subflow['local'][0]} -> {subflow['remote'][0]}: "
+                  f"{subflow['bytes_acked'] / 1e6:.1f} MB acked, rtt {subflow['rtt_ms']:.1f} ms, "
+                  f"{subflow['total_retrans']} retransmits")
+        return received
+    finally:
+        manager.remove_endpoints()
+
+
+def client(size: int, links: int):
+    sources = [link_ips(index)[0] for index in range(links)]
+    interfaces = [{"name": f"tpc{index}", "ip": source} for index, source in enumerate(sources)]
+    runs = [
+        ("tcp (one link)", lambda: upload_single(size, sources[0])),
+        ("userspace bonding", lambda: upload_bonded(size, sources)),
+        ("mptcp", lambda: upload_mptcp(size, interfaces)),
+    ]
+    results = []
+    for name, run in runs:
+        start = time.perf_counter()
+        received = run()
+        elapsed = time.perf_counter() - start
+        results.append((name, received, elapsed))
+    print(f"\n{'mode':<20}{'MB':>8}{'seconds':>10}{'Mbit/s':>9}")
+    for name, received, elapsed in results:
+        print(f"{name:<20}{received / 1e6:>8.1f}{elapsed:>10.2f}{received * 8 / elapsed / 1e6:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=float, default=64)
+    parser.add_argument("--rates", default="40,20", help="link rates in Mbit/s")
+    parser.add_argument("--delays", default="10,30", help="link one-way delays in ms (needs netem)")
+    parser.add_argument("--role", choices=["server", "client"], help=argparse.SUPPRESS)
+    parser.add_argument("--links", type=int, default=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.role == "server":
+        serve()
+        return
+    if args.role == "client":
+        client(int(args.size_mb * 1e6), args.links)
+        return
+
+    if os.geteuid() != 0:
+        sys.exit("needs root (network namespaces)")
+    if not MPTCPManager.supported():
+        sys.exit("MPTCP is not enabled (sysctl net.mptcp.enabled=1)")
+    rates = [int(rate) for rate in args.rates.split(",")]
+    delays = [int(delay) for delay in args.delays.split(",")]
+    delays += [0] * (len(rates) - len(delays))
+    script = os.path.abspath(__file__)
+    if not setup(rates, delays):
+        print("note: netem is not available, links differ in rate only")
+        delays = [0] * len(rates)
+    server = subprocess.Popen(["ip", "netns", "exec", SERVER_NS, sys.executable, script, "--role", "server"],
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        server.stdout.readline()
+        print("links: " + ", ".join(f"{rate} Mbit/s" + (f" {delay} ms" if delay else "")
+                                     for rate, delay in zip(rates, delays)), flush=True)
+        subprocess.run(["ip", "netns", "exec", CLIENT_NS, sys.executable, script, "--role", "client",
+                        "--size-mb", str(args.size_mb), "--links", str(len(rates))], check=True)
+    finally:
+        server.kill()
+        teardown()
+
+
+if __name__ == "__main__":
+    main()